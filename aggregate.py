@@ -0,0 +1,156 @@
+import heapq
+import json
+from bisect import bisect_left
+
+# Summaries built up one result at a time, as the solver hands them over, instead of sorting the whole list at the end.
+# Only the best k rows of each ranking are ever kept, so memory doesn't grow with the number of options, and the
+# summaries are there to look at halfway through a long run.
+
+
+def converged(result):
+    """False for the placeholder rows of options that didn't converge (everything set to 1e3)"""
+    return result[2][0] != 1e3
+
+
+class Ranked:
+    """Heap entry that sorts backwards, so the top of heapq's heap is the worst of the best k"""
+    __slots__ = ("key", "result")
+
+    def __init__(self, key, result):
+        self.key = key
+        self.result = result
+
+    def __lt__(self, other):
+        return self.key > other.key
+
+
+class TopK:
+    """The k results with the lowest value in column. Ties go to whichever option comes first in build_parameter_array
+    (smallest diameters, then pump letter), so it comes out the same as sorted(solutions, key=lambda x: x[column])[0:k]."""
+
+    def __init__(self, column, k):
+        self.column = column
+        self.k = k
+        self.heap = []
+
+    def add(self, result):
+        entry = Ranked((result[self.column], tuple(result[0]), result[1]), result)
+        if len(self.heap) < self.k:
+            heapq.heappush(self.heap, entry)
+        elif self.heap[0] < entry:
+            heapq.heapreplace(self.heap, entry)
+
+    def full(self):
+        return len(self.heap) == self.k
+
+    def worst(self):
+        """Value of the k-th best so far (the one next in line to be pushed out)"""
+        return self.heap[0].key[0]
+
+    def rows(self):
+        """The best k so far, best first"""
+        return [entry.result for entry in sorted(self.heap, reverse=True)]
+
+    def __len__(self):
+        return len(self.heap)
+
+
+class ParetoFront:
+    """Options nobody would pick over another one: every option on the front is cheaper to build than the ones after it,
+    and cheaper to run than the ones before it. Anything more expensive both ways than something on the front isn't on it.
+    Kept sorted by system cost (so operating cost only goes down along it), which makes adding an option a binary search
+    plus dropping whatever it beats, all of which come right after it (or have the same system cost).
+    Options that didn't converge never make it on."""
+
+    def __init__(self, system_column=3, operating_column=4):
+        self.system_column = system_column
+        self.operating_column = operating_column
+        self.system = []
+        self.operating = []
+        self.results = []
+
+    def add(self, result):
+        """Adds result if nothing on the front is at least as good both ways. Returns whether it made it on."""
+        if not converged(result):
+            return False
+        system, operating = result[self.system_column], result[self.operating_column]
+
+        # Everything before i is cheaper to build, and the last of them is the cheapest of those to run. There's at most
+        # one option with the same system cost already on the front, and it would be at i.
+        i = bisect_left(self.system, system)
+        if i > 0 and self.operating[i - 1] <= operating:
+            return False
+        if i < len(self.system) and self.system[i] == system and self.operating[i] <= operating:
+            return False
+
+        # Everything from i on costs at least as much to build, so whatever doesn't also cost less to run is beaten
+        j = i
+        while j < len(self.operating) and self.operating[j] >= operating:
+            j += 1
+        self.system[i:j] = [system]
+        self.operating[i:j] = [operating]
+        self.results[i:j] = [result]
+        return True
+
+    def rows(self):
+        """Every option on the front, cheapest to build first"""
+        return list(self.results)
+
+    def __len__(self):
+        return len(self.results)
+
+
+def pareto_front(results, system_column=3, operating_column=4):
+    """The same front as adding every result to a ParetoFront, for a whole list at once. Sorts by system cost, then
+    keeps each option that's cheaper to run than everything before it."""
+    front = []
+    cheapest_to_run = float("inf")
+    for result in sorted(filter(converged, results), key=lambda x: (x[system_column], x[operating_column])):
+        if result[operating_column] < cheapest_to_run:
+            front.append(result)
+            cheapest_to_run = result[operating_column]
+    return front
+
+
+def front_from_journal(path):
+    """Pareto front of every option in a results journal (see journal.py), read one line at a time so even millions of
+    options never need to be in memory at once. Later lines for the same option don't replace earlier ones here."""
+    front = ParetoFront()
+    with open(path, "r") as file:
+        for line in file:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if "error" not in entry:
+                front.add(entry["result"])
+    return front
+
+
+class Collector:
+    """Everything optimize_everything and parse_json summarize: the best k by system cost and by operating cost (or any
+    other columns), the Pareto front of the two, plus how many options went in and how many of them didn't converge."""
+
+    def __init__(self, k=5, columns=(3, 4)):
+        self.top = {column: TopK(column, k) for column in columns}
+        self.front = ParetoFront()
+        self.count = 0
+        self.not_converged = 0
+
+    def add(self, result):
+        self.count += 1
+        if not converged(result):
+            self.not_converged += 1
+        for top in self.top.values():
+            top.add(result)
+        self.front.add(result)
+
+    def rows(self, column):
+        return self.top[column].rows()
+
+    def progress(self):
+        """One line on how things look so far"""
+        text = f"{self.count - self.not_converged} of {self.count} converged"
+        if 3 in self.top and len(self.top[3]) and converged(self.top[3].rows()[0]):
+            text += f", cheapest system so far ${self.top[3].rows()[0][3]:.2f}"
+        return text
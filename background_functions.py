@@ -1,8 +1,10 @@
-from scipy.special import lambertw
+import numpy as np
 from numpy import pi
-from units import *
+from quantity import J, K, ft, gal, inch, kWh, lb, m, minute, mm, mol, month, psi, s
+from pumps import CATALOGUE
 
 # This module contains more trivial and low-level functions and variables that are constant throughout other functions.
+# Everything carries units (quantity.py), so mixing up dimensions anywhere raises instead of giving a wrong number.
 
 
 # From problem statement
@@ -17,6 +19,20 @@ epsilon = 0.0015 * mm
 
 grav = 9.81 * m / s ** 2
 
+# Units the solvers attach to plain numbers before calling the functions below. float_functions has the same names.
+flow_unit = gal / minute
+diameter_unit = inch
+
+
+def head_in_ft(head):
+    """Strips the units off a head, leaving a plain number of ft."""
+    return head.asNumber(ft)
+
+
+def flow_in_gpm(flow):
+    """Strips the units off a flowrate, leaving a plain number of gal/min."""
+    return flow.asNumber(flow_unit)
+
 gasconst = 8.31446261815324 * J / mol / K
 
 # KLs:
@@ -30,11 +46,16 @@ valve = 10
 
 # Friction and head loss finders
 
+# How many friction factors came from Haaland because Colebrook raised an error (see metrics.py)
+fallbacks = {"Haaland": 0}
+
+
 def friction(epsilon, diameter, Re):
     """Returns Darcy friction factor at given parameters.
     Tries the Colebrook equation first, then switches to Haaland if necessary."""
     if Re.asNumber() <= 2300:
-        return 64 / Re
+        # No flow means no friction (the design point cascade looks at each pipe with nothing flowing through it)
+        return 64 / Re if Re.asNumber() != 0 else 0
     try:
         return Colebrook(epsilon, diameter, Re)
     except Exception or RuntimeWarning as ex:
@@ -43,11 +64,14 @@ def friction(epsilon, diameter, Re):
         print(f"Diameter: {diameter}")
         print(f"Reynolds number: {Re}")
         print(ex)
+        fallbacks["Haaland"] += 1
         return Haaland(epsilon, diameter, Re)
 
 
 def Colebrook(epsilon, diameter, Re):
     """Returns the Darcy friction factor according to the Colebrook equation."""
+    # Imported here so the constants and units above don't cost a scipy import
+    from scipy.special import lambertw
     if Re.asNumber() == 0:
         return 0
     a = 2.51 / Re.asNumber()
@@ -213,17 +237,12 @@ def hl26(flow, d):
     return hLtotal(friction(epsilon, d, rhoWater * v * d / muWater), 4 * ft, d, [bend, sink], v) + 4 * ft
 
 
-# Pump curve functions
-def pump_curve_A(flow):
-    """Returns supplied head at that flow for pump A"""
-    return (60 - 0.03 / (gal / minute) ** 2 * flow ** 2) * ft
-
-
-def pump_curve_B(flow):
-    """Returns supplied head at that flow for pump B"""
-    return (40 - 0.02 / (gal / minute) ** 2 * flow ** 2) * ft
+def operating_cost(wattage):
+    """Monthly cost of running at the given wattage, assuming average 2023 US electricity price of 12.72 cents/kWh"""
+    return (wattage * (0.1272 / kWh) * (1 * month)).asNumber()
 
 
-def pump_curve_C(flow):
-    """Returns supplied head at that flow for pump C"""
-    return (20 - 0.01 / (gal / minute) ** 2 * flow ** 2) * ft
+# Pump curve function, from the catalogue in pumps.py
+def pump_curve(pump, flow):
+    """Returns supplied head at that flow for one pump of that type"""
+    return (CATALOGUE[pump].shutoff - CATALOGUE[pump].coefficient / flow_unit ** 2 * flow ** 2) * ft
@@ -0,0 +1,134 @@
+import numpy as np
+import network
+import pumps
+
+# Solves the operating point (the same 12 equations as solver_functions.head_losses) for many options at once.
+# Everything is stacked: row i of every array is one option. Each iteration is one damped Newton step for every option
+# that hasn't converged yet, using the stacked heads and Jacobians from network.py, so a whole sweep takes about as many
+# numpy calls as a single option does. Float kernel only.
+
+# Head (ft) the pumps need before any water moves: straight up to the highest fixture
+STATIC_HEAD = network.fixture_heads(np.zeros(network.NUMBER_OF_FIXTURES), [1] * 5).max()
+
+
+def residuals(flowrates, d, shutoff, coefficient, series, open_fixtures=None):
+    """The 11 loop residuals and the pump residual for every option, (N, 12) in ft.
+    With open_fixtures ((N, 12), True where a fixture is open), every open fixture's head has to match the pumps' and
+    every closed one's flow has to be 0 instead."""
+    heads = network.fixture_heads(flowrates, d)
+    total = flowrates.sum(axis=1)
+    pump_head = (shutoff - coefficient * total ** 2) * series
+    if open_fixtures is not None:
+        return np.where(open_fixtures, heads - pump_head[:, None], flowrates)
+    return np.column_stack([heads @ network.LOOP_MATRIX.T, heads[:, 0] - pump_head])
+
+
+def jacobians(flowrates, d, coefficient, series, open_fixtures=None):
+    """Derivatives of residuals with respect to the 12 flowrates, (N, 12, 12). The pump row picks up the slope of the
+    pump curve, since every flowrate adds to the total flow."""
+    heads_jacobian = network.fixture_heads_jacobian(flowrates, d)
+    total = flowrates.sum(axis=1)
+    pump_slope = (2 * coefficient * total * series)[:, None, None]
+    if open_fixtures is not None:
+        return np.where(open_fixtures[:, :, None], heads_jacobian + pump_slope, np.eye(flowrates.shape[1]))
+    pump_row = heads_jacobian[:, 0:1, :] + pump_slope
+    return np.concatenate([network.LOOP_MATRIX @ heads_jacobian, pump_row], axis=1)
+
+
+def operating_point_guess(design_flows, design_head, pump_types, series):
+    """Starting flows for the operating point: the design point flows (fl11 at 1 gpm) scaled up or down together.
+    Treats the system as STATIC_HEAD plus something going as flow^2 through the design point, and finds where that meets
+    series pumps' curve. Close enough that Newton rarely needs more than a few steps."""
+    design_flows = np.asarray(design_flows, dtype=float)
+    design_total = design_flows.sum(axis=1)
+    shutoff, coefficient = pumps.coefficients(pump_types)
+    system = (np.asarray(design_head) - STATIC_HEAD) / design_total ** 2
+    total = np.sqrt(np.maximum(series * shutoff - STATIC_HEAD, 1) / (system + series * coefficient))
+    return design_flows * (total / design_total)[:, None]
+
+
+def newton_steps(J, f):
+    """Solves J step = -f for every option at once. If any of the Jacobians is singular, goes one option at a time so
+    only those options get stuck (a zero step, flagged in the second array returned)."""
+    singular = np.zeros(len(f), dtype=bool)
+    try:
+        return -np.linalg.solve(J, f[..., None])[..., 0], singular
+    except np.linalg.LinAlgError:
+        step = np.zeros_like(f)
+        for i in range(len(f)):
+            try:
+                step[i] = -np.linalg.solve(J[i], f[i])
+            except np.linalg.LinAlgError:
+                singular[i] = True
+        return step, singular
+
+
+def solve_operating_points(guess, d, pump_types, series, tol=1e-10, ftol=1e-8, max_iterations=50, open_fixtures=None):
+    """Damped Newton on every option at once. guess is (N, 12) flowrates (gal/min), d is (N, 5) diameters (in),
+    pump_types is N pump types and series the number of pumps in series for each. pump_types can also be a
+    (shutoff, coefficient) pair of arrays, for curves that aren't in the catalogue (coefficient 0 is a fixed head).
+    Every step is cut in half until it actually brings the residuals down, and short enough that no flow drops below a
+    tenth of what it was. Options drop out as soon as their residuals are all within ftol (ft), or their step gets
+    smaller than tol (relative to their flows), which only counts as converged if the residuals are within 1000 ftol.
+    open_fixtures ((N, 12) booleans) turns off the fixtures where it's False, see residuals.
+    Returns the flowrates, which options converged (with every open fixture's flow at least 1 gpm, like
+    solver_functions requires), and how many iterations it took."""
+    flowrates = np.array(guess, dtype=float)
+    d = np.asarray(d, dtype=float)
+    series = np.asarray(series, dtype=float)
+    if isinstance(pump_types, tuple):
+        shutoff, coefficient = (np.asarray(x, dtype=float) for x in pump_types)
+    else:
+        shutoff, coefficient = pumps.coefficients(pump_types)
+    n = len(flowrates)
+    if open_fixtures is not None:
+        open_fixtures = np.asarray(open_fixtures, dtype=bool)
+
+    def pick(rows):
+        """Everything besides the flowrates for just those options"""
+        return d[rows], shutoff[rows], coefficient[rows], series[rows], \
+            None if open_fixtures is None else open_fixtures[rows]
+
+    active = np.arange(n)
+    converged = np.zeros(n, dtype=bool)
+    iterations = 0
+    while len(active) and iterations < max_iterations:
+        iterations += 1
+        q, rows = flowrates[active], pick(active)
+        f = residuals(q, *rows)
+        close = np.abs(f).max(axis=1) <= ftol
+        if close.any():
+            converged[active[close]] = True
+            active = active[~close]
+            if not len(active):
+                break
+            q, rows, f = q[~close], pick(active), f[~close]
+        dd, h0, a, s, o = rows
+        J = jacobians(q, dd, a, s, o)
+
+        step, singular = newton_steps(J, f)
+
+        # Damping: no flow may fall below a tenth of itself, then halve until the residuals go down.
+        # (Closed fixtures have no flow to protect, and their steps are only ever rounding error.)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            shrink = np.where((step < 0) & (q > 0), -0.9 * q / step, np.inf).min(axis=1)
+        alpha = np.minimum(1, shrink)
+        norm = (f ** 2).sum(axis=1)
+        for _ in range(30):
+            trial = q + alpha[:, None] * step
+            trial_norm = (residuals(trial, *rows) ** 2).sum(axis=1)
+            worse = ~(trial_norm < norm) & (alpha * np.abs(step).max(axis=1) > tol * q.max(axis=1))
+            if not worse.any():
+                break
+            alpha = np.where(worse, alpha / 2, alpha)
+
+        flowrates[active] = q + alpha[:, None] * step
+        done = np.abs(alpha[:, None] * step).max(axis=1) <= tol * q.max(axis=1)
+        stuck = singular | ~np.isfinite(flowrates[active]).all(axis=1)
+        if done.any():
+            close = np.abs(residuals(flowrates[active[done]], *pick(active[done]))).max(axis=1)
+            converged[active[done][close <= 1000 * ftol]] = True
+        active = active[~(done | stuck)]
+
+    converged &= ((flowrates >= 1) | (False if open_fixtures is None else ~open_fixtures)).all(axis=1)
+    return flowrates, converged, iterations
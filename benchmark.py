@@ -0,0 +1,417 @@
+import argparse
+import ast
+import json
+import os
+import platform
+import subprocess
+import sys
+import timeit
+from datetime import datetime
+from time import perf_counter as now
+import numpy as np
+import background_functions as bf
+import float_functions as ff
+import network
+import solver_functions
+from solver_functions import build_parameter_array
+from solver_functions import compute_cost_with_specifications as cost
+
+# Timing and solver-effort comparisons. Run this file directly to print them.
+# "python benchmark.py run" times the hot paths on their own and the whole sweep, checks the sweep still gives the
+# answers in raw_data.json, and adds both to HISTORY_FILE (one JSON object per line, one line per run).
+# It also times what every script imports before it gets going, each in a fresh interpreter, since that's paid again
+# by every run and every worker process.
+# "python benchmark.py compare" then fails if the latest run got slower than the one before, or gave different answers.
+
+HISTORY_FILE = "benchmarks.jsonl"
+
+# How much slower than before a benchmark has to get to count as a regression. Timings on a quiet machine wander by
+# a few percent, a busy one more.
+THRESHOLD = 1.25
+
+# Scripts whose start-up gets tracked (worker processes start the same way optimize_everything does)
+ENTRY_POINTS = ["optimize_everything", "parse_json", "simulate", "system_curves", "metrics", "benchmark"]
+
+
+def run_sweep(params, use_jacobian=True, use_warm_start=True):
+    """Solves every set of parameters on the float kernel, starting with no saved warm starts. Returns the results,
+    the wall time, and how many times fsolve called the residual and Jacobian functions."""
+    solver_functions.use_jacobian = use_jacobian
+    solver_functions.use_warm_start = use_warm_start
+    solver_functions.reset_warm_starts()
+    solver_functions.counters.update(residuals=0, jacobians=0, cascade=0, batch_iterations=0)
+    start = now()
+    results = [cost(param, fast=True) for param in params]
+    elapsed = now() - start
+    solver_functions.use_jacobian = True
+    solver_functions.use_warm_start = True
+    return results, elapsed, dict(solver_functions.counters)
+
+
+def count_per_option(params, use_warm_start=True):
+    """Like run_sweep, but returns residual and Jacobian calls for every option separately, along with the results"""
+    solver_functions.use_warm_start = use_warm_start
+    solver_functions.reset_warm_starts()
+    results, counts = [], []
+    for param in params:
+        solver_functions.counters.update(residuals=0, jacobians=0, cascade=0, batch_iterations=0)
+        results.append(cost(param, fast=True))
+        counts.append(dict(solver_functions.counters))
+    solver_functions.use_warm_start = True
+    return results, counts
+
+
+def same_results(first, second, rtol=1e-6):
+    """True if two sweeps gave the same numbers (pump counts, costs, flows, totals) for every configuration."""
+    for a, b in zip(first, second):
+        numbers_a = np.array(list(a[2]) + a[3:5] + list(a[5]) + a[6:8], dtype=float)
+        numbers_b = np.array(list(b[2]) + b[3:5] + list(b[5]) + b[6:8], dtype=float)
+        if not np.allclose(numbers_a, numbers_b, rtol=rtol):
+            return False
+    return True
+
+
+def jacobian_benchmark(params):
+    """Runs the sweep with fsolve estimating Jacobians by finite differences, then with the exact ones from
+    network.py, and prints residual evaluations and time per configuration for both."""
+    estimated, estimated_time, estimated_counts = run_sweep(params, use_jacobian=False)
+    exact, exact_time, exact_counts = run_sweep(params, use_jacobian=True)
+
+    n = len(params)
+    print(f"Jacobian benchmark over {n} configurations")
+    print(f"{'':<22}{'residual calls':>16}{'jacobian calls':>16}{'ms per config':>16}")
+    print(f"{'finite differences':<22}{estimated_counts['residuals'] / n:>16.1f}{estimated_counts['jacobians'] / n:>16.1f}"
+          f"{estimated_time / n * 1000:>16.2f}")
+    print(f"{'exact jacobian':<22}{exact_counts['residuals'] / n:>16.1f}{exact_counts['jacobians'] / n:>16.1f}"
+          f"{exact_time / n * 1000:>16.2f}")
+    print(f"Speedup: {estimated_time / exact_time:.2f}x, same answers: {same_results(estimated, exact)}")
+
+
+def warm_start_benchmark(params):
+    """Solves params in their usual order starting every solve from the fixed guesses, then in sweep_order starting
+    from the closest solution found so far. Prints residual and Jacobian calls (fsolve's hybrid method takes one
+    residual call per iteration) for options that converge both ways, and how many converge at all."""
+    cold, cold_counts = count_per_option(params, use_warm_start=False)
+    order = solver_functions.sweep_order(params)
+    warm_ordered, warm_ordered_counts = count_per_option([params[i] for i in order], use_warm_start=True)
+    warm, warm_counts = [None] * len(params), [None] * len(params)
+    for position, index in enumerate(order):
+        warm[index], warm_counts[index] = warm_ordered[position], warm_ordered_counts[position]
+
+    converged_cold = [result[2][0] != 1e3 for result in cold]
+    converged_warm = [result[2][0] != 1e3 for result in warm]
+    both = [i for i in range(len(params)) if converged_cold[i] and converged_warm[i]]
+
+    def total(counts, name, rows):
+        return sum(counts[i][name] for i in rows)
+
+    everything = range(len(params))
+    print(f"Warm start benchmark over {len(params)} configurations")
+    print(f"{'':<14}{'converged':>11}{'residuals, both converged':>28}{'jacobians, both converged':>28}"
+          f"{'residuals, all':>16}{'jacobians, all':>16}")
+    for name, counts, converged in [("cold starts", cold_counts, converged_cold), ("warm starts", warm_counts, converged_warm)]:
+        print(f"{name:<14}{sum(converged):>11}{total(counts, 'residuals', both):>28}{total(counts, 'jacobians', both):>28}"
+              f"{total(counts, 'residuals', everything):>16}{total(counts, 'jacobians', everything):>16}")
+    saved = total(cold_counts, 'residuals', both) - total(warm_counts, 'residuals', both)
+    print(f"Saved {saved} residual calls ({saved / total(cold_counts, 'residuals', both):.0%}) on the {len(both)} "
+          f"options both converge, same answers there: {same_results([cold[i] for i in both], [warm[i] for i in both])}")
+
+
+def design_point_benchmark(params):
+    """Times the pump stage (solve_pumps_required) over every option twice: solving the design point again for each
+    pump like it used to, then sharing one design point between the pumps for each set of diameters."""
+    times = []
+    for shared in [False, True]:
+        solver_functions.reset_warm_starts()
+        solver_functions.counters.update(residuals=0, jacobians=0, cascade=0, batch_iterations=0)
+        start = now()
+        for param in params:
+            if not shared:
+                solver_functions.design_points.clear()
+            solver_functions.solve_pumps_required(param[0:5], param[5], fast=True)
+        times.append((now() - start, solver_functions.counters["cascade"]))
+
+    print(f"Pump stage over {len(params)} configurations ({len(solver_functions.design_points)} sets of diameters)")
+    print(f"{'':<22}{'pipe heads':>16}{'per design point':>18}{'ms total':>12}")
+    for name, (elapsed, evaluations), solves in zip(["every pump", "shared"], times,
+                                                   [len(params), len(solver_functions.design_points)]):
+        print(f"{name:<22}{evaluations:>16}{evaluations / solves:>18.0f}{elapsed * 1000:>12.1f}")
+    print(f"Time saved: {1 - times[1][0] / times[0][0]:.0%}")
+
+
+def batched_benchmark(params, repeats=20):
+    """Times the sweep solving each operating point with its own fsolve (in sweep_order, with warm starts) against
+    solving them all together with compute_costs_batched. Then times the batched solve on params repeated, to see how it
+    does on a bigger sweep."""
+    order = solver_functions.sweep_order(params)
+    solver_functions.reset_warm_starts()
+    start = now()
+    one_by_one = [None] * len(params)
+    for index in order:
+        one_by_one[index] = cost(params[index], fast=True)
+    one_by_one_time = now() - start
+
+    solver_functions.reset_warm_starts()
+    solver_functions.counters.update(batch_iterations=0)
+    start = now()
+    batched = solver_functions.compute_costs_batched(params)
+    batched_time = now() - start
+    iterations = solver_functions.counters["batch_iterations"]
+
+    both = [i for i in range(len(params)) if one_by_one[i][2][0] != 1e3 and batched[i][2][0] != 1e3]
+    print(f"Batched benchmark over {len(params)} configurations")
+    print(f"{'':<14}{'converged':>11}{'ms total':>12}")
+    print(f"{'one by one':<14}{sum(r[2][0] != 1e3 for r in one_by_one):>11}{one_by_one_time * 1000:>12.1f}")
+    print(f"{'batched':<14}{sum(r[2][0] != 1e3 for r in batched):>11}{batched_time * 1000:>12.1f}")
+    print(f"{iterations} Newton iterations, same answers where both converge: "
+          f"{same_results([one_by_one[i] for i in both], [batched[i] for i in both])}")
+
+    # Design points are shared between repeats, so this is mostly the Newton iterations
+    bigger = params * repeats
+    solver_functions.counters.update(batch_iterations=0)
+    start = now()
+    solver_functions.compute_costs_batched(bigger)
+    print(f"{len(bigger)} configurations batched: {(now() - start) * 1000:.1f} ms, "
+          f"{solver_functions.counters['batch_iterations']} Newton iterations")
+
+
+def units_benchmark(repeats=5):
+    """What carrying units costs: the steps of one pipe's head loss (see background_functions.hl14) on Unum quantities
+    (units.py), on quantity.py's and on plain SI floats, then the whole pipe with and without units. Prints microseconds
+    per call."""
+    import quantity
+    import units
+
+    # Every unit in the same names, for all three
+    floats = {name: unit.value for name, unit in quantity.UNITS.items()}
+    systems = [("Unum", vars(units)), ("Quantity", quantity.UNITS), ("float", floats)]
+
+    def steps(u):
+        flow, d = 2.5 * u["gal"] / u["minute"], 0.75 * u["inch"]
+        rho, mu, g = 62.3 * u["lb"] / u["ft"] ** 3, 6.733e-4 * u["lb"] / u["ft"] / u["s"], 9.81 * u["m"] / u["s"] ** 2
+        length, v = 4 * u["ft"], flow / (np.pi / 4 * d ** 2)
+        f = 0.03
+        head = v ** 2 / 2 / g * (f * length / d + 20.9) + length
+        convert = (lambda: head.asNumber(u["ft"])) if hasattr(head, "asNumber") else lambda: head / u["ft"]
+        return [
+            ("attach units", lambda: 2.5 * u["gal"] / u["minute"]),
+            ("velocity", lambda: flow / (np.pi / 4 * d ** 2)),
+            ("Reynolds number", lambda: rho * v * d / mu),
+            ("head loss", lambda: v ** 2 / 2 / g * (f * length / d + 20.9) + length),
+            ("back to ft", convert),
+        ]
+
+    timings = {name: [time_call(step, repeats) for _, step in steps(u)] for name, u in systems}
+    names = [name for name, _ in steps(floats)]
+    print("Cost of units, microseconds per call")
+    print(f"{'':<18}" + "".join(f"{name:>12}" for name, _ in systems) + f"{'Quantity / float':>18}")
+    for i, step in enumerate(names):
+        print(f"{step:<18}" + "".join(f"{timings[name][i] * 1e6:>12.2f}" for name, _ in systems) +
+              f"{timings['Quantity'][i] / timings['float'][i]:>17.1f}x")
+
+    d = [1, 0.75, 0.75, 0.75, 0.5]
+    with_units, without = time_call(lambda: network.hl(14, 2.5, d, fast=False), repeats), \
+        time_call(lambda: network.hl(14, 2.5, d), repeats)
+    print(f"hl14: {with_units * 1e6:.1f} us with units (background_functions), {without * 1e6:.1f} us on floats "
+          f"(network.py), {with_units / without:.0f}x")
+
+
+def time_call(function, repeats=5):
+    """Seconds per call of function(), best of repeats. Each repeat calls it enough times in a row to take at least
+    0.2 s (see timeit.Timer.autorange), so quick functions aren't lost in timer resolution."""
+    timer = timeit.Timer(function)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeats, number)) / number
+
+
+def import_time(script, repeats=5):
+    """Seconds it takes a fresh interpreter to do everything script (a module name) imports at the top, best of
+    repeats. Not the interpreter starting up, and not the script itself, since some of them (parse_json) run the moment
+    they're imported. Runs from this file's directory, like the scripts themselves."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    with open(os.path.join(here, f"{script}.py"), "r") as file:
+        imports = [ast.unparse(node) for node in ast.parse(file.read()).body
+                   if isinstance(node, (ast.Import, ast.ImportFrom))]
+    code = "from time import perf_counter\nstart = perf_counter()\n" + "\n".join(imports) + \
+           "\nprint(perf_counter() - start)"
+    return min(float(subprocess.run([sys.executable, "-c", code], cwd=here, capture_output=True, text=True,
+                                    check=True).stdout) for _ in range(repeats))
+
+
+def hot_paths():
+    """(name, function) for every benchmark in the suite, each one taking no arguments.
+    Everything that saves solutions between calls (warm starts, design points) gets reset inside the call, so every
+    call does the same work as the first one would."""
+    d = [1, 0.75, 0.75, 0.75, 0.5]
+    flowrates = [6.16, 4.63, 3.68, 2.33, 1.96, 1.89, 3.47, 2.59, 2.04, 1.27, 1.06, 1.01]
+    params = build_parameter_array()
+
+    # A typical pipe: 2.5 gal/min through 3/4 in, plus a thousand Reynolds numbers across the turbulent range
+    D = 0.75 * ff.inch
+    Re = ff.rhoWater * 2.5 * ff.flow_unit / (np.pi / 4 * D ** 2) * D / ff.muWater
+    Res = np.geomspace(2500, 1e6, 1000)
+    D_units = 0.75 * bf.diameter_unit
+    Re_units = bf.rhoWater * 2.5 * bf.flow_unit / (np.pi / 4 * D_units ** 2) * D_units / bf.muWater
+
+    def solve_pumps_required():
+        solver_functions.design_points.clear()
+        solver_functions.solve_pumps_required(d, "A", fast=True)
+
+    def one_option():
+        solver_functions.reset_warm_starts()
+        cost(d + ["A"], fast=True)
+
+    def sweep():
+        solver_functions.reset_warm_starts()
+        return [cost(param, fast=True) for param in params]
+
+    def batched_sweep():
+        solver_functions.reset_warm_starts()
+        return solver_functions.compute_costs_batched(params)
+
+    return [
+        ("friction, units", lambda: bf.friction(bf.epsilon, D_units, Re_units)),
+        ("friction, float", lambda: ff.friction_single(ff.epsilon, D, Re)),
+        ("friction, 1000 at once", lambda: ff.friction(ff.epsilon, D, Res)),
+        ("Colebrook, units", lambda: bf.Colebrook(bf.epsilon, D_units, Re_units)),
+        ("Colebrook, float", lambda: ff.Colebrook(ff.epsilon, D, Re)),
+        ("hl14, units", lambda: network.hl(14, 2.5, d, fast=False)),
+        ("hl14, float", lambda: network.hl(14, 2.5, d)),
+        ("head_losses, units", lambda: solver_functions.head_losses(flowrates, d, "A", 4)),
+        ("head_losses, float", lambda: solver_functions.head_losses(flowrates, d, "A", 4, fast=True)),
+        ("solve_pumps_required", solve_pumps_required),
+        ("compute_cost_with_specifications", one_option),
+        ("sweep", sweep),
+        ("sweep, batched", batched_sweep),
+    ]
+
+
+def check_answers(results, reference="raw_data.json", rtol=1e-6):
+    """Compares a sweep's results with the ones checked in (in the same order), option by option. Counts how many
+    give the same numbers, how many don't (both converged with the same pumps, but something's off by more than rtol),
+    how many converged before but don't now with the same pumps ("lost"), how many only converge now ("gained"), and
+    how many come out with a different number of pumps (the design point got more accurate since raw_data.json was
+    made, see solve_design_point). Only "different" and "lost" are wrong answers."""
+    with open(reference, "r") as file:
+        expected = json.load(file)
+    if len(expected) != len(results):
+        raise ValueError(f"{reference} has {len(expected)} options, the sweep has {len(results)}")
+
+    counts = {"same": 0, "different": 0, "lost": 0, "gained": 0, "resized": 0}
+    for before, after in zip(expected, results):
+        if before[0:2] != [list(after[0]), after[1]]:
+            raise ValueError(f"{reference} isn't in the same order as the sweep ({before[0:2]} vs {after[0:2]})")
+        converged_before, converged_after = before[2][0] != 1e3, after[2][0] != 1e3
+        if not converged_before:
+            counts["gained" if converged_after else "same"] += 1
+            continue
+        # A failed option doesn't say how many pumps it had, but they're solved and saved by now
+        pumps_after = after[2] if converged_after else solver_functions.solve_pumps_required(after[0], after[1], True)
+        if list(pumps_after) != list(before[2]):
+            counts["resized"] += 1
+        elif not converged_after:
+            counts["lost"] += 1
+        elif same_results([before], [after], rtol):
+            counts["same"] += 1
+        else:
+            counts["different"] += 1
+    return counts
+
+
+def commit():
+    """Short hash of the checked out commit, None if git can't tell"""
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_suite(history=HISTORY_FILE, repeats=5):
+    """Times every hot path and every script's imports, checks both sweeps' answers against raw_data.json, prints it all and adds it to history.
+    Returns True if the answers are right."""
+    timings, answers = {}, {}
+    print(f"{'':<36}{'per call':>14}")
+    for name, function in hot_paths():
+        timings[name] = time_call(function, repeats)
+        print(f"{name:<36}{timings[name] * 1000:>11.4f} ms")
+        if name.startswith("sweep"):
+            answers[name] = check_answers(function())
+    for script in ENTRY_POINTS:
+        name = f"importing {script}"
+        timings[name] = import_time(script, repeats)
+        print(f"{name:<36}{timings[name] * 1000:>11.4f} ms")
+
+    right = True
+    for name, counts in answers.items():
+        print(f"{name} against raw_data.json: " + ", ".join(f"{count} {kind}" for kind, count in counts.items()))
+        right = right and counts["different"] == 0 and counts["lost"] == 0
+
+    with open(history, "a") as file:
+        file.write(json.dumps({"time": datetime.now().isoformat(timespec="seconds"), "commit": commit(),
+                               "python": platform.python_version(), "machine": platform.node(),
+                               "timings": timings, "answers": answers, "right": right}) + "\n")
+    print(f"Added to {history}." + ("" if right else " The answers have changed!"))
+    return right
+
+
+def compare(history=HISTORY_FILE, baseline=-2, threshold=THRESHOLD):
+    """Compares the latest run in history with an earlier one (the one before it, unless baseline says which).
+    Prints every benchmark's timings side by side. Returns False if any got more than threshold times slower,
+    or the latest run's answers were wrong or changed from the earlier run's."""
+    with open(history, "r") as file:
+        runs = [json.loads(line) for line in file if line.strip()]
+    if len(runs) < 2:
+        raise ValueError(f"{history} needs at least two runs to compare, it has {len(runs)}")
+    before, after = runs[baseline], runs[-1]
+    if (before["machine"], before["python"]) != (after["machine"], after["python"]):
+        print(f"Warning: comparing runs from {before['machine']} (Python {before['python']}) and "
+              f"{after['machine']} (Python {after['python']}), timings may not mean much")
+
+    print(f"{'':<36}{before['commit'] or before['time']:>14}{after['commit'] or after['time']:>14}{'ratio':>9}")
+    ok = True
+    for name, seconds in after["timings"].items():
+        if name not in before["timings"]:
+            print(f"{name:<36}{'':>14}{seconds * 1000:>11.4f} ms      new")
+            continue
+        ratio = seconds / before["timings"][name]
+        slower = ratio > threshold
+        ok = ok and not slower
+        print(f"{name:<36}{before['timings'][name] * 1000:>11.4f} ms{seconds * 1000:>11.4f} ms{ratio:>8.2f}x"
+              f"{'  SLOWER' if slower else ''}")
+
+    if not after["right"]:
+        print("The latest run's answers don't match raw_data.json")
+        ok = False
+    if after["answers"] != before["answers"]:
+        print(f"The answers changed: {before['answers']} before, {after['answers']} now")
+        ok = False
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks the solvers. With no command, prints the comparisons "
+                                                 "between solver settings.")
+    commands = parser.add_subparsers(dest="command")
+    run = commands.add_parser("run", help="time the hot paths, the sweep and the imports, check the answers, "
+                                          "add to the history")
+    run.add_argument("--history", default=HISTORY_FILE, help=f"file to add the results to (default {HISTORY_FILE})")
+    run.add_argument("--repeats", type=int, default=5, help="times to repeat every timing, keeping the best (default 5)")
+    against = commands.add_parser("compare", help="fail if the latest run got slower or changed its answers")
+    against.add_argument("--history", default=HISTORY_FILE, help=f"file with the runs (default {HISTORY_FILE})")
+    against.add_argument("--baseline", type=int, default=-2,
+                         help="which run to compare against, as an index into the history (default -2, the one before)")
+    against.add_argument("--threshold", type=float, default=THRESHOLD,
+                         help=f"how many times slower counts as a regression (default {THRESHOLD})")
+    args = parser.parse_args()
+
+    if args.command == "run":
+        sys.exit(0 if run_suite(args.history, args.repeats) else 1)
+    elif args.command == "compare":
+        sys.exit(0 if compare(args.history, args.baseline, args.threshold) else 1)
+    else:
+        jacobian_benchmark(build_parameter_array())
+        warm_start_benchmark(build_parameter_array())
+        design_point_benchmark(build_parameter_array())
+        batched_benchmark(build_parameter_array())
+        units_benchmark()
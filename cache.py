@@ -0,0 +1,137 @@
+import hashlib
+import json
+import os
+import tempfile
+import float_functions as ff
+import network
+import pumps
+
+# Solved options saved to disk, so running again (after changing only the summary, or adding one new diameter)
+# doesn't re-solve everything from scratch.
+# Each option is its own small file named after a hash of everything that goes into solving it: the diameters, the pump,
+# how it was solved (see METHODS), and every physical constant and pipe in the system. Change any of those and the old files
+# just stop matching, nothing needs clearing by hand.
+# Files are written to a temporary name and then renamed into place, so several processes can share the folder:
+# a reader either finds a whole file or none at all.
+# Only options that converged get saved. Whether fsolve converges can depend on where it started (see
+# solver_functions.warm_starts), so an option that didn't is solved again next time rather than given up on for good.
+
+CACHE_DIR = ".solution_cache"
+
+# Every way an option can be solved. They don't all converge on the same options, so each keeps its own results.
+METHODS = ("fsolve", "fsolve with units", "batched", "tabulated")
+
+# How many writes (by every process sharing the folder) between checks of its size, and the file that counts them:
+# one byte gets appended per write, so its size is the count
+EVICT_EVERY = 100
+WRITES_FILE = "writes"
+
+
+def constants_hash():
+    """Hash of every number the solution depends on besides the option itself. Uses float_functions' constants,
+    which check_units() keeps equal to background_functions', plus the pipe table from network.py and the pump catalogue."""
+    constants = {
+        "rhoWater": ff.rhoWater, "muWater": ff.muWater, "epsilon": ff.epsilon, "grav": ff.grav,
+        "KLs": [ff.branch_tee, ff.straight_tee, ff.toilet, ff.sink, ff.bend, ff.valve],
+        "pipes": network.SEGMENTS,
+        "pumps": pumps.CATALOGUE,
+    }
+    return hashlib.sha256(json.dumps(constants).encode()).hexdigest()
+
+
+CONSTANTS_HASH = constants_hash()
+
+
+def converged(result):
+    """Whether a result row is for an option that converged (its numbers of pumps aren't 1e3)"""
+    return result[2][0] != 1e3
+
+
+class SolutionCache:
+    """Folder of solved options, at most max_bytes in size. When it gets bigger than that, the ones used least recently
+    get deleted first. Only holds a folder name, so it can be handed to worker processes."""
+
+    def __init__(self, path=CACHE_DIR, max_bytes=50_000_000):
+        self.path = path
+        self.max_bytes = max_bytes
+        os.makedirs(path, exist_ok=True)
+
+    def file_name(self, param, method):
+        if method not in METHODS:
+            raise ValueError(f"{method!r} isn't a solver method the cache knows, see cache.METHODS")
+        text = json.dumps([list(param), method, CONSTANTS_HASH])
+        return os.path.join(self.path, hashlib.sha256(text.encode()).hexdigest() + ".json")
+
+    def get(self, param, method):
+        """Saved result for this option, or None if it hasn't been solved by method (with these constants) before."""
+        name = self.file_name(param, method)
+        try:
+            with open(name, "r") as file:
+                entry = json.load(file)
+            # Marks it as recently used for eviction
+            os.utime(name)
+        except (OSError, ValueError):
+            return None
+        if entry["param"] != list(param) or not converged(entry["result"]):
+            return None
+        return entry["result"]
+
+    def put(self, param, method, result):
+        """Saves a result. Whatever's already there under the same name is replaced in one go.
+        Returns False if it couldn't be saved (the folder's full, or went away), which only means solving it again
+        next time, so it doesn't raise. Options that didn't converge aren't saved either."""
+        if not converged(result):
+            return False
+        try:
+            descriptor, temporary = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+        except OSError:
+            return False
+        try:
+            with os.fdopen(descriptor, "w") as file:
+                json.dump({"param": list(param), "result": result}, file)
+            os.replace(temporary, self.file_name(param, method))
+        except BaseException as error:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+            if not isinstance(error, OSError):
+                raise
+            return False
+
+        # Checking the folder's size means looking at every file, so it's only done every EVICT_EVERY writes. The count
+        # is kept in the folder itself (appends don't get lost between processes), so every worker process's copy of
+        # this, and every run, counts towards the same total.
+        try:
+            with open(os.path.join(self.path, WRITES_FILE), "ab") as file:
+                file.write(b".")
+                writes = file.tell()
+            if writes >= EVICT_EVERY:
+                os.truncate(os.path.join(self.path, WRITES_FILE), 0)
+                self.evict()
+        except OSError:
+            pass
+        return True
+
+    def evict(self):
+        """Deletes the least recently used files until the folder is back under 90% of max_bytes.
+        Other processes might be deleting (or replacing) the same files, which is fine. Files still being written
+        (.tmp) are left alone, or whoever's writing them would fail to rename them into place."""
+        entries = []
+        for entry in os.scandir(self.path):
+            if not entry.name.endswith(".json"):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        if total <= self.max_bytes:
+            return
+        for _, size, name in sorted(entries):
+            try:
+                os.remove(name)
+            except FileNotFoundError:
+                pass
+            total -= size
+            if total <= 0.9 * self.max_bytes:
+                break
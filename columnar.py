@@ -0,0 +1,168 @@
+import os
+import numpy as np
+
+# Results stored by column instead of as a list of rows: a directory with one .npy file per column of a result row
+# (see solver_functions.cost_breakdown for what they are). Every column gets memory-mapped when loaded, so nothing is
+# read until it's needed, and ranking millions of options by one cost only ever touches that one column.
+# Rows still come out in the usual layout for anything that wants them (display.summary and friends).
+
+RESULTS_DIRECTORY = "raw_data.columns"
+
+# Name, type and width of every column, in the order they come in a result row
+COLUMNS = [
+    ("diameters", "f8", 5),  # in
+    ("pump", "U8", 1),
+    ("no_pumps", "f8", 2),  # series, parallel, 1e3 if it didn't converge
+    ("system_cost", "f8", 1),  # $
+    ("operating_cost", "f8", 1),  # $ per month
+    ("flowrates", "f8", 12),  # gal/min
+    ("total_flow", "f8", 1),  # gal/min
+    ("head", "f8", 1),  # ft
+]
+
+# Which column a result row's index refers to, so rankings can be asked for by index like aggregate.TopK does
+BY_INDEX = [name for name, _, _ in COLUMNS]
+
+
+def save(solutions, path=RESULTS_DIRECTORY):
+    """Writes a list of result rows to path, one .npy file per column"""
+    os.makedirs(path, exist_ok=True)
+    for index, (name, kind, width) in enumerate(COLUMNS):
+        column = np.array([solution[index] for solution in solutions], dtype=kind)
+        if width > 1:
+            column = column.reshape(len(solutions), width)
+        np.save(os.path.join(path, f"{name}.npy"), column)
+
+
+def whole(number):
+    """Numbers that were whole to begin with (a 1 in diameter, numbers of pumps) back as ints, like in the JSON"""
+    return int(number) if number == int(number) else float(number)
+
+
+class Results:
+    """Results saved by save(), memory-mapped. Works like a read-only list of result rows (len(), results[i]), plus
+    rankings and the Pareto front worked out on whole columns at once."""
+
+    def __init__(self, path=RESULTS_DIRECTORY):
+        self.path = path
+        self.columns = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r") for name, _, _ in COLUMNS}
+
+    def __len__(self):
+        return len(self.columns["system_cost"])
+
+    def __getitem__(self, i):
+        """Result row i, same as it was saved. A slice gives a list of rows, like a list would."""
+        if isinstance(i, slice):
+            return self.rows(i)
+        return self.rows([i])[0]
+
+    def rows(self, indices):
+        """Result rows for indices (anything that can index a numpy array, a slice included), built a column at a time"""
+        columns = {name: self.columns[name][indices].tolist() for name, _, _ in COLUMNS}
+        diameters = [[whole(d) for d in row] for row in columns["diameters"]]
+        no_pumps = [[whole(n) for n in row] if row[0] != 1e3 else [1e3, 1e3] for row in columns["no_pumps"]]
+        return [list(row) for row in zip(diameters, columns["pump"], no_pumps, columns["system_cost"],
+                                         columns["operating_cost"], columns["flowrates"], columns["total_flow"],
+                                         columns["head"])]
+
+    def converged(self):
+        """True for every option that converged"""
+        return self.columns["no_pumps"][:, 0] != 1e3
+
+    def not_converged(self):
+        return len(self) - int(self.converged().sum())
+
+    def top(self, column, k):
+        """Indices of the k options with the lowest value in column (a name, or its index in a result row), best first.
+        Ties go the same way as aggregate.TopK: smallest diameters, then pump. Only the candidates get sorted."""
+        values = self.columns[BY_INDEX[column] if isinstance(column, int) else column]
+        k = min(k, len(values))
+        if k == 0:
+            return np.array([], dtype=int)
+        # Everything up to the k-th lowest value, ties at the edge included, and only then sort those properly
+        cutoff = np.partition(values, k - 1)[k - 1]
+        candidates = np.flatnonzero(values <= cutoff)
+        diameters = self.columns["diameters"][candidates]
+        keys = [self.columns["pump"][candidates]] + [diameters[:, j] for j in reversed(range(diameters.shape[1]))]
+        order = np.lexsort(keys + [values[candidates]])
+        return candidates[order[0:k]]
+
+    def pareto(self):
+        """Indices of the options on the Pareto front of system and operating cost, cheapest to build first. Same front
+        as aggregate.pareto_front: sorted by system cost, keeping everything cheaper to run than all before it."""
+        candidates = np.flatnonzero(self.converged())
+        if not len(candidates):
+            return candidates
+        system = self.columns["system_cost"][candidates]
+        operating = self.columns["operating_cost"][candidates]
+
+        # Nothing on the front costs more to build than the cheapest to run, or more to run than the cheapest to build,
+        # which usually leaves hardly anything to sort
+        lowest_operating, lowest_system = operating.min(), system.min()
+        keep = (system <= system[operating == lowest_operating].min()) & \
+               (operating <= operating[system == lowest_system].min())
+        candidates, system, operating = candidates[keep], system[keep], operating[keep]
+
+        order = np.lexsort((operating, system))
+        operating = operating[order]
+        cheapest_before = np.concatenate([[np.inf], np.minimum.accumulate(operating)[:-1]])
+        return candidates[order[operating < cheapest_before]]
+
+
+if __name__ == "__main__":
+    import json
+    import tempfile
+    import time
+    from aggregate import Collector, pareto_front
+
+    # Same answers as going through the rows one at a time
+    with open("raw_data.json", "r") as file:
+        solutions = json.load(file)
+    with tempfile.TemporaryDirectory() as directory:
+        save(solutions, directory)
+        results = Results(directory)
+        assert [results[i] for i in range(len(results))] == results[:] == solutions
+        collector = Collector(10)
+        for solution in solutions:
+            collector.add(solution)
+        assert results.rows(results.top(3, 10)) == collector.rows(3)
+        assert results.rows(results.top("operating_cost", 10)) == collector.rows(4)
+        assert results.rows(results.pareto()) == pareto_front(solutions) == collector.front.rows()
+        assert results.not_converged() == collector.not_converged
+        print(f"{len(solutions)} options from raw_data.json come back the same, and so do their summaries")
+
+        # Ties on system cost: only the one cheaper to run is on the front, whichever order they come in
+        first = next(solution for solution in solutions if solution[2][0] != 1e3)
+        ties = [first[0:3] + [100., 50.] + first[5:], first[0:3] + [100., 40.] + first[5:],
+                first[0:3] + [90., 60.] + first[5:], first[0:3] + [100., 40.] + first[5:]]
+        for order in (ties, ties[::-1]):
+            save(order, directory)
+            collector = Collector(10)
+            for solution in order:
+                collector.add(solution)
+            assert Results(directory).rows(Results(directory).pareto()) == pareto_front(order) == \
+                   collector.front.rows() == [ties[2], ties[1]]
+        print("Options tied on system cost give the same Pareto front every way")
+
+        # A couple million made up options, ties and all
+        n = 2000000
+        rng = np.random.default_rng(0)
+        many = {"diameters": rng.choice([0.5, 0.75, 1], (n, 5)), "pump": rng.choice(["A", "B", "C"], n).astype("U8"),
+                "no_pumps": np.where(rng.random((n, 1)) < 0.5, 1e3, rng.integers(1, 20, (n, 2))),
+                "system_cost": np.round(rng.uniform(1000, 30000, n), 2), "operating_cost": rng.uniform(20, 400, n),
+                "flowrates": rng.uniform(1, 10, (n, 12)), "total_flow": rng.uniform(12, 120, n),
+                "head": rng.uniform(44, 500, n)}
+        for name, column in many.items():
+            np.save(os.path.join(directory, f"{name}.npy"), column)
+
+        start = time.perf_counter()
+        results = Results(directory)
+        loaded = time.perf_counter() - start
+        start = time.perf_counter()
+        top = results.rows(results.top("system_cost", 10))
+        ranked = time.perf_counter() - start
+        start = time.perf_counter()
+        front = results.pareto()
+        paretoed = time.perf_counter() - start
+        print(f"{n} options: loaded in {loaded * 1000:.1f} ms, top 10 by system cost in {ranked * 1000:.1f} ms, "
+              f"Pareto front ({len(front)} options) in {paretoed * 1000:.1f} ms")
@@ -0,0 +1,135 @@
+from functools import lru_cache
+from pumps import CATALOGUE
+
+# Every option to try, as a space that can be counted, indexed and walked through without building the list.
+# An option is the five diameters (see network.py) plus a pump, in the same order build_parameter_array always used:
+# diameters smallest first, D0 outermost, pump innermost. Diameters only get smaller (or stay the same) going
+# downstream, so most combinations are never looked at instead of being built and thrown away.
+# Every option also has an index, so a sweep can be split into ranges of indices and each range rebuilt on its own.
+
+DIAMETERS = (0.5, 0.75, 1)  # in
+PUMPS = tuple(CATALOGUE)  # see pumps.py
+
+# Which diameter each diameter can't be bigger than: the first floor's fixture pipes (2) come off its main line (1),
+# the second floor's (4) off its own (3), and both floors' main lines off the main pipe from the pumps (0).
+# A diameter comes after the one it depends on, so going through them in order always knows the limit already.
+PARENTS = (None, 0, 1, 0, 3)
+
+
+class DesignSpace:
+    """All options for a catalogue of diameters and pumps. Works like a read-only list: len(), iteration,
+    space[i] for the i-th option and space.index(option) for the other way round.
+    parents is which diameter limits each one (None for no limit), see PARENTS."""
+
+    def __init__(self, diameters=DIAMETERS, pumps=PUMPS, parents=PARENTS):
+        self.diameters = tuple(sorted(diameters))
+        self.pumps = tuple(pumps)
+        self.parents = tuple(parents)
+        self.children = [[k for k, parent in enumerate(self.parents) if parent == j] for j in range(len(self.parents))]
+        # Memoized per instance, for catalogues too big to count by walking through them
+        self.subtree = lru_cache(maxsize=None)(self._subtree)
+        self.count = self.completions(0, ()) * len(self.pumps)
+
+    def _subtree(self, position, limit):
+        """Ways to pick this diameter (no bigger than the limit-th) and every diameter below it"""
+        total = 0
+        for value in range(limit + 1):
+            ways = 1
+            for child in self.children[position]:
+                ways *= self.subtree(child, value)
+            total += ways
+        return total
+
+    def limit(self, position, chosen):
+        """Largest diameter (as an index into diameters) allowed at position, given the ones before it"""
+        parent = self.parents[position]
+        return len(self.diameters) - 1 if parent is None else chosen[parent]
+
+    def completions(self, position, chosen):
+        """Ways to pick every diameter from position on, given the ones before it. Whatever comes after position
+        splits up into whole subtrees hanging off diameters already picked, which can be counted separately."""
+        ways = 1
+        for k in range(position, len(self.parents)):
+            parent = self.parents[k]
+            if parent is None or parent < position:
+                ways *= self.subtree(k, self.limit(k, chosen))
+        return ways
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        """Every option in order, one at a time"""
+        for chosen in self.diameter_indices(0, []):
+            diameters = [self.diameters[i] for i in chosen]
+            for pump in self.pumps:
+                yield diameters + [pump]
+
+    def diameter_indices(self, position, chosen):
+        if position == len(self.parents):
+            yield chosen
+            return
+        for value in range(self.limit(position, chosen) + 1):
+            yield from self.diameter_indices(position + 1, chosen + [value])
+
+    def __getitem__(self, index):
+        """The index-th option (unrank)"""
+        if index < 0:
+            index += self.count
+        if not 0 <= index < self.count:
+            raise IndexError("design space index out of range")
+        index, pump = divmod(index, len(self.pumps))
+
+        chosen = []
+        for position in range(len(self.parents)):
+            for value in range(self.limit(position, chosen) + 1):
+                ways = self.completions(position + 1, chosen + [value])
+                if index < ways:
+                    chosen.append(value)
+                    break
+                index -= ways
+        return [self.diameters[i] for i in chosen] + [self.pumps[pump]]
+
+    def index(self, option):
+        """Where option comes in the order (rank). Raises ValueError if it isn't in the space."""
+        try:
+            chosen = [self.diameters.index(d) for d in option[0:len(self.parents)]]
+            pump = self.pumps.index(option[len(self.parents)])
+        except ValueError:
+            raise ValueError(f"{option} is not in the design space")
+        if any(value > self.limit(position, chosen) for position, value in enumerate(chosen)):
+            raise ValueError(f"{option} is not in the design space")
+
+        index = 0
+        for position, value in enumerate(chosen):
+            for smaller in range(value):
+                index += self.completions(position + 1, chosen[0:position] + [smaller])
+        return index * len(self.pumps) + pump
+
+    def range(self, start, stop=None):
+        """Options start to stop (like list slicing, without negative indices), one at a time.
+        For handing separate parts of the space to separate processes."""
+        stop = self.count if stop is None else min(stop, self.count)
+        for index in range(start, stop):
+            yield self[index]
+
+    def ranges(self, parts):
+        """(start, stop) for splitting the space into parts about equal ranges"""
+        size, extra = divmod(self.count, parts)
+        bounds = [0]
+        for part in range(parts):
+            bounds.append(bounds[-1] + size + (part < extra))
+        return list(zip(bounds[:-1], bounds[1:]))
+
+
+if __name__ == "__main__":
+    space = DesignSpace()
+    options = list(space)
+    print(f"{len(space)} options, {len(options)} when walked through")
+    assert len(options) == len(space)
+    assert all(space[i] == option and space.index(option) == i for i, option in enumerate(options))
+    assert [option for start, stop in space.ranges(4) for option in space.range(start, stop)] == options
+
+    bigger = DesignSpace(DIAMETERS + (1.25, 1.5), PUMPS + ("D", "E"))
+    print(f"With 1.25 and 1.5 in pipe and two more pumps: {len(bigger)} options, "
+          f"the last one being {bigger[-1]}")
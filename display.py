@@ -1,18 +1,67 @@
-def summary(arr, msg):
-    """Takes an array of solutions and returns appropriate text that summarizes it."""
+import csv
+import io
+from itertools import chain, repeat
+import numpy as np
+
+# Rows formatted and written at a time by the write_ functions below, so a table of millions of options never has to
+# be one string (or one list of strings) all at once
+CHUNK = 10000
+
+HEADER = ["Diameters", "Pump Type", "Number of Pumps", "System Cost", "Operating Cost (1 month max)", "Flow Rates",
+          "Total Flow", "Total Head Required"]
+UNITS = ["in", "", "series, parallel", "$", "$", "gal/min", "gal/min", "ft"]
+CSV_HEADER = [f"d{i}" for i in range(5)] + ["pump", "series", "parallel", "system_cost", "operating_cost"] + \
+             [f"fl{i}" for i in range(1, 13)] + ["total_flow", "head"]
+
+
+def rounded(values):
+    """round(value, 2) for a whole array of floats at once. numpy rounds the scaled value, which can only come out
+    different from round's (exact) answer right at a half, so those few get rounded by round itself."""
+    values = np.asarray(values, dtype=float)
+    scaled = values * 100
+    result = np.round(scaled) / 100
+    with np.errstate(invalid="ignore"):
+        halves = np.abs(np.abs(scaled - np.trunc(scaled)) - 0.5) <= 4 * np.spacing(scaled) + 1e-9
+    for i in np.flatnonzero(halves):
+        result.flat[i] = round(float(values.flat[i]), 2)
+    return result
+
+
+def column_text(column):
+    """A column of result rows as the text summary puts in its cells: numbers rounded to 2 decimals, lists of numbers
+    rounded number by number. Columns of floats (or of equally long lists of floats) get rounded all together;
+    anything else (ints in with the floats, like diameters and numbers of pumps) one cell at a time, but those only
+    ever have a handful of different cells, so each one only gets worked out once."""
+    if isinstance(column[0], str):
+        return list(column)
+    if not isinstance(column[0], (list, tuple)):
+        if set(map(type, column)) == {float}:
+            return list(map(repr, rounded(column).tolist()))
+        return list(map(str, map(round, column, repeat(2))))
+
+    if len(set(map(len, column))) == 1 and set(map(type, chain.from_iterable(column))) == {float}:
+        return ["[" + ", ".join(map(repr, cell)) + "]" for cell in rounded(column).tolist()]
+    text = {}
+    for cell in map(tuple, column):
+        if cell not in text:
+            text[cell] = str([round(item, 2) for item in cell])
+    return [text[tuple(cell)] for cell in column]
+
+
+def cells(rows):
+    """Text for every cell of rows, as a list per column"""
+    return [column_text(column) for column in zip(*rows)]
+
+
+def write_summary(arr, msg, file, chunk=CHUNK):
+    """Writes the same table summary(arr, msg) returns to file, chunk rows at a time. Goes through arr twice (once for
+    the column widths) so it has to be a sequence, a list or columnar.Results."""
     maxlen = [9, 9, 18, 11, 28, 10, 10, 19]
-    rounded = [[round(item, 2) if isinstance(item, float) else item for item in sublist] for sublist in arr]
-    roundedtwice = [[[round(subitem, 2) for subitem in item] if isinstance(item, list) else item for item in sublist]
-                    for sublist in rounded]
-
-    for i, sublist in enumerate(arr):
-        for j, item in enumerate(sublist):
-            try:
-                if len(str(roundedtwice[i][j])) > maxlen[j]:
-                    maxlen[j] = len(str(roundedtwice[i][j]))
-            except Exception as ex:
-                print(i, j, item)
-                raise ex
+    text = None
+    for start in range(0, len(arr), chunk):
+        text = cells(arr[start:start + chunk])
+        for j, column in enumerate(text):
+            maxlen[j] = max(maxlen[j], max(map(len, column)))
 
     txt = "\n" + "-" * (5 + sum(maxlen)) + "\n"
     txt += msg + "\n"
@@ -24,19 +73,73 @@ def summary(arr, msg):
            + f"| ${' ' * (maxlen[3] - 2)}| ${' ' * (maxlen[4] - 2)}" \
            + f"| gal/min{' ' * (maxlen[5] - 8)}| gal/min{' ' * (maxlen[6] - 8)}| ft{' ' * (maxlen[7] - 3)}|\n"
     txt += f"|{'-' * maxlen[0]}|{'-' * maxlen[1]}|{'-' * maxlen[2]}|{'-' * maxlen[3]}|{'-' * maxlen[4]}|{'-' * maxlen[5]}|{'-' * maxlen[6]}|{'-' * maxlen[7]}|\n"
-    for sublist in roundedtwice:
-        txt += f"|{str(sublist[0])}{' ' * (maxlen[0] - len(str(sublist[0])))}"
-        txt += f"|{str(sublist[1])}{' ' * (maxlen[1] - len(str(sublist[1])))}"
-        txt += f"|{str(sublist[2])}{' ' * (maxlen[2] - len(str(sublist[2])))}"
-        txt += f"|{str(sublist[3])}{' ' * (maxlen[3] - len(str(sublist[3])))}"
-        txt += f"|{str(sublist[4])}{' ' * (maxlen[4] - len(str(sublist[4])))}"
-        txt += f"|{str(sublist[5])}{' ' * (maxlen[5] - len(str(sublist[5])))}"
-        txt += f"|{str(sublist[6])}{' ' * (maxlen[6] - len(str(sublist[6])))}"
-        txt += f"|{str(sublist[7])}{' ' * (maxlen[7] - len(str(sublist[7])))}|\n"
+    file.write(txt)
+
+    for start in range(0, len(arr), chunk):
+        # Everything fits in one chunk (like any summary of the top few), the cells are already there
+        if len(arr) > chunk:
+            text = cells(arr[start:start + chunk])
+        padded = [list(map(str.ljust, column, repeat(width))) for column, width in zip(text, maxlen)]
+        file.writelines("|" + "|".join(row) + "|\n" for row in zip(*padded))
+    file.write("\n")
+
+
+def summary(arr, msg):
+    """Takes an array of solutions and returns appropriate text that summarizes it.
+    For big ones, write_summary writes the same thing straight to a file."""
+    txt = io.StringIO()
+    write_summary(arr, msg, txt)
+    return txt.getvalue()
+
+
+def write_markdown(arr, file, chunk=CHUNK):
+    """Writes arr (a list of solutions or columnar.Results) to file as a Markdown table, same cells as summary"""
+    file.write("| " + " | ".join(f"{name} ({unit})" if unit else name for name, unit in zip(HEADER, UNITS)) + " |\n")
+    file.write("|" + "---|" * len(HEADER) + "\n")
+    for start in range(0, len(arr), chunk):
+        file.writelines("| " + " | ".join(row) + " |\n" for row in zip(*cells(arr[start:start + chunk])))
+
+
+def write_csv(arr, file, chunk=CHUNK):
+    """Writes arr (a list of solutions or columnar.Results) to file as CSV, every number in full and in its own
+    column (see CSV_HEADER). Open file with newline=""."""
+    writer = csv.writer(file)
+    writer.writerow(CSV_HEADER)
+    for start in range(0, len(arr), chunk):
+        writer.writerows([*row[0], row[1], *row[2], *row[3:5], *row[5], *row[6:8]] for row in arr[start:start + chunk])
+
+
+def pareto_summary(front, msg):
+    """Takes the Pareto front (cheapest system first, see aggregate.ParetoFront) and returns a table of it, with what
+    each option costs over the one before it, what it saves every month, and how many months until that pays for itself."""
+    header = ["Diameters", "Pump Type", "Number of Pumps", "System Cost", "Operating Cost (1 month max)",
+              "Extra System Cost", "Monthly Savings", "Payback"]
+    units = [" in", "", " series, parallel", " $", " $", " $", " $", " months"]
+    rows = []
+    for i, result in enumerate(front):
+        row = [str([round(d, 2) for d in result[0]]), str(result[1]), str(result[2]),
+               str(round(result[3], 2)), str(round(result[4], 2))]
+        if i == 0:
+            row += ["", "", ""]
+        else:
+            extra = result[3] - front[i - 1][3]
+            savings = front[i - 1][4] - result[4]
+            row += [str(round(extra, 2)), str(round(savings, 2)), str(round(extra / savings, 1))]
+        rows.append(row)
+
+    maxlen = [max([len(header[j]), len(units[j])] + [len(row[j]) for row in rows]) for j in range(len(header))]
+    line = lambda cells: "|" + "|".join(cell + " " * (maxlen[j] - len(cell)) for j, cell in enumerate(cells)) + "|\n"
+
+    txt = "\n" + "-" * (len(maxlen) + 1 + sum(maxlen)) + "\n"
+    txt += msg + "\n"
+    txt += "-" * (len(maxlen) + 1 + sum(maxlen)) + "\n"
+    txt += line(header) + line(units) + line(["-" * length for length in maxlen])
+    txt += "".join(map(line, rows))
     txt += "\n"
 
     return txt
 
+
 def time_str(time):
     """Takes a float of seconds and turns it into appropriate hours, minutes, and seconds.
     Really just for easy reading. Not important to assignment."""
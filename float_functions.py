@@ -0,0 +1,206 @@
+import math
+import numpy as np
+import pumps
+
+# Plain-float twin of background_functions. Same equations, but everything is a float in SI units (m, kg, s)
+# so no unit bookkeeping happens inside the solver loops.
+# Units are only dealt with at the boundary: the solvers multiply plain numbers by flow_unit and diameter_unit on the
+# way in and call head_in_ft on the way out, exactly like they do with background_functions.
+# The pipes themselves (what hl1..hl26 are in background_functions) are a table in network.py.
+# check_units() below makes sure every number here still matches its counterpart with units.
+
+
+# Conversion factors to SI (same definitions as units.py)
+ft = 0.3048
+inch = ft / 12
+mm = 1e-3
+lb = 0.4535924
+gal = 3.785412e-3
+minute = 60.
+kWh = 3.6e6
+month = 365.25 * 24 * 3600 / 12
+
+# Units the solvers attach to plain numbers before calling the functions below. background_functions has the same names.
+flow_unit = gal / minute
+diameter_unit = inch
+
+
+def head_in_ft(head):
+    """Turns a head in m into a plain number of ft."""
+    return head / ft
+
+
+def flow_in_gpm(flow):
+    """Turns a flowrate in m^3/s into a plain number of gal/min."""
+    return flow / flow_unit
+
+
+# From problem statement
+rhoWater = 62.3 * lb / ft ** 3
+muWater = 6.733e-4 * lb / ft
+
+# PVC roughness, see background_functions
+epsilon = 0.0015 * mm
+
+grav = 9.81
+
+# KLs: same as background_functions
+branch_tee = 2
+straight_tee = 0.9
+toilet = 14 + 0.9 + 10
+sink = 10 + 0.9 + 10
+bend = 0.9
+valve = 10
+
+
+# Friction and head loss finders
+
+# How many friction factors came from Haaland because Colebrook didn't come out finite (see metrics.py)
+fallbacks = {"Haaland": 0}
+
+
+def friction(epsilon, diameter, Re):
+    """Returns Darcy friction factor at given parameters.
+    Takes arrays of Reynolds numbers (and diameters) as well as single numbers and works element by element:
+    laminar up to Re = 2300, Colebrook above that, and Haaland wherever Colebrook doesn't come out finite."""
+    if np.ndim(Re) == 0 and np.ndim(diameter) == 0:
+        return friction_single(epsilon, float(diameter), float(Re))
+    Re = np.asarray(Re, dtype=float)
+
+    # Same branches as background_functions.friction, picked element by element. No flow means no friction.
+    # Both formulas get evaluated everywhere (it's cheaper than splitting the arrays), hence the errstate.
+    turbulent = Re > 2300
+    with np.errstate(all="ignore"):
+        f = np.where(turbulent, Colebrook(epsilon, diameter, Re), np.where(Re != 0, 64 / Re, 0.))
+
+    fallback = turbulent & ~np.isfinite(f)
+    if fallback.any():
+        fallbacks["Haaland"] += int(fallback.sum())
+        f = np.where(fallback, Haaland(epsilon, diameter, np.where(fallback, Re, 1e5)), f)
+
+    return f[()]
+
+
+def lambert_w_from_log(log_x):
+    """Real principal branch of the Lambert W function at x = exp(log_x), for arrays with x > e.
+    Takes the log because the x in Colebrook overflows a float long before W(x) does.
+    Starts from the asymptotic series for large x and takes one step of Fritsch's iteration, which is already
+    exact to machine precision for x > 1000 (always the case in Colebrook). Smaller x get a second step."""
+    L = np.asarray(log_x, dtype=float)
+    w = L - np.log(L) + np.log(L) / L
+    w = fritsch_step(w, L)
+    if np.any(L < 7):
+        w = fritsch_step(w, L)
+    return w
+
+
+def fritsch_step(w, log_x):
+    """One step of Fritsch's iteration for Lambert W. Works on floats and arrays alike."""
+    z = log_x - np.log(w) - w
+    q = 2 * (1 + w) * (1 + w + 2 * z / 3)
+    return w * (1 + z / (1 + w) * (q - z) / (q - 2 * z))
+
+
+def friction_single(epsilon, diameter, Re):
+    """Same as friction, but for one plain float at a time. numpy's overhead on a single number costs more than the
+    math itself, and the one-pipe-at-a-time solves in solver_functions call this thousands of times."""
+    if Re <= 2300:
+        return 64 / Re if Re != 0 else 0.
+    a = 2.51 / Re
+    b = 4 * epsilon / 14.8 / diameter
+    log_ins = math.log(math.log(10) / 2 / a) + b / 2 / a * math.log(10)
+    w = fritsch_step(log_ins - math.log(log_ins) + math.log(log_ins) / log_ins, log_ins)
+    if log_ins < 7:
+        w = fritsch_step(w, log_ins)
+    f = float(1 / (2 * w / math.log(10) - b / a) ** 2)
+    if not math.isfinite(f):
+        fallbacks["Haaland"] += 1
+        return float(Haaland(epsilon, diameter, Re))
+    return f
+
+
+def Colebrook(epsilon, diameter, Re):
+    """Returns the Darcy friction factor according to the Colebrook equation, solved explicitly with Lambert W."""
+    a = 2.51 / Re
+    b = 4 * epsilon / 14.8 / diameter
+    log_ins = np.log(np.log(10) / 2 / a) + b / 2 / a * np.log(10)
+    return 1 / (2 * lambert_w_from_log(log_ins) / np.log(10) - b / a) ** 2
+
+
+def Haaland(epsilon, diameter, Re):
+    """Returns the Darcy friction factor according to the Haaland equation."""
+    return (-1.8 * np.log10(6.9 / Re + (epsilon / 3.7 / diameter) ** 1.11)) ** -2
+
+
+def friction_derivative(epsilon, diameter, Re):
+    """Derivative of the friction factor with respect to Reynolds number, df/dRe, element by element.
+    Follows the same branches as friction so it's the exact slope of whatever friction returned."""
+    Re = np.asarray(Re, dtype=float)
+    turbulent = Re > 2300
+    with np.errstate(all="ignore"):
+        df = np.where(turbulent, Colebrook_derivative(epsilon, diameter, Re), np.where(Re != 0, -64 / Re ** 2, 0.))
+        f = friction(epsilon, diameter, Re)
+        fallback = turbulent & ~np.isfinite(Colebrook(epsilon, diameter, Re))
+    if fallback.any():
+        df = np.where(fallback, Haaland_derivative(epsilon, diameter, np.where(fallback, Re, 1e5)), df)
+    return np.where(np.isfinite(f), df, 0.)[()]
+
+
+def Colebrook_derivative(epsilon, diameter, Re):
+    """df/dRe of the Lambert W form of Colebrook. With y = 2 W / ln(10) - b / a, f = 1 / y^2,
+    and dW/dln(x) = W / (1 + W)."""
+    a = 2.51 / Re
+    b = 4 * epsilon / 14.8 / diameter
+    log_ins = np.log(np.log(10) / 2 / a) + b / 2 / a * np.log(10)
+    W = lambert_w_from_log(log_ins)
+    y = 2 * W / np.log(10) - b / a
+    dlog_ins = 1 / Re + b * np.log(10) / 5.02
+    dy = 2 / np.log(10) * W / (1 + W) * dlog_ins - b / 2.51
+    return -2 / y ** 3 * dy
+
+
+def Haaland_derivative(epsilon, diameter, Re):
+    """df/dRe of the Haaland equation."""
+    inside = 6.9 / Re + (epsilon / 3.7 / diameter) ** 1.11
+    u = -1.8 * np.log10(inside)
+    return -2 / u ** 3 * (-1.8 / inside / np.log(10) * -6.9 / Re ** 2)
+
+
+def hLtotal(f, L, D, KLs, v):
+    """Computes the total head loss for the given parameters."""
+    return v ** 2 / 2 / grav * (f * L / D + sum(KLs))
+
+
+# Pump curves, from the catalogue in pumps.py
+def pump_curve(pump, flow):
+    """Returns supplied head at that flow for one pump of that type"""
+    return pumps.head(pump, flow / flow_unit) * ft
+
+
+def pump_slope(pump, flow):
+    """Returns d(head)/d(flow) at that flow for one pump of that type, for the Jacobians"""
+    return pumps.slope(pump, flow / flow_unit) / flow_unit * ft
+
+
+def operating_cost(wattage):
+    """Monthly cost of running at the given wattage, assuming average 2023 US electricity price of 12.72 cents/kWh"""
+    return wattage * (0.1272 / kWh) * (1 * month)
+
+
+def check_units():
+    """Compares every constant above with its counterpart with units in background_functions.
+    Raises AssertionError if anything has drifted apart. Imports background_functions, so only call it when checking."""
+    import background_functions as bf
+    import quantity as q
+
+    pairs = [
+        (ft, bf.ft, q.m), (inch, bf.inch, q.m), (flow_unit, bf.flow_unit, q.m ** 3 / q.s),
+        (rhoWater, bf.rhoWater, q.kg / q.m ** 3), (muWater, bf.muWater, q.kg / q.m / q.s),
+        (epsilon, bf.epsilon, q.m), (grav, bf.grav, q.m / q.s ** 2), (kWh, bf.kWh, q.J), (month, bf.month, q.s)
+    ]
+    for number, quantity, si in pairs:
+        # asNumber raises if the dimensions don't match
+        assert math.isclose(number, quantity.asNumber(si), rel_tol=1e-6), f"{number} != {quantity}"
+
+    for name in ["branch_tee", "straight_tee", "toilet", "sink", "bend", "valve"]:
+        assert globals()[name] == getattr(bf, name), f"{name} differs from background_functions"
@@ -0,0 +1,300 @@
+import numpy as np
+import float_functions as ff
+import network
+import pumps
+
+# Steady flow in any network of pipes, looped or not, by the global gradient method (Todini & Pilati).
+# Nodes have a head (ft of water, elevation included) and links (pipes and pumps) have a flow (gal/min). Every link has
+# to lose (or, for a pump, gain) exactly the difference in head between its ends, and at every node with an unknown
+# head what flows in has to flow out. Newton on both at once, with the flows eliminated, leaves one sparse symmetric
+# system in the unknown heads per iteration, so each one costs about as much as the number of pipes.
+# Fixtures are open to the air: their head is just their elevation, whatever flows out of them. Their fittings are
+# counted in the pipe that ends at them, same as network.SEGMENTS does.
+# Friction jumps going from laminar to turbulent at Re = 2300 (see float_functions.friction), so a looped network with
+# a pipe whose flow ends up right at that jump has no exact solution and stops there without converging.
+
+# Smallest slope (ft per gal/min) a link is allowed to have, so a link with no flow through it doesn't make the
+# system singular
+MIN_SLOPE = 1e-6
+
+
+def pipe_losses(flow, diameter, length, k_sum):
+    """Head lost (ft) along pipes of diameter (in) and length (ft) with fittings k_sum, at flow (gal/min), and its
+    derivative with respect to flow. Same math as network.segment_heads without the rise, for arrays of pipes.
+    Flow going the other way loses head the other way."""
+    q = np.abs(flow) * ff.flow_unit
+    D = np.asarray(diameter, dtype=float) * ff.diameter_unit
+    L = np.asarray(length, dtype=float) * ff.ft
+    A = np.pi / 4 * D ** 2
+    v = q / A
+    Re = ff.rhoWater * v * D / ff.muWater
+    f = ff.friction(ff.epsilon, D, Re)
+    df = ff.friction_derivative(ff.epsilon, D, Re)
+    loss = ff.head_in_ft(v ** 2 / 2 / ff.grav * (f * L / D + k_sum))
+    slope = v / ff.grav / A * (f * L / D + k_sum) + v ** 2 / 2 / ff.grav * L / D * df * ff.rhoWater * D / ff.muWater / A
+    return np.sign(flow) * loss, ff.head_in_ft(slope) * ff.flow_unit
+
+
+class Network:
+    """Nodes and links, added one at a time, then solved all at once.
+    Junctions have an unknown head and a demand (gal/min taken out there, 0 for a plain tee). Fixed nodes (supplies and
+    fixtures) have a known head. Pipes lose head going from start to end, pumps gain it."""
+
+    def __init__(self):
+        self.nodes = {}
+        self.fixed_heads = {}
+        self.elevations = {}
+        self.demands = {}
+        self.links = {}
+        self.pipes = []
+        self.pumps = []
+
+    def add_junction(self, name, elevation=0., demand=0.):
+        self.nodes[name] = len(self.nodes)
+        self.elevations[name] = elevation
+        self.demands[name] = demand
+
+    def add_supply(self, name, head=0.):
+        """Somewhere water comes from at a known head, like the open tank the pumps draw from"""
+        self.nodes[name] = len(self.nodes)
+        self.elevations[name] = head
+        self.fixed_heads[name] = head
+
+    def add_fixture(self, name, elevation):
+        """Somewhere water leaves to the air, so its head is its elevation"""
+        self.nodes[name] = len(self.nodes)
+        self.elevations[name] = elevation
+        self.fixed_heads[name] = elevation
+
+    def add_pipe(self, name, start, end, length, diameter, k_sum=0.):
+        self.links[name] = len(self.links)
+        self.pipes.append((name, start, end, length, diameter, k_sum))
+
+    def add_pump(self, name, start, end, pump, series=1, parallel=1):
+        """series pumps of that type (see pumps.CATALOGUE) in a row, parallel of those rows side by side.
+        Raises ValueError for no pumps, or more than pumps.MAX_PARALLEL side by side."""
+        if series < 1 or not 1 <= parallel <= pumps.MAX_PARALLEL:
+            raise ValueError(f"{series} in series and {parallel} in parallel isn't a bank of pumps there's room for "
+                             f"(1 to {pumps.MAX_PARALLEL} in parallel)")
+        self.links[name] = len(self.links)
+        self.pumps.append((name, start, end, pump, series, parallel))
+
+    def incidence(self):
+        """Link-node incidence as two sparse matrices, one for the junctions and one for the fixed nodes.
+        +1 where a link starts, -1 where it ends, so incidence @ heads is the head across every link."""
+        # scipy.sparse only gets imported by something that solves a network, not everything that imports this
+        from scipy import sparse
+        junctions = [name for name in self.nodes if name not in self.fixed_heads]
+        fixed = list(self.fixed_heads)
+        column = {name: i for i, name in enumerate(junctions)}
+        column.update({name: i for i, name in enumerate(fixed)})
+        ends = [(start, end) for _, start, end, *_ in self.pipes] + [(start, end) for _, start, end, *_ in self.pumps]
+        order = [self.links[name] for name, *_ in self.pipes] + [self.links[name] for name, *_ in self.pumps]
+
+        matrices = []
+        for group in (junctions, fixed):
+            members = set(group)
+            rows, columns, values = [], [], []
+            for link, (start, end) in zip(order, ends):
+                for node, sign in ((start, 1.), (end, -1.)):
+                    if node in members:
+                        rows.append(link)
+                        columns.append(column[node])
+                        values.append(sign)
+            matrices.append(sparse.csr_matrix((values, (rows, columns)), shape=(len(self.links), len(group))))
+        return junctions, fixed, matrices[0], matrices[1]
+
+    def tables(self):
+        """Pipes and pumps as arrays, for working out every link's head at once"""
+        pipe_index = np.array([self.links[name] for name, *_ in self.pipes], dtype=int)
+        length, diameter, k_sum = np.array([pipe[3:6] for pipe in self.pipes], dtype=float).reshape(-1, 3).T
+        pump_index = np.array([self.links[name] for name, *_ in self.pumps], dtype=int)
+        shutoff, coefficient = pumps.coefficients([pump[3] for pump in self.pumps])
+        series, parallel = np.array([pump[4:6] for pump in self.pumps], dtype=float).reshape(-1, 2).T
+        return pipe_index, diameter, length, k_sum, pump_index, shutoff, coefficient, series, parallel
+
+    def link_heads(self, flows, tables=None):
+        """Head every link loses at flows (a pump's is negative), and the derivatives of those"""
+        pipe_index, diameter, length, k_sum, pump_index, shutoff, coefficient, series, parallel = tables or self.tables()
+        heads = np.zeros(len(self.links))
+        slopes = np.zeros(len(self.links))
+        heads[pipe_index], slopes[pipe_index] = pipe_losses(flows[pipe_index], diameter, length, k_sum)
+        per_pump = flows[pump_index] / parallel
+        heads[pump_index] = -series * (shutoff - coefficient * per_pump ** 2)
+        slopes[pump_index] = series * 2 * coefficient * per_pump / parallel
+        return heads, np.maximum(slopes, MIN_SLOPE)
+
+    def solve(self, guess=None, ftol=1e-8, tol=1e-12, max_iterations=100):
+        """Flows through every link and heads at every node. guess is starting flows by link name (1 gal/min for any
+        link left out, and any name that isn't a link here is ignored). Converged once every link's head and every
+        junction's flow balance are within ftol, or a step changes nothing by more than tol relative (and they're
+        within 1000 ftol).
+        Returns flows (by link name), heads (by node name), whether it converged and how many iterations it took."""
+        from scipy import sparse
+        from scipy.sparse.linalg import spsolve
+        junctions, fixed, B, B0 = self.incidence()
+        fixed_heads = np.array([self.fixed_heads[name] for name in fixed])
+        demands = np.array([self.demands[name] for name in junctions])
+        flows = np.ones(len(self.links))
+        for name, flow in (guess or {}).items():
+            if name in self.links:
+                flows[self.links[name]] = flow
+        heads = np.zeros(len(junctions))
+        BT = B.T.tocsr()
+        tables = self.tables()
+
+        def residuals(flows, heads):
+            energy = self.link_heads(flows, tables)[0] - B @ heads - B0 @ fixed_heads
+            return energy, BT @ flows + demands
+
+        energy, mass = residuals(flows, heads)
+        converged = False
+        iterations = 0
+        while iterations < max_iterations:
+            if max(np.abs(energy).max(), np.abs(mass).max(initial=0)) <= ftol:
+                converged = True
+                break
+            iterations += 1
+
+            # Newton: G dq - B dh = -energy, B^T dq = -mass. Putting dq = (B dh - energy) / G into the second
+            # leaves (B^T G^-1 B) dh = -mass + B^T G^-1 energy
+            inverse = 1 / self.link_heads(flows, tables)[1]
+            schur = (BT @ sparse.diags(inverse) @ B).tocsc()
+            dh = spsolve(schur, BT @ (inverse * energy) - mass) if len(junctions) else np.zeros(0)
+            dq = inverse * (B @ dh - energy)
+
+            # Halve the step until it brings the residuals down
+            norm = (energy ** 2).sum() + (mass ** 2).sum()
+            alpha = 1.
+            for _ in range(30):
+                trial_energy, trial_mass = residuals(flows + alpha * dq, heads + alpha * dh)
+                if (trial_energy ** 2).sum() + (trial_mass ** 2).sum() < norm:
+                    break
+                alpha /= 2
+            flows, heads = flows + alpha * dq, heads + alpha * dh
+            energy, mass = trial_energy, trial_mass
+
+            if np.abs(alpha * dq).max() <= tol * np.abs(flows).max():
+                converged = max(np.abs(energy).max(), np.abs(mass).max(initial=0)) <= 1000 * ftol
+                break
+
+        flows = {name: flows[i] for name, i in self.links.items()}
+        heads = dict(zip(junctions, heads.tolist()))
+        heads.update(self.fixed_heads)
+        return flows, heads, converged, iterations
+
+    def pressures(self, heads):
+        """Pressure head (ft) at every node: head minus elevation"""
+        return {name: head - self.elevations[name] for name, head in heads.items()}
+
+
+def building(d, pump, series, closed=()):
+    """The building in network.SEGMENTS as a Network, with series pumps of type pump drawing from an open tank at the
+    bottom of the main pipe. Pipe n ends at node n, which is fixture n's outlet if the pipe ends at a fixture.
+    Fixtures in closed (numbered 1-12 like fl1..fl12) are turned off, so the pipe going to them is left out.
+    The pumps count as one row of series, like solver_functions.head_losses (which doesn't split the flow between
+    pumps in parallel)."""
+    system = Network()
+    system.add_supply("tank", 0.)
+    system.add_junction("pumps", 0.)
+    system.add_pump("pump", "tank", "pumps", pump, series)
+    for number, length, KLs, rise, diameter, upstream, fixture in network.SEGMENTS:
+        if fixture in closed:
+            continue
+        # Everything going up on the way here (pipes aren't in order, 24 feeds 14)
+        elevation, pipe = 0., number
+        while pipe is not None:
+            elevation += network.SEGMENTS[pipe - 1][3]
+            pipe = network.UPSTREAM[pipe - 1]
+        if fixture is None:
+            system.add_junction(number, elevation)
+        else:
+            system.add_fixture(number, elevation)
+        system.add_pipe(f"pipe {number}", "pumps" if upstream is None else upstream, number, length, d[diameter],
+                        sum(KLs))
+    return system
+
+
+# Pipe ending at each fixture
+OUTLETS = {fixture: number for number, *_, fixture in network.SEGMENTS if fixture is not None}
+
+
+def fixture_flows(flows):
+    """The 12 fixture flowrates (fl1..fl12) out of a building's solved link flows, 0 for any that are closed"""
+    return [flows.get(f"pipe {OUTLETS[fixture]}", 0.) for fixture in range(1, network.NUMBER_OF_FIXTURES + 1)]
+
+
+def solve_building(d, pump, series, guess=None):
+    """Operating point of the building, same as solver_functions.solve_head_losses for that number of pumps in series.
+    guess is 12 fixture flowrates to start from (1 gal/min in every pipe if not given).
+    Returns the fixture flowrates, whether it converged (with every one at least 1 gpm) and how many iterations."""
+    system = building(d, pump, series)
+    if guess is not None:
+        pipe_flows = network.segment_flows(guess)
+        guess = {f"pipe {number}": flow for number, flow in zip(range(1, len(pipe_flows) + 1), pipe_flows)}
+        guess["pump"] = pipe_flows[0]
+    flows, _, converged, iterations = system.solve(guess)
+    flowrates = fixture_flows(flows)
+    return flowrates, converged and min(flowrates) >= 1, iterations
+
+
+def ring_main(fixtures, d=1., length=3., branch=4.):
+    """A pump feeding a loop of pipe with a fixture hanging off every tee, for trying looped networks and seeing how
+    the solver scales with the number of pipes. The loop closes back on itself after the last fixture.
+    Another pump goes in parallel for every 20 fixtures, up to pumps.MAX_PARALLEL."""
+    system = Network()
+    system.add_supply("tank", 0.)
+    system.add_junction("pumps", 0.)
+    system.add_pump("pump", "tank", "pumps", "A", 3, min(1 + fixtures // 20, pumps.MAX_PARALLEL))
+    system.add_pipe("riser", "pumps", 0, 20., d, ff.bend)
+    for i in range(fixtures):
+        if i:
+            system.add_junction(i, 20.)
+        system.add_pipe(f"main {i}", i, (i + 1) % fixtures, length, d, ff.straight_tee)
+        system.add_fixture(f"fixture {i}", 24.)
+        system.add_pipe(f"branch {i}", i, f"fixture {i}", branch, d * 0.5, ff.branch_tee + ff.sink)
+    system.add_junction(0, 20.)
+    return system
+
+
+if __name__ == "__main__":
+    import time
+    import solver_functions as sf
+
+    # Every operating point the fsolve path finds, found again from scratch (1 gal/min everywhere)
+    params = sf.build_parameter_array()
+    matched = extra = missed = 0
+    worst = 0.
+    for param in params:
+        series = sf.solve_pumps_required(param[0:5], param[5], True)[0]
+        if series == 1e3:
+            continue
+        expected = sf.compute_cost_with_specifications(param, fast=True)
+        flowrates, converged, _ = solve_building(param[0:5], param[5], series)
+        if expected[2][0] == 1e3:
+            extra += converged
+        elif converged:
+            matched += 1
+            worst = max(worst, np.abs(np.array(flowrates) - expected[5]).max())
+        else:
+            missed += 1
+    print(f"{matched} of fsolve's operating points reproduced to within {worst:.1e} gal/min ({missed} not), "
+          f"plus {extra} fsolve doesn't find")
+
+    # A ring main, with water getting to each fixture both ways round
+    for fixtures in [10, 1000, 10000, 100000]:
+        system = ring_main(fixtures)
+        start = time.perf_counter()
+        flows, heads, converged, iterations = system.solve()
+        taken = time.perf_counter() - start
+        total = sum(flows[f"branch {i}"] for i in range(fixtures))
+        print(f"Ring main with {len(system.links)} links: {'converged' if converged else 'did not converge'} in "
+              f"{iterations} iterations, {taken:.3f} s, {total:.1f} gal/min total ({flows['pump']:.1f} through the pumps)")
+
+    # No more pumps side by side than there's room for
+    try:
+        Network().add_pump("pump", "tank", "pumps", "A", 1, pumps.MAX_PARALLEL + 1)
+    except ValueError:
+        print(f"More than {pumps.MAX_PARALLEL} pumps in parallel raises ValueError")
+    else:
+        raise AssertionError("a bank of too many pumps in parallel got added")
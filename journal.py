@@ -0,0 +1,84 @@
+import json
+import os
+
+# Append-only record of every solved option, one JSON object per line, written while the run is going.
+# If a run dies halfway through, everything solved so far is still in here and --resume picks up where it left off.
+# raw_data.json and the summaries get rebuilt from it at the end, so they never need anything re-solved.
+
+JOURNAL_FILE = "raw_data.jsonl"
+
+
+def key(param):
+    """What identifies an option in the journal: the five diameters and the pump type"""
+    return json.dumps(list(param))
+
+
+class Journal:
+    """Appends solved options to the journal file. Lines are flushed right away but only fsynced every batch lines
+    (and when closed), since forcing every line onto disk would cost more than the solve itself."""
+
+    def __init__(self, path=JOURNAL_FILE, resume=False, batch=50):
+        self.path = path
+        self.batch = batch
+        self.unsynced = 0
+        # A line cut off by a crash would run into the next one, so make sure appending starts on a new line
+        if resume and os.path.exists(path) and os.path.getsize(path) > 0:
+            with open(path, "rb") as file:
+                file.seek(-1, os.SEEK_END)
+                ends_clean = file.read(1) == b"\n"
+            self.file = open(path, "a")
+            if not ends_clean:
+                self.file.write("\n")
+        else:
+            self.file = open(path, "w")
+
+    def write(self, param, result, error=None):
+        """Adds one solved option. Options that raised an error are written too, but --resume solves them again."""
+        entry = {"param": list(param), "result": result}
+        if error is not None:
+            entry["error"] = error
+        self.file.write(json.dumps(entry) + "\n")
+        self.file.flush()
+        self.unsynced += 1
+        if self.unsynced >= self.batch:
+            self.sync()
+
+    def sync(self):
+        os.fsync(self.file.fileno())
+        self.unsynced = 0
+
+    def close(self):
+        if not self.file.closed:
+            self.sync()
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_journal(path=JOURNAL_FILE, skip_errors=False):
+    """Every option in the journal, as a dict from key(param) to its result. Later lines win over earlier ones.
+    A half-written last line (from a run that got killed) is ignored. skip_errors leaves out options that errored."""
+    solved = {}
+    if not os.path.exists(path):
+        return solved
+    with open(path, "r") as file:
+        for line in file:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if skip_errors and "error" in entry:
+                solved.pop(key(entry["param"]), None)
+                continue
+            solved[key(entry["param"])] = entry["result"]
+    return solved
+
+
+def rebuild(params, path=JOURNAL_FILE):
+    """Results for params in the same order as params, straight from the journal. None for anything not in it."""
+    solved = read_journal(path)
+    return [solved.get(key(param)) for param in params]
@@ -0,0 +1,117 @@
+import json
+import sys
+from time import perf_counter
+import float_functions
+import solver_functions
+
+# Where the time goes. Every option (or every batched chunk of them) gets a record of how long it took, how much of
+# that was each stage (design point cascade, pump sizing, operating point, costs), how hard fsolve worked and how often
+# friction had to fall back on Haaland. The solvers just keep running totals (solver_functions.stage_times and friends),
+# so a record is the difference between before and after. Records go one JSON object per line into
+# logs/run_*.metrics.jsonl next to the run's log, and summary() adds them up.
+
+STAGES = tuple(solver_functions.stage_times)
+
+
+def snapshot():
+    """Every running total the solvers keep, as they are right now"""
+    totals = dict(solver_functions.stage_times)
+    totals["nfev"] = solver_functions.fsolve_stats["nfev"]
+    totals["batch_iterations"] = solver_functions.counters["batch_iterations"]
+    # background_functions only counts if something's loaded it (see solver_functions.kernel)
+    unum_fallbacks = sys.modules["background_functions"].fallbacks["Haaland"] if "background_functions" in sys.modules \
+        else 0
+    totals["Haaland"] = unum_fallbacks + float_functions.fallbacks["Haaland"]
+    return totals
+
+
+def measure(function, *args, **fields):
+    """Calls function(*args) and returns what it returns, along with its record: fields, the total seconds, what went
+    into each of the running totals in between, and fsolve's exit flag and final residual norm (None if it didn't run,
+    like for a cached or batched option)"""
+    solver_functions.fsolve_stats.update(ier=None, residual_norm=None)
+    before = snapshot()
+    start = perf_counter()
+    result = function(*args)
+    seconds = perf_counter() - start
+    after = snapshot()
+
+    record = dict(fields, seconds=seconds)
+    record.update({name: after[name] - before[name] for name in before})
+    record.update(ier=solver_functions.fsolve_stats["ier"], residual_norm=solver_functions.fsolve_stats["residual_norm"])
+    return result, record
+
+
+class MetricsLog:
+    """Appends records to a metrics file as they come in, like journal.Journal does with results"""
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "w")
+
+    def write(self, record):
+        self.file.write(json.dumps(record) + "\n")
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read(path):
+    """Every record in a metrics file, one at a time"""
+    with open(path, "r") as file:
+        for line in file:
+            if line.strip():
+                yield json.loads(line)
+
+
+def summary(records, slowest=5):
+    """Where the time went: every stage's total and share, fsolve's work, Haaland fallbacks and the slowest options"""
+    options, seconds = 0, 0.
+    stages = {stage: 0. for stage in STAGES}
+    nfev, solves, failed, iterations, haaland, worst = 0, 0, 0, 0, 0, 0.
+    slow = []
+    for record in records:
+        options += record.get("options", 1)
+        seconds += record["seconds"]
+        for stage in STAGES:
+            stages[stage] += record[stage]
+        nfev += record["nfev"]
+        iterations += record["batch_iterations"]
+        haaland += record["Haaland"]
+        if record["ier"] is not None:
+            solves += 1
+            if record["ier"] != 1:
+                failed += 1
+            else:
+                worst = max(worst, record["residual_norm"])
+        if "option" in record:
+            slow = sorted(slow + [(record["seconds"], record["option"])], reverse=True)[0:slowest]
+
+    if not options:
+        return "No metrics recorded.\n"
+    stages["other"] = seconds - sum(stages.values())
+    text = f"Where the time went, over {options} options ({seconds:.2f} s):\n"
+    text += f"{'':<18}{'seconds':>10}{'share':>8}{'ms per option':>15}\n"
+    for stage, total in stages.items():
+        text += f"{stage:<18}{total:>10.3f}{total / seconds if seconds else 0:>8.1%}{total / options * 1000:>15.3f}\n"
+    if solves:
+        text += (f"fsolve: {nfev} function evaluations over {solves} operating points ({nfev / solves:.1f} each), "
+                 f"{failed} didn't converge, largest final residual norm of the rest {worst:.1e} ft\n")
+    if iterations:
+        text += f"Batched Newton: {iterations} iterations\n"
+    text += f"Friction fell back on Haaland {haaland} times\n"
+    if slow:
+        text += "Slowest options: " + ", ".join(f"{option} ({time * 1000:.1f} ms)" for time, option in slow) + "\n"
+    return text
+
+
+if __name__ == "__main__":
+    # Summary of a metrics file from an earlier run
+    print(summary(read(sys.argv[1])), end="")
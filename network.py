@@ -0,0 +1,168 @@
+import numpy as np
+from math import pi
+import float_functions as ff
+from float_functions import branch_tee, straight_tee, toilet, sink, bend
+
+# The whole building as a table instead of 26 hand-written hlN functions.
+# Everything coming in or going out of this module is a plain number in the same units the solvers use:
+# flowrates in gal/min (fl1..fl12, one per fixture), diameters in inches (the usual five), heads in ft.
+# The array functions also take a stack of configurations at once: (N, 12) flowrates with (N, 5) diameters.
+
+# Every pipe, numbered like hl1..hl26 in background_functions (see diagram).
+# Diameter is which of the five diameters the pipe uses, upstream is the number of the pipe feeding it
+# and fixture is the fixture (1-12, same as fl1..fl12) it ends at, if it ends at one.
+SEGMENTS = [
+    # number, length (ft), KLs, rise (ft), diameter, upstream, fixture
+    (1, 20, [], 20, 0, None, None),  # main pipe from the pumps up to the first floor
+    (2, 3, [branch_tee], 0, 1, 1, None),
+    (3, 4, [branch_tee, toilet], 4, 2, 2, 1),
+    (4, 3, [straight_tee], 0, 1, 2, None),
+    (5, 4, [branch_tee, toilet], 4, 2, 4, 2),
+    (6, 3, [straight_tee], 0, 1, 4, None),
+    (7, 4, [branch_tee, toilet], 4, 2, 6, 3),
+    (8, 7.5, [straight_tee, bend * 2], 0, 1, 6, None),
+    (9, 4, [branch_tee, sink], 4, 2, 8, 4),
+    (10, 3, [straight_tee], 0, 1, 8, None),
+    (11, 4, [branch_tee, sink], 4, 2, 10, 5),
+    (12, 3, [straight_tee], 0, 1, 10, None),
+    (13, 20, [straight_tee], 20, 0, 1, None),  # main pipe from the first floor up to the second
+    (14, 4, [branch_tee, toilet], 4, 4, 24, 7),
+    (15, 3, [straight_tee], 0, 3, 24, None),
+    (16, 4, [branch_tee, toilet], 4, 4, 15, 8),
+    (17, 3, [straight_tee], 0, 3, 15, None),
+    (18, 4, [branch_tee, toilet], 4, 4, 17, 9),
+    (19, 7.5, [straight_tee, bend * 2], 0, 3, 17, None),
+    (20, 4, [branch_tee, sink], 4, 4, 19, 10),
+    (21, 3, [straight_tee], 0, 3, 19, None),
+    (22, 4, [branch_tee, sink], 4, 4, 21, 11),
+    (23, 3, [straight_tee], 0, 3, 21, None),
+    (24, 3, [bend], 0, 3, 13, None),
+    (25, 4, [bend, sink], 4, 2, 12, 6),
+    (26, 4, [bend, sink], 4, 4, 23, 12),
+]
+
+# Pairs of fixtures whose paths from the pumps must need the same head, in the same order as the residuals in
+# solver_functions.head_losses. The first five are the top floor, the next five the bottom floor, the last is the split.
+LOOPS = [(12, 11), (11, 10), (10, 9), (9, 8), (8, 7), (6, 5), (5, 4), (4, 3), (3, 2), (2, 1), (1, 7)]
+
+NUMBER_OF_FIXTURES = 12
+
+# Columns of the table as arrays, in SI, indexed by pipe number - 1
+LENGTH = np.array([seg[1] for seg in SEGMENTS]) * ff.ft
+K_SUM = np.array([sum(seg[2]) for seg in SEGMENTS], dtype=float)
+RISE = np.array([seg[3] for seg in SEGMENTS]) * ff.ft
+DIAMETER_CLASS = np.array([seg[4] for seg in SEGMENTS])
+UPSTREAM = [seg[5] for seg in SEGMENTS]
+
+# The same columns as plain floats, for working out one pipe at a time (see hl)
+SCALAR_COLUMNS = list(zip(LENGTH.tolist(), K_SUM.tolist(), RISE.tolist()))
+
+
+def build_paths():
+    """Walks upstream from every fixture to the pumps. Returns a (fixtures x pipes) array with a 1 wherever the pipe
+    is on that fixture's path. Its transpose turns fixture flows into pipe flows."""
+    paths = np.zeros((NUMBER_OF_FIXTURES, len(SEGMENTS)))
+    for number, *_, fixture in SEGMENTS:
+        if fixture is None:
+            continue
+        pipe = number
+        while pipe is not None:
+            paths[fixture - 1, pipe - 1] = 1
+            pipe = UPSTREAM[pipe - 1]
+    return paths
+
+
+PATHS = build_paths()
+
+# Turns the 12 fixture heads into the 11 loop residuals
+LOOP_MATRIX = np.zeros((len(LOOPS), NUMBER_OF_FIXTURES))
+for row, (first, second) in enumerate(LOOPS):
+    LOOP_MATRIX[row, first - 1] = 1
+    LOOP_MATRIX[row, second - 1] = -1
+
+
+def segment_flows(flowrates):
+    """Flow through every pipe (gal/min) given the flow out of every fixture (gal/min)."""
+    return np.asarray(flowrates, dtype=float) @ PATHS
+
+
+def segment_heads(flowrates, d):
+    """Head (ft) needed to push the right flow through each of the 26 pipes, all at once.
+    Entry i is what hl(i+1) would give. Same math as background_functions.hLtotal, elevation included."""
+    q = segment_flows(flowrates) * ff.flow_unit
+    D = np.asarray(d, dtype=float)[..., DIAMETER_CLASS] * ff.diameter_unit
+    v = q / (pi / 4 * D ** 2)
+    f = ff.friction(ff.epsilon, D, ff.rhoWater * v * D / ff.muWater)
+    return ff.head_in_ft(v ** 2 / 2 / ff.grav * (f * LENGTH / D + K_SUM) + RISE)
+
+
+def segment_head_slopes(flowrates, d):
+    """Derivative of each pipe's head (ft) with respect to the flow through it (gal/min), friction included.
+    h = v^2 / 2g (f L / D + K) + z with v = q / A and Re = rho v D / mu, so
+    dh/dq = v / (g A) (f L / D + K) + v^2 / 2g L / D df/dRe rho D / (mu A)."""
+    q = segment_flows(flowrates) * ff.flow_unit
+    D = np.asarray(d, dtype=float)[..., DIAMETER_CLASS] * ff.diameter_unit
+    A = pi / 4 * D ** 2
+    v = q / A
+    Re = ff.rhoWater * v * D / ff.muWater
+    f = ff.friction(ff.epsilon, D, Re)
+    df = ff.friction_derivative(ff.epsilon, D, Re)
+    slope = v / ff.grav / A * (f * LENGTH / D + K_SUM) + v ** 2 / 2 / ff.grav * LENGTH / D * df * ff.rhoWater * D / ff.muWater / A
+    return ff.head_in_ft(slope) * ff.flow_unit
+
+
+def fixture_heads_jacobian(flowrates, d):
+    """(12 x 12) derivative of fixture_heads with respect to the fixture flowrates. Each pipe's slope shows up
+    wherever two fixtures share that pipe."""
+    return (PATHS * segment_head_slopes(flowrates, d)[..., None, :]) @ PATHS.T
+
+
+def fixture_heads(flowrates, d):
+    """Head (ft) the pumps have to supply to push each fixture's flow all the way along its path."""
+    return segment_heads(flowrates, d) @ PATHS.T
+
+
+def loop_residuals(flowrates, d):
+    """The 11 differences in head between neighbouring fixtures. All zero when the flows are consistent."""
+    return fixture_heads(flowrates, d) @ LOOP_MATRIX.T
+
+
+def hl(number, flow, d, fast=True):
+    """Head (ft) needed to push flow (gal/min) through just pipe number, picking its diameter out of d (in).
+    fast=False goes through the hand-written hlN in background_functions instead, with units."""
+    diameter = d[DIAMETER_CLASS[number - 1]]
+    if not fast:
+        import background_functions as bf
+        return getattr(bf, f"hl{number}")(flow * bf.flow_unit, diameter * bf.diameter_unit).asNumber(bf.ft)
+    # Plain Python floats all the way through, numpy is slower than the math itself for one number
+    length, k_sum, rise = SCALAR_COLUMNS[number - 1]
+    D = float(diameter) * ff.diameter_unit
+    v = flow * ff.flow_unit / (pi / 4 * D ** 2)
+    f = ff.friction_single(ff.epsilon, D, ff.rhoWater * v * D / ff.muWater)
+    return ff.head_in_ft(ff.hLtotal(f, length, D, [k_sum], v) + rise)
+
+
+# Checks the table against the hand-written functions with units, pipe by pipe, then both kernels against every row of
+# raw_data.json and against each other. Raises AssertionError (and exits non-zero) if anything's off.
+def table_error():
+    """Worst relative difference between the head loss of every pipe, from the table (one at a time and all at once),
+    and the hlN functions in background_functions, over a handful of flows and diameters"""
+    worst = 0
+    for flow in [0.5, 1, 3.7, 12, 40]:
+        for d in [[0.5] * 5, [0.75] * 5, [1] * 5, [1, 0.75, 0.5, 1, 0.75]]:
+            heads = segment_heads(np.full(NUMBER_OF_FIXTURES, flow / 6), d)
+            flows = segment_flows(np.full(NUMBER_OF_FIXTURES, flow / 6))
+            for number in range(1, len(SEGMENTS) + 1):
+                with_units = hl(number, flows[number - 1], d, fast=False)
+                worst = max(worst, abs(heads[number - 1] - with_units) / abs(with_units),
+                            abs(hl(number, flows[number - 1], d) - with_units) / abs(with_units))
+    return worst
+
+
+if __name__ == "__main__":
+    # Whether both kernels still solve every option the same, and the same as before, is in test_network.py
+    ff.check_units()
+    print("Constants match background_functions")
+    worst = table_error()
+    print(f"Worst relative difference from the hlN functions: {worst}")
+    assert worst < 1e-9, f"the pipe table is {worst} off the hlN functions"
@@ -1,39 +1,115 @@
+import argparse
 import json
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
 from datetime import datetime as dt
+from design_space import DesignSpace
+from aggregate import Collector
+from cache import SolutionCache
+import columnar
 from time import time as now
-from display import summary, time_str
-from solver_functions import build_parameter_array
+from display import pareto_summary, summary, time_str
+from journal import JOURNAL_FILE, Journal, key, read_journal, rebuild
+import metrics
+from search import top_system_cost
+from solver_functions import build_parameter_array, compute_costs_batched, failed_solution, sweep_order
 from solver_functions import compute_cost_with_specifications as cost
 
 logtext = ""
 
-try:
-    timetext = dt.now().strftime('%Y%m%d_%H%M%S')
+# True runs the solvers on plain floats (float_functions.py), False carries units (quantity.py) through every step.
+# Both give the same answers (test_network.py checks), the float version is just a lot faster.
+fast = True
 
+timetext = dt.now().strftime('%Y%m%d_%H%M%S')
 
-    def log(txt):
-        """Logs message to console and .log file."""
-        print(txt)
-        global logtext
-        logtext += txt
 
+def log(txt):
+    """Logs message to console and .log file."""
+    print(txt)
+    global logtext
+    logtext += txt
 
-    def solve_all(params):
-        """Main solver function. Iterates through params, computing the cost breakdown and details of each set of parameters"""
-        # Instantiate results list
-        results = []
 
-        # Start timer
-        function_timer = now()
+def solve_chunk(chunk, cache=None, batched=False):
+    """Solves a list of (index, parameters) pairs. This is what runs in the worker processes.
+    Errors are caught one configuration at a time so a single bad one can't take the rest of the run down with it;
+    it comes back as a placeholder row (like one that didn't converge) along with the error message.
+    cache (a cache.SolutionCache) is checked before solving anything.
+    batched solves the whole chunk's operating points together (see solver_functions.compute_costs_batched).
+    Returns (index, result, error) for every option and the metrics records (see metrics.py), one per option, or just
+    one for the whole chunk if it was batched."""
+    if batched:
+        try:
+            results, record = metrics.measure(compute_costs_batched, [param for _, param in chunk], cache,
+                                              options=len(chunk))
+            return [(index, result, None) for (index, _), result in zip(chunk, results)], [record]
+        except Exception:
+            # Go through them one at a time instead, so the error ends up with the option that caused it
+            pass
+
+    solved, records = [], []
+    for index, param in chunk:
+        try:
+            result, record = metrics.measure(cost, param, fast, cache, option=param)
+            solved.append((index, result, None))
+            records.append(record)
+        except Exception as ex:
+            solved.append((index, failed_solution(param), f"{param}: {ex!r}"))
+    return solved, records
+
+
+def make_chunks(params, chunksize):
+    """Splits params into lists of (index, parameters) pairs, about chunksize at a time. Options next to each other
+    with the same diameters (the different pumps) always go in the same chunk, so they can share a design point."""
+    chunks = [[]]
+    for index, param in enumerate(params):
+        if len(chunks[-1]) >= chunksize and param[0:5] != chunks[-1][-1][1][0:5]:
+            chunks.append([])
+        chunks[-1].append((index, param))
+    return [chunk for chunk in chunks if chunk]
+
+
+def solve_all(params, workers=1, chunksize=None, journal=None, cache=None, batched=False, collector=None,
+              metrics_log=None):
+    """Main solver function. Iterates through params, computing the cost breakdown and details of each set of parameters.
+    With more than one worker, chunks of params are handed out to a pool of processes. Results always come back in
+    the same order as params. Every result is also appended to journal (if given) and added to collector (an
+    aggregate.Collector, if given) as soon as it comes back, and its metrics written to metrics_log (a
+    metrics.MetricsLog, if given)."""
+    # Instantiate results list
+    results = [None] * len(params)
+
+    # Start timer
+    function_timer = now()
+
+    log(f"Executing {len(params)} solver functions...\n")
 
-        log(f"Executing {len(params)} solver functions...\n")
+    # Small enough chunks that every worker gets several, so the progress messages keep coming.
+    # Batched solves are better off with as big a chunk as possible, so there it's just one per worker.
+    if chunksize is None and batched:
+        chunksize = max(1, -(-len(params) // workers))
+    elif chunksize is None:
+        chunksize = max(1, min(10, len(params) // (4 * workers)))
+    chunks = make_chunks(params, chunksize)
 
-        # Iterate
-        counter = 0
-        for param in params:
+    # Keeps the log messages and ETA going no matter which worker a chunk came back from
+    counter = 0
 
-            # Compute and store
-            results.append(cost(param))
+    def record(chunk):
+        nonlocal counter
+        solved, records = chunk
+        if metrics_log is not None:
+            for entry in records:
+                metrics_log.write(entry)
+        for index, result, error in solved:
+            results[index] = result
+            if journal is not None:
+                journal.write(params[index], result, error)
+            if collector is not None:
+                collector.add(result)
+            if error is not None:
+                log(f"Error while solving {error}. Stored as not converged.\n")
 
             # Helpful log messages to let you know how far along the program is
             counter += 1
@@ -42,65 +118,170 @@ try:
                 print(f"Estimated time remaining: {time_str(time_left)}")
             if counter % 10 == 0:
                 time_taken = round(now() - function_timer)
-                log(f"{counter} options solved so far in {time_str(time_taken)}.\n")
+                so_far = f" {collector.progress()}." if collector is not None else ""
+                log(f"{counter} options solved so far in {time_str(time_taken)}.{so_far}\n")
 
-        # Report complete and return
-        time_taken = round(now() - function_timer)
-        log(f"Done! Solved {counter} functions in {time_str(time_taken)}.\n")
-        return results
+    if workers > 1:
+        log(f"Using {workers} worker processes, {len(chunks)} chunks of up to {chunksize}.\n")
+        unfinished = []
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(solve_chunk, chunk, cache, batched): chunk for chunk in chunks}
+            for future in as_completed(futures):
+                try:
+                    record(future.result())
+                except BrokenProcessPool:
+                    unfinished.append(futures[future])
 
+        # If a worker process died outright, whatever it (and the pool) didn't finish gets solved here instead
+        if unfinished:
+            log(f"A worker process died. Solving the {sum(len(c) for c in unfinished)} remaining options here.\n")
+            for chunk in unfinished:
+                record(solve_chunk(chunk, cache, batched))
+    else:
+        for chunk in chunks:
+            record(solve_chunk(chunk, cache, batched))
 
-    # Start timer
-    starttime = now()
-
-    log("Building parameter array...\n")
-
-    # Build parameters to be pushed to cost function
-    params = build_parameter_array()
-
-    log(f"Parameter array built! Time taken: {now() - starttime} seconds. {len(params)} arrays to try.\n")
-
-    # Compute all
-    solutions = solve_all(params)
+    # Report complete and return
+    time_taken = round(now() - function_timer)
+    log(f"Done! Solved {counter} functions in {time_str(time_taken)}.\n")
+    return results
 
-    # Store raw data (full-length runs usually take over an hour
-    # so being able to fetch rather than compute the data can save massive amounts of time
-    with open("raw_data.json", "w") as file:
-        json.dump(solutions, file)
 
-    # Summarize
-    log(f"Summarizing...\n")
-    top5system = sorted(solutions, key=lambda x: x[3])[0:5]
-    top5operation = sorted(solutions, key=lambda x: x[4])[0:5]
-    log(f"Summary finished. Program done in {time_str(round(now() - starttime))}.\n")
-    log(summary(top5system, "Top five with regards to system cost"))
-    log(summary(top5operation, "Top five with regards to operation cost"))
-    print("Logging data...")
-
-    # Save to .log files
+def save_logs():
+    """Saves everything logged so far to latest.log and a timestamped copy in logs"""
     with open("latest.log", "w") as file:
         file.write(logtext)
     with open(f"logs/run_{timetext}.log", "w") as file:
         file.write(logtext)
-    print("Done logging. In the future you can import the json file if you'd like to see all the raw data.")
 
-except Exception as ex:
 
-    # In case of an error during execution, attempt to save data
-    print("Error occured during execution. Attempting to save logs...")
+def index_range(text):
+    """START:STOP (either one can be left out) for --range"""
+    start, _, stop = text.partition(":")
+    return int(start or 0), int(stop) if stop else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Solves and summarizes every combination of pipe diameters and pumps.")
+    parser.add_argument("--workers", type=int, default=1, help="number of processes to solve with (default 1)")
+    parser.add_argument("--chunksize", type=int, default=None,
+                        help="options handed to a worker at a time (default picks one from the number of workers)")
+    parser.add_argument("--resume", action="store_true",
+                        help="skip options already solved in the journal from an earlier (possibly interrupted) run")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="solve everything from scratch instead of reusing solutions saved in .solution_cache")
+    parser.add_argument("--batched", action="store_true",
+                        help="solve the operating points of a whole chunk at once with vectorized Newton iterations")
+    parser.add_argument("--top", type=int, default=None, metavar="K",
+                        help="only find the K options with the lowest system cost, skipping options that can't make it")
+    parser.add_argument("--range", type=index_range, default=None, metavar="START:STOP",
+                        help="only solve options START to STOP (by index, see design_space.py), to split a sweep up. Each range "
+                             "starts its warm starts from scratch, so now and then an option converges in one way of "
+                             "splitting it up and not another")
+    args = parser.parse_args()
+
+    # A range gets its own journal and raw data file, so several ranges can run at once without clobbering each other
+    journal_file, raw_file = JOURNAL_FILE, "raw_data.json"
+    if args.range:
+        space = DesignSpace()
+        start, stop = args.range[0], len(space) if args.range[1] is None else min(args.range[1], len(space))
+        journal_file, raw_file = f"raw_data_{start}-{stop}.jsonl", f"raw_data_{start}-{stop}.json"
+
+    solutions = []
     try:
-        _ = solutions[0]
-        with open("raw_data.json", "w") as file:
+        # Start timer
+        starttime = now()
+
+        log("Building parameter array...\n")
+
+        # Build parameters to be pushed to cost function
+        if args.range:
+            params = list(space.range(start, stop))
+        else:
+            params = build_parameter_array()
+
+        log(f"Parameter array built! Time taken: {now() - starttime} seconds. {len(params)} arrays to try.\n")
+
+        # Branch and bound on system cost instead of solving everything (see search.py). Leaves the raw data file alone.
+        if args.top:
+            cache = None if args.no_cache else SolutionCache()
+            top, solved, skipped = top_system_cost(params, args.top, lambda param: cost(param, fast=fast, cache=cache))
+            log(f"Solved {solved} options, skipped {skipped} that couldn't make the top {args.top}. "
+                f"Program done in {time_str(round(now() - starttime))}.\n")
+            log(summary(top, f"Top {args.top} with regards to system cost"))
+            save_logs()
+            return
+
+        # Summaries get built up as results come in (see aggregate.py)
+        collector = Collector(5)
+
+        # Anything already in the journal doesn't need solving again (errored options get another try)
+        if args.resume:
+            already_solved = read_journal(journal_file, skip_errors=True)
+            pending = []
+            for param in params:
+                if key(param) in already_solved:
+                    collector.add(already_solved[key(param)])
+                else:
+                    pending.append(param)
+            log(f"Resuming. {len(params) - len(pending)} options already solved, {len(pending)} to go.\n")
+        else:
+            pending = params
+
+        # Solve in an order where each option is as close as possible to the one before, so every solve can start from
+        # a nearby solution (see solver_functions.warm_starts)
+        pending = [pending[i] for i in sweep_order(pending)]
+
+        # Compute all, then put everything back together in order from the journal
+        metrics_file = f"logs/run_{timetext}.metrics.jsonl"
+        with Journal(journal_file, resume=args.resume) as journal, metrics.MetricsLog(metrics_file) as metrics_log:
+            solve_all(pending, max(1, args.workers), args.chunksize, journal, None if args.no_cache else SolutionCache(),
+                      args.batched, collector, metrics_log)
+        solutions = rebuild(params, journal_file)
+
+        # Store raw data (full-length runs usually take over an hour
+        # so being able to fetch rather than compute the data can save massive amounts of time
+        # The columnar copy is what parse_json reads, without having to parse all of it (see columnar.py)
+        with open(raw_file, "w") as file:
             json.dump(solutions, file)
-        print("JSON file successfully saved")
-    except:
-        print("JSON file couldn't be saved")
-    try:
-        with open("latest.log", "w") as file:
-            file.write(logtext)
-        with open(f"logs/run_{timetext}.log", "w") as file:
-            file.write(logtext)
-        print("LOG files successfully saved")
-    except:
-        print("LOG files couldn't be saved")
-    raise ex
+        columnar.save(solutions, raw_file.replace(".json", ".columns"))
+
+        # Summarize
+        log(f"Summarizing...\n")
+        top5system = collector.rows(3)
+        top5operation = collector.rows(4)
+        log(f"{collector.not_converged} of {collector.count} options didn't converge.\n")
+        log(f"Summary finished. Program done in {time_str(round(now() - starttime))}.\n")
+        log(summary(top5system, "Top five with regards to system cost"))
+        log(summary(top5operation, "Top five with regards to operation cost"))
+        log(pareto_summary(collector.front.rows(), "Pareto front of system cost and operation cost"))
+        log(f"\n{metrics.summary(metrics.read(metrics_file))}(per option in {metrics_file})\n")
+        print("Logging data...")
+
+        # Save to .log files
+        save_logs()
+        print("Done logging. In the future you can import the json file if you'd like to see all the raw data.")
+
+    except Exception as ex:
+
+        # In case of an error during execution, attempt to save data
+        print("Error occured during execution. Attempting to save logs...")
+        print("Options solved so far are kept in the journal. Run again with --resume to pick up from there.")
+        try:
+            _ = solutions[0]
+            with open(raw_file, "w") as file:
+                json.dump(solutions, file)
+            print("JSON file successfully saved")
+        except:
+            print("JSON file couldn't be saved")
+        try:
+            save_logs()
+            print("LOG files successfully saved")
+        except:
+            print("LOG files couldn't be saved")
+        raise ex
+
+
+# Everything runs from here so worker processes can import this file without starting a run of their own
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,44 @@
+import argparse
 import json
-from display import summary
+import os
+from columnar import RESULTS_DIRECTORY, Results, save
+from display import pareto_summary, summary, write_csv, write_markdown, write_summary
 
 # This file is meant for backup use, in the case that the json file saves but the log files don't for whatever reason.
 # Also was used for testing and streamlining.
+# Works off the columnar copy of the results (see columnar.py), which only gets read as far as the summaries need.
+# It gets made from raw_data.json first if there isn't one yet, or raw_data.json is newer.
+# Every option (not just the summaries) can also be written out as a table, CSV or Markdown, see --help.
 
-with open("raw_data.json", "r") as file:
-    to_parse = json.load(file)
+parser = argparse.ArgumentParser(description="Summarizes raw_data.json again, and can write out every option.")
+parser.add_argument("--table", metavar="FILE", help="write every option to FILE, in the same table as the summaries")
+parser.add_argument("--csv", metavar="FILE", help="write every option to FILE as CSV, every number in full")
+parser.add_argument("--markdown", metavar="FILE", help="write every option to FILE as a Markdown table")
+args = parser.parse_args()
 
-top5system = sorted(to_parse, key=lambda x: x[3])[0:10]
-top5operation = sorted(to_parse, key=lambda x: x[4])[0:10]
-logtext = ""
+if not os.path.isdir(RESULTS_DIRECTORY) or \
+        os.path.getmtime("raw_data.json") > os.path.getmtime(os.path.join(RESULTS_DIRECTORY, "system_cost.npy")):
+    with open("raw_data.json", "r") as file:
+        save(json.load(file))
+
+results = Results()
+
+top5system = results.rows(results.top(3, 10))
+top5operation = results.rows(results.top(4, 10))
+logtext = f"{results.not_converged()} of {len(results)} options didn't converge.\n"
 logtext += summary(top5system, "Top ten with regards to system cost")
 logtext += summary(top5operation, "Top ten with regards to operation cost")
+logtext += pareto_summary(results.rows(results.pareto()), "Pareto front of system cost and operation cost")
 
 with open("logs/latest_json_parse.log", "w") as file:
     file.write(logtext)
+
+if args.table:
+    with open(args.table, "w") as file:
+        write_summary(results, "Every option", file)
+if args.csv:
+    with open(args.csv, "w", newline="") as file:
+        write_csv(results, file)
+if args.markdown:
+    with open(args.markdown, "w") as file:
+        write_markdown(results, file)
@@ -0,0 +1,79 @@
+from collections import namedtuple
+import numpy as np
+
+# Every pump there is to pick from, as data. Each one's curve is head (ft) = shutoff - coefficient * flow (gal/min)^2.
+# Since that's a plain quadratic, how many it takes to deliver a given flow and head comes straight out of it,
+# for one option or a whole array of them at once.
+
+Pump = namedtuple("Pump", ["shutoff", "coefficient", "price", "efficiency"])  # ft, ft/(gal/min)^2, $, fraction
+
+CATALOGUE = {
+    "A": Pump(60, 0.03, 1500, 0.9),
+    "B": Pump(40, 0.02, 800, 0.8),
+    "C": Pump(20, 0.01, 250, 0.7),
+}
+
+# Most pumps in parallel there's ever room for
+MAX_PARALLEL = 99
+
+
+def coefficients(pumps):
+    """Shutoff heads and coefficients, one per pump type in pumps"""
+    shutoff = np.array([CATALOGUE[pump].shutoff for pump in pumps], dtype=float)
+    coefficient = np.array([CATALOGUE[pump].coefficient for pump in pumps], dtype=float)
+    return shutoff, coefficient
+
+
+def head(pump, flow):
+    """Head (ft) one pump of this type gives at flow (gal/min). flow can be an array."""
+    return CATALOGUE[pump].shutoff - CATALOGUE[pump].coefficient * np.asarray(flow) ** 2
+
+
+def slope(pump, flow):
+    """d(head)/d(flow) (ft per gal/min) at flow"""
+    return -2 * CATALOGUE[pump].coefficient * np.asarray(flow)
+
+
+def pumps_required(pumps, flow, head_required):
+    """How many pumps it takes to give head_required (ft) at flow (gal/min), for arrays of pump types, flows and heads.
+    Parallel: the fewest that split the flow so each one still gives some head, so shutoff > coefficient (flow / n)^2,
+    which is n = floor(flow sqrt(coefficient / shutoff)) + 1. Series: enough of those to add up to head_required.
+    Returns arrays of the numbers in series and in parallel. Raises RuntimeError if any would need more than
+    MAX_PARALLEL in parallel."""
+    shutoff, coefficient = coefficients(np.atleast_1d(pumps))
+    flow = np.asarray(flow, dtype=float)
+    parallel = np.floor(flow * np.sqrt(coefficient / shutoff)) + 1
+
+    # Right at the edge the square root can round either way, so check against the curve itself
+    parallel += shutoff - coefficient * (flow / parallel) ** 2 <= 0
+    lower = np.maximum(parallel - 1, 1)
+    parallel = np.where(shutoff - coefficient * (flow / lower) ** 2 > 0, lower, parallel)
+
+    if (parallel > MAX_PARALLEL).any():
+        raise RuntimeError(f"Critical error occured while trying to calculate number of necessary pumps. "
+                           f"{parallel.max():.0f} in parallel were needed")
+
+    series = np.ceil(np.asarray(head_required) / (shutoff - coefficient * (flow / parallel) ** 2))
+    return series.astype(int), parallel.astype(int)
+
+
+if __name__ == "__main__":
+    # Same as stepping one pump at a time, the way it used to be done
+    def stepping(pump, flow, head_required):
+        no_parallel = 1
+        while head(pump, flow / no_parallel) <= 0:
+            no_parallel += 1
+        return [int(np.ceil(head_required / head(pump, flow / no_parallel))), no_parallel]
+
+    rng = np.random.default_rng(0)
+    names = rng.choice(list(CATALOGUE), 100000)
+    flows = rng.uniform(0, 200, len(names))
+    heads = rng.uniform(1, 500, len(names))
+    # Flows right at the edge of needing another pump in parallel
+    flows[0:3] = [np.sqrt(CATALOGUE[pump].shutoff / CATALOGUE[pump].coefficient) * 3 for pump in "ABC"]
+    names[0:3] = list("ABC")
+
+    series, parallel = pumps_required(names, flows, heads)
+    for i in range(len(names)):
+        assert [series[i], parallel[i]] == stepping(names[i], flows[i], heads[i]), (names[i], flows[i], heads[i])
+    print(f"{len(names)} random sizings match stepping one pump at a time")
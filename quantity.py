@@ -0,0 +1,199 @@
+import math
+
+# Lightweight stand-in for Unum, used by background_functions. A Quantity is a float in SI units and its dimensions:
+# how many of each of BASE_UNITS it's made of. Every unit below is a Quantity too, whose value is its size in SI units,
+# so attaching a unit is one multiplication and taking it off (asNumber) is one division.
+# Adding, subtracting, comparing or converting things with different dimensions raises DimensionError, same as Unum
+# raising on ft + s. What it doesn't keep is which units something was written in, so everything prints in SI units.
+# Unum builds a new dict of units and exponents at every step, which is most of what an hl1..hl26 call costs. Here the
+# exponents are packed into one int, a byte each (see dimensions), so multiplying two quantities just adds their
+# dimensions, dividing subtracts them and raising to a power multiplies them.
+
+BASE_UNITS = ("m", "kg", "s", "K", "mol")
+DIMENSIONLESS = 0
+
+# Exponents are packed in base 256, so each one has to stay between -128 and 127
+PACKING = 256
+
+
+class DimensionError(ValueError):
+    """Adding, comparing or converting quantities whose dimensions don't match"""
+
+
+def dimensions(vector):
+    """Packed dimensions for a vector of exponents of BASE_UNITS. Packing is linear, so the packed dimensions of a
+    product are the sum of the two packed dimensions, and so on."""
+    return sum(int(exponent) * PACKING ** i for i, exponent in enumerate(vector))
+
+
+def exponents(packed):
+    """Vector of exponents of BASE_UNITS from packed dimensions"""
+    vector = []
+    for _ in BASE_UNITS:
+        exponent = (packed + PACKING // 2) % PACKING - PACKING // 2
+        vector.append(exponent)
+        packed = (packed - exponent) // PACKING
+    return tuple(vector)
+
+
+class Quantity:
+    """value (SI units) with dimensions (packed exponents of BASE_UNITS, see dimensions()). Plain numbers work as
+    dimensionless quantities."""
+    __slots__ = ("value", "dimensions")
+
+    # numpy scalars (numpy.pi, anything out of an array) hand arithmetic with a Quantity over to the Quantity instead
+    # of trying to make an array out of it
+    __array_ufunc__ = None
+
+    def __init__(self, value, dimensions=DIMENSIONLESS):
+        self.value = value
+        self.dimensions = dimensions
+
+    def same(self, other):
+        """other's value, if it has the same dimensions as this"""
+        if type(other) is Quantity:
+            if other.dimensions == self.dimensions:
+                return other.value
+        elif self.dimensions == DIMENSIONLESS:
+            return other
+        raise DimensionError(f"{self} and {other} don't have the same dimensions")
+
+    def __add__(self, other):
+        return Quantity(self.value + self.same(other), self.dimensions)
+
+    def __radd__(self, other):
+        return Quantity(self.same(other) + self.value, self.dimensions)
+
+    def __sub__(self, other):
+        return Quantity(self.value - self.same(other), self.dimensions)
+
+    def __rsub__(self, other):
+        return Quantity(self.same(other) - self.value, self.dimensions)
+
+    def __mul__(self, other):
+        if type(other) is Quantity:
+            return Quantity(self.value * other.value, self.dimensions + other.dimensions)
+        return Quantity(self.value * other, self.dimensions)
+
+    def __rmul__(self, other):
+        return Quantity(other * self.value, self.dimensions)
+
+    def __truediv__(self, other):
+        if type(other) is Quantity:
+            return Quantity(self.value / other.value, self.dimensions - other.dimensions)
+        return Quantity(self.value / other, self.dimensions)
+
+    def __rtruediv__(self, other):
+        return Quantity(other / self.value, -self.dimensions)
+
+    def __pow__(self, exponent):
+        if type(exponent) is int:
+            return Quantity(self.value ** exponent, self.dimensions * exponent)
+        if self.dimensions == DIMENSIONLESS:
+            return Quantity(self.value ** exponent)
+        # Something like a square root only works out if every exponent stays whole
+        vector = [power * exponent for power in exponents(self.dimensions)]
+        if any(power != int(power) for power in vector):
+            raise DimensionError(f"{self} to the power of {exponent} doesn't have whole dimensions")
+        return Quantity(self.value ** exponent, dimensions(vector))
+
+    def __neg__(self):
+        return Quantity(-self.value, self.dimensions)
+
+    def __pos__(self):
+        return self
+
+    def __abs__(self):
+        return Quantity(abs(self.value), self.dimensions)
+
+    def __eq__(self, other):
+        if type(other) is Quantity:
+            return self.dimensions == other.dimensions and self.value == other.value
+        return self.dimensions == DIMENSIONLESS and self.value == other
+
+    __hash__ = None
+
+    def __lt__(self, other):
+        return self.value < self.same(other)
+
+    def __le__(self, other):
+        return self.value <= self.same(other)
+
+    def __gt__(self, other):
+        return self.value > self.same(other)
+
+    def __ge__(self, other):
+        return self.value >= self.same(other)
+
+    def __float__(self):
+        return float(self.asNumber())
+
+    def asNumber(self, unit=None):
+        """Plain number of unit (a Quantity) this comes out to, like Unum's. No unit means it has to be dimensionless."""
+        if unit is None:
+            if self.dimensions != DIMENSIONLESS:
+                raise DimensionError(f"{self} isn't dimensionless")
+            return self.value
+        if unit.dimensions != self.dimensions:
+            raise DimensionError(f"{self} can't be given in {unit}")
+        return self.value / unit.value
+
+    def __repr__(self):
+        units = " ".join(name if exponent == 1 else f"{name}{exponent:g}"
+                         for name, exponent in zip(BASE_UNITS, exponents(self.dimensions)) if exponent != 0)
+        return f"{self.value} [{units}]"
+
+
+# SI
+m = Quantity(1., dimensions([1, 0, 0, 0, 0]))
+kg = Quantity(1., dimensions([0, 1, 0, 0, 0]))
+s = Quantity(1., dimensions([0, 0, 1, 0, 0]))
+K = Quantity(1., dimensions([0, 0, 0, 1, 0]))
+mol = Quantity(1., dimensions([0, 0, 0, 0, 1]))
+mm = 1e-3 * m
+L = 1e-3 * m ** 3
+J = kg * m ** 2 / s ** 2
+W = J / s
+Pa = kg / m / s ** 2
+
+# The ones background_functions uses, defined the same way as in units.py
+lb = 0.4535924 * kg
+ft = 0.3048 * m
+inch = 1 / 12 * ft
+gal = 3.785412 * L
+psi = 101325 / 14.7 * Pa
+minute = 60 * s
+hr = 60 * minute
+day = 24 * hr
+year = 365.25 * day
+month = year / 12
+kW = 1000 * W
+kWh = kW * hr
+
+# Flow in the units the solvers take it in
+gpm = gal / minute
+
+# Every unit above, by name
+UNITS = {name: unit for name, unit in globals().items() if type(unit) is Quantity}
+
+
+if __name__ == "__main__":
+    import units
+
+    # Every unit comes out the same size as units.py's Unum one
+    for name, unit in UNITS.items():
+        vector = exponents(unit.dimensions)
+        si = 1 * units.m ** vector[0] * units.kg ** vector[1] * units.s ** vector[2] * units.K ** vector[3] * \
+             units.mol ** vector[4]
+        unum = 1 * getattr(units, name) if hasattr(units, name) else 1 * units.gal / units.minute
+        assert math.isclose(unit.value, unum.asNumber(si), rel_tol=1e-12), f"{name}: {unit} != {unum}"
+
+    # Mixing up dimensions still gets caught
+    for mistake in [lambda: ft + s, lambda: ft < s, lambda: (gal / minute).asNumber(ft), lambda: ft.asNumber(),
+                    lambda: 1 + ft, lambda: float(kWh)]:
+        try:
+            mistake()
+        except DimensionError:
+            continue
+        raise AssertionError("mixed up dimensions weren't caught")
+    print(f"All {len(UNITS)} units match units.py, and mixed up dimensions raise DimensionError")
@@ -0,0 +1,45 @@
+import math
+import batch
+import pumps
+from aggregate import TopK
+from solver_functions import compute_cost_with_specifications, count_system_pipe_cost
+
+# Finds the cheapest options to build without solving every option.
+# Pipe cost is just arithmetic and pump prices are fixed, so every option's system cost has a lower bound before any
+# hydraulics get solved. Going through the options cheapest bound first, the search can stop as soon as the next bound
+# can't beat the best k found so far: nothing after it can either.
+
+
+def minimum_pumps_in_series(pump):
+    """Fewest pumps in series that could ever be enough. No pump gives more head than its shutoff head, and the water
+    has to get at least STATIC_HEAD up to the top floor, so it takes at least STATIC_HEAD / shutoff of them."""
+    return math.ceil(batch.STATIC_HEAD / pumps.CATALOGUE[pump].shutoff)
+
+
+def system_cost_lower_bound(param):
+    """Least this option's system cost could come out to: all the pipe, plus the fewest pumps it could need
+    (at least one in parallel)"""
+    return count_system_pipe_cost(param[0:5]) + pumps.CATALOGUE[param[5]].price * minimum_pumps_in_series(param[5])
+
+
+def top_system_cost(params, k=5, solve=None):
+    """The k options with the lowest system cost, same as sorted(solutions, key=lambda x: x[3])[0:k] over all of params
+    (ties included, see aggregate.TopK), but only solving options whose lower bound can still make it into the top k.
+    solve turns one option into its result, compute_cost_with_specifications on floats by default.
+    Returns the top k results, how many options were solved and how many were skipped."""
+    if solve is None:
+        def solve(param):
+            return compute_cost_with_specifications(param, fast=True)
+
+    bounds = [system_cost_lower_bound(param) for param in params]
+    order = sorted(range(len(params)), key=lambda i: bounds[i])
+
+    best = TopK(3, k)
+    solved = 0
+    for i in order:
+        if best.full() and bounds[i] > best.worst():
+            break
+        best.add(solve(params[i]))
+        solved += 1
+
+    return best.rows(), solved, len(params) - solved
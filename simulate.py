@@ -0,0 +1,140 @@
+import numpy as np
+import batch
+import float_functions as ff
+import hydraulics
+import network
+import pumps
+from solver_functions import solve_design_point, solve_pumps_required
+
+# Operating cost from how the fixtures actually get used instead of all twelve running flat out for a whole month.
+# A usage profile says which fixtures are open at every time step (a minute, an hour, whatever). The pumps only have to
+# run while something's open, and how hard depends on which fixtures are open, so each pattern of open fixtures gets
+# its operating point solved once and reused every time it comes up again. There are at most 4096 patterns however long
+# the profile is, and they're all solved together (see batch.py). Everything else is array arithmetic over the steps.
+
+# Which fixtures are toilets (the rest are sinks), from the fittings at the end of each fixture's pipe
+TOILETS = np.array([ff.toilet in network.SEGMENTS[hydraulics.OUTLETS[fixture] - 1][2]
+                    for fixture in range(1, network.NUMBER_OF_FIXTURES + 1)])
+
+# How busy the building is at each hour of the day, relative to its average. Peaks in the morning and evening.
+DIURNAL = np.array([0.2, 0.1, 0.1, 0.1, 0.2, 0.5, 1.5, 2.6, 2.2, 1.4, 1.1, 1.0,
+                    1.1, 1.0, 0.9, 0.9, 1.0, 1.4, 1.9, 1.8, 1.5, 1.2, 0.8, 0.4])
+DIURNAL = DIURNAL / DIURNAL.mean()
+
+
+def usage_profile(days=30, step=60, toilet_uses=1., sink_uses=2., use_length=60, seed=0):
+    """Random profile: a (steps, 12) array of which fixtures are open at every step of step seconds over days.
+    Every toilet gets used toilet_uses times an hour on average (sinks sink_uses), for use_length seconds each time,
+    more often at busy times of day (see DIURNAL)."""
+    rng = np.random.default_rng(seed)
+    steps = int(days * 24 * 3600 / step)
+    hours = (np.arange(steps) * step // 3600) % 24
+    uses = np.where(TOILETS, toilet_uses, sink_uses)
+    chance = np.clip(DIURNAL[hours][:, None] * uses[None, :] * use_length / 3600, 0, 1)
+    return rng.random((steps, network.NUMBER_OF_FIXTURES)) < chance
+
+
+def patterns(profile):
+    """Every different pattern of open fixtures in profile (as a bitmask, fixture 1 in the lowest bit), in the order
+    they first come up, and which of them each step is"""
+    masks = np.asarray(profile, dtype=np.int64) @ (1 << np.arange(network.NUMBER_OF_FIXTURES))
+    unique, first, which = np.unique(masks, return_index=True, return_inverse=True)
+    order = np.argsort(first)
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    return unique[order], rank[which]
+
+
+class Building:
+    """One option (diameters, pump type and number of pumps) with the operating point of every pattern of open fixtures
+    it's been asked about so far"""
+
+    def __init__(self, d, pump, no_pumps):
+        self.d = list(d)
+        self.pump = pump
+        self.series = no_pumps[0]
+        self.operating_points = {0: (0., 0.)}
+        self.solves = 0
+
+    def solve(self, masks):
+        """Operating points for every pattern in masks at once (batch.solve_operating_points with the closed fixtures
+        held at no flow), starting from the design point flows of the open fixtures scaled to meet the pumps.
+        Anything that doesn't converge that way gets another go with hydraulics.py."""
+        open_fixtures = (np.asarray(masks)[:, None] >> np.arange(network.NUMBER_OF_FIXTURES) & 1).astype(bool)
+        n = len(masks)
+        design = solve_design_point(self.d, True)
+        design_flows = np.array(list(design[0]) + design[1]) * open_fixtures
+        guess = batch.operating_point_guess(design_flows, [ff.head_in_ft(design[3])] * n, [self.pump] * n,
+                                            [self.series] * n)
+        flows, converged, _ = batch.solve_operating_points(guess, [self.d] * n, [self.pump] * n, [self.series] * n,
+                                                           open_fixtures=open_fixtures)
+        self.solves += n
+
+        for mask, closed, row, ok in zip(masks, ~open_fixtures, flows, converged):
+            if not ok:
+                system = hydraulics.building(self.d, self.pump, self.series, np.flatnonzero(closed) + 1)
+                link_flows, _, ok, _ = system.solve()
+                row = np.array(hydraulics.fixture_flows(link_flows))
+                ok = ok and (row[~closed] >= 1).all()
+            total = row.sum()
+            self.operating_points[int(mask)] = (total, self.series * float(pumps.head(self.pump, total))) if ok \
+                else (np.nan, np.nan)
+
+    def operating_point(self, mask):
+        """Flow (gal/min) and head (ft) through the pumps with the fixtures in mask open, (0, 0) if none are.
+        NaN if it doesn't converge."""
+        if mask not in self.operating_points:
+            self.solve([mask])
+        return self.operating_points[mask]
+
+    def wattage(self, masks):
+        """Electrical power (W) the pumps draw for each pattern in masks"""
+        new = [int(mask) for mask in masks if int(mask) not in self.operating_points]
+        if new:
+            self.solve(new)
+        points = np.array([self.operating_points[int(mask)] for mask in masks]).reshape(-1, 2)
+        shaft_work = points[:, 1] * ff.ft * points[:, 0] * ff.flow_unit * ff.rhoWater * ff.grav
+        return shaft_work / pumps.CATALOGUE[self.pump].efficiency
+
+    def simulate(self, profile, step=60):
+        """Energy and cost of running through profile (see usage_profile), step seconds per row.
+        Returns the energy (kWh), the cost over the profile, and what that comes out to per month, like
+        month_operating_cost. NaN if any pattern that comes up doesn't converge."""
+        unique, which = patterns(profile)
+        wattage = self.wattage(unique)[which]
+        energy = wattage.sum() * step
+        months = len(wattage) * step / ff.month
+        monthly = ff.operating_cost(energy / (len(wattage) * step))
+        return energy / ff.kWh, monthly * months, monthly
+
+
+def simulate(param, profile, step=60):
+    """Building(param).simulate(profile, step) for an option as built by build_parameter_array, sized the usual way
+    (solve_pumps_required). None if its design point doesn't work out."""
+    no_pumps = solve_pumps_required(param[0:5], param[5], True)
+    if no_pumps[0] == 1e3:
+        return None
+    return Building(param[0:5], param[5], no_pumps).simulate(profile, step)
+
+
+if __name__ == "__main__":
+    import json
+    import time
+    from aggregate import TopK
+
+    # How the five options cheapest to run flat out do in a month of ordinary use, a minute at a time
+    with open("raw_data.json", "r") as file:
+        solutions = json.load(file)
+    top = TopK(4, 5)
+    for solution in solutions:
+        top.add(solution)
+
+    profile = usage_profile(days=30, step=60)
+    print(f"{len(profile)} minutes, {len(patterns(profile)[0])} different patterns of open fixtures, "
+          f"{profile.any(axis=1).mean():.0%} of the time something's open")
+    for solution in top.rows():
+        start = time.perf_counter()
+        building = Building(solution[0], solution[1], solution[2])
+        energy, cost, monthly = building.simulate(profile, 60)
+        print(f"{solution[0]} {solution[1]} {solution[2]}: ${solution[4]:.2f}/month flat out, ${monthly:.2f}/month "
+              f"in use ({energy:.1f} kWh), {building.solves} operating points in {time.perf_counter() - start:.2f} s")
@@ -1,102 +1,262 @@
-from background_functions import *
-from scipy.optimize import fsolve
+import math
+from time import perf_counter
+import numpy as np
+import batch
+import float_functions
+import network
+import pumps
+from design_space import DesignSpace
+
+# fsolve gets exact Jacobians from network.py when running on floats (fast=True).
+# Set to False to go back to fsolve estimating them by finite differences.
+use_jacobian = True
+
+# Running totals of calls to the residual and Jacobian functions below, of single pipe head losses worked out by
+# the design point cascade, and of Newton iterations in compute_costs_batched. benchmark.py reads and resets these.
+counters = {"residuals": 0, "jacobians": 0, "cascade": 0, "batch_iterations": 0}
+
+# Running totals of seconds spent in each stage of solving options: the design point (cascade), sizing the pumps, the
+# operating point and adding up the costs. metrics.py reads these before and after every option.
+stage_times = {"cascade": 0., "pumps": 0., "operating point": 0., "costs": 0.}
+
+# How the operating point fsolves went: function evaluations added up, and the exit flag (ier, 1 means converged) and
+# norm of the residuals (ft) of the last one
+fsolve_stats = {"nfev": 0, "ier": None, "residual_norm": None}
+
+# Converged flows from earlier operating point solves, by pump and diameters. Each new solve starts from whichever
+# earlier one had the closest diameters instead of the fixed guess below. Each pump in pumps.CATALOGUE gets its own
+# store the first time it's solved for.
+# Set use_warm_start to False to always start from the fixed guess.
+use_warm_start = True
+warm_starts = {"head_losses": {}}
+
+# Design points already solved, by diameters and kernel (see solve_design_point). They don't depend on the pump, so the
+# three pumps for each set of diameters share one.
+design_points = {}
+
+
+def kernel(fast):
+    """Picks which module of head loss functions the solvers use. background_functions carries units (quantity.py)
+    through every step, float_functions does the same math on plain SI floats and is a lot faster.
+    Both take the same inputs once multiplied by their flow_unit and diameter_unit.
+    background_functions only gets imported the first time something asks for it, so nothing running on floats ever
+    pays for loading it."""
+    if fast:
+        return float_functions
+    import background_functions
+    return background_functions
+
+
+def penalize_low_flows(residuals, flowrates):
+    """Flow must be greater than one. If less than one, drastically increase residuals to discourage fsolve from
+    doing so"""
+    if any([flow < 1 for flow in flowrates]):
+        residuals = [(err + 1) * 1e4 if err > 0 else (err - 1) * 1e4 for err in residuals]
+    return residuals
+
+
+def penalize_low_flows_jacobian(jacobian, flowrates):
+    """Same scaling as penalize_low_flows, applied to a Jacobian"""
+    if any([flow < 1 for flow in flowrates]):
+        jacobian = jacobian * 1e4
+    return jacobian
+
+
+def nearest_warm_start(store, d, default):
+    """Converged solution in store whose diameters are closest to d (fewest inches of difference), or default if there
+    isn't one yet"""
+    if not use_warm_start or not store:
+        return default
+    nearest = min(store, key=lambda other: sum(abs(a - b) for a, b in zip(other, d)))
+    return store[nearest]
 
 
-def pumps_required(flowrates, d, flows2):
+def reset_warm_starts():
+    """Forgets every solution saved for warm starts, so the next solve starts from the fixed guesses.
+    Forgets the design points too, so they get solved again."""
+    design_points.clear()
+    warm_starts["head_losses"].clear()
+
+
+def pumps_required(flowrates, d, flows2, fast=False):
     """Goes to solve_pumps_required to figure out how many pumps the system will need.
     This function assumes that the last sink will have a flowrate of 1 gpm. It's used to solve
     for the flowrates at each appliance that will make appropriate head losses equal."""
 
+    k = kernel(fast)
+    counters["residuals"] += 1
+
+    # The pipe table does all of this in one go. Same residuals as below: bottom floor, then the split.
+    if fast:
+        residuals = list(network.loop_residuals(list(flowrates) + list(flows2), d)[5:])
+        return penalize_low_flows(residuals, flowrates)
+
     # Break apart array for better legibility
-    fl1, fl2, fl3, fl4, fl5, fl6 = [i * gal / minute for i in flowrates]
-    fl7, fl8, fl9, fl10, fl11, fl12 = flows2
+    fl1, fl2, fl3, fl4, fl5, fl6 = [i * k.gal / k.minute for i in flowrates]
+    fl7, fl8, fl9, fl10, fl11, fl12 = [i * k.gal / k.minute for i in flows2]
 
     # Add units to diameters (required for head loss, friction functions)
-    d = [i * inch for i in d]
+    d = [i * k.inch for i in d]
 
     # Array which fsolve will try to make zero.
     residuals = [
 
         # Bottom floor
-        hl12(fl6, d[1]) + hl25(fl6, d[2]) - hl11(fl5, d[2]),
-        hl10(fl5 + fl6, d[1]) + hl11(fl5, d[2]) - hl9(fl4, d[2]),
-        hl8(fl4 + fl5 + fl6, d[1]) + hl9(fl4, d[2]) - hl7(fl3, d[2]),
-        hl6(fl3 + fl4 + fl5 + fl6, d[1]) + hl7(fl3, d[2]) - hl5(fl2, d[2]),
-        hl4(fl2 + fl3 + fl4 + fl5 + fl6, d[1]) + hl5(fl2, d[2]) - hl3(fl1, d[2]),
+        k.hl12(fl6, d[1]) + k.hl25(fl6, d[2]) - k.hl11(fl5, d[2]),
+        k.hl10(fl5 + fl6, d[1]) + k.hl11(fl5, d[2]) - k.hl9(fl4, d[2]),
+        k.hl8(fl4 + fl5 + fl6, d[1]) + k.hl9(fl4, d[2]) - k.hl7(fl3, d[2]),
+        k.hl6(fl3 + fl4 + fl5 + fl6, d[1]) + k.hl7(fl3, d[2]) - k.hl5(fl2, d[2]),
+        k.hl4(fl2 + fl3 + fl4 + fl5 + fl6, d[1]) + k.hl5(fl2, d[2]) - k.hl3(fl1, d[2]),
 
         # Split
-        hl2(fl1 + fl2 + fl3 + fl4 + fl5 + fl6, d[1]) + hl3(fl1, d[2]) \
-        - hl13(fl7 + fl8 + fl9 + fl10 + fl11 + fl12, d[0]) \
-        - hl24(fl7 + fl8 + fl9 + fl10 + fl11 + fl12, d[3]) - hl14(fl7, d[4])
+        k.hl2(fl1 + fl2 + fl3 + fl4 + fl5 + fl6, d[1]) + k.hl3(fl1, d[2]) \
+        - k.hl13(fl7 + fl8 + fl9 + fl10 + fl11 + fl12, d[0]) \
+        - k.hl24(fl7 + fl8 + fl9 + fl10 + fl11 + fl12, d[3]) - k.hl14(fl7, d[4])
     ]
 
     # Strip units away to avoid unit errors
-    residuals = [i.asNumber(ft) for i in residuals]
-
-    # Flow must be greater than one. If less than one, drastically increase residuals to discourage fsolve from doing so
-    if any([flow < 1 for flow in flowrates]):
-        residuals = [(err + 1) * 1e4 if err > 0 else (err - 1) * 1e4 for err in residuals]
+    residuals = [k.head_in_ft(i) for i in residuals]
 
     # if __name__ == "__main__":
     # print(residuals)
     # pass
 
-    return residuals
+    return penalize_low_flows(residuals, flowrates)
+
+
+def unit_total_heads(flowrates, flows2, d):
+    """Total head required by the system with units, along the top floor and along the bottom floor.
+    Both should be the same number once the flows are solved."""
+    k = kernel(False)
+    fl1, fl2, fl3, fl4, fl5, fl6 = [i * k.gal / k.minute for i in flowrates]
+    fl7, fl8, fl9, fl10, fl11, fl12 = [i * k.gal / k.minute for i in flows2]
+    totalflow = fl1 + fl2 + fl3 + fl4 + fl5 + fl6 + fl7 + fl8 + fl9 + fl10 + fl11 + fl12
+    d = [i * k.inch for i in d]
+
+    total_head_required = k.hl1(totalflow, d[0]) + k.hl13(fl7 + fl8 + fl9 + fl10 + fl11 + fl12, d[0]) \
+                          + k.hl24(fl7 + fl8 + fl9 + fl10 + fl11 + fl12, d[3]) \
+                          + k.hl15(fl8 + fl9 + fl10 + fl11 + fl12, d[3]) + k.hl17(fl9 + fl10 + fl11 + fl12, d[3]) \
+                          + k.hl19(fl10 + fl11 + fl12, d[3]) + k.hl21(fl11 + fl12, d[3]) + k.hl23(fl12, d[3]) \
+                          + k.hl26(fl12, d[4])
+    total_head_required_alt = k.hl1(totalflow, d[0]) + k.hl2(fl1 + fl2 + fl3 + fl4 + fl5 + fl6, d[1]) + k.hl3(fl1, d[2])
+    return total_head_required, total_head_required_alt
+
+
+def solve_for_flow(head, target, guess=1., xtol=1e-12):
+    """Flow (gal/min) at which head(flow) comes out to target (ft), for a head that only goes up with flow.
+    Head losses go roughly as a power of flow (about 1.8) on top of whatever head there is at no flow (the rise), so
+    this is Newton's method on log(head - rise) against log(flow), with the power estimated from the last two tries.
+    Every try also tightens a bracket around the answer, and any step that would leave the bracket bisects instead,
+    so it always converges as long as head(0) isn't already above target (then it's 0).
+    Stops once a step changes the flow by less than xtol relative."""
+    at_zero = head(0.)
+    if at_zero >= target:
+        return 0.
+    goal = math.log(target - at_zero)
+    low, high = 0., math.inf
+    flow, power = guess, 1.8
+    last = None
+    for _ in range(200):
+        excess = head(flow) - at_zero
+        if excess < target - at_zero:
+            low = flow
+        else:
+            high = flow
+        log_flow, log_excess = math.log(flow), math.log(excess)
+        if last is not None and log_flow != last[0]:
+            # (kept between 0.5 and 3 so one odd step can't throw it way off)
+            power = (log_excess - last[1]) / (log_flow - last[0])
+            power = 0.5 if power < 0.5 else 3 if power > 3 else power
+        last = log_flow, log_excess
+
+        step = flow * math.exp((goal - log_excess) / power)
+        if not low < step < high:
+            step = (low + high) / 2 if high < math.inf else 2 * low
+        if abs(step - flow) <= xtol * flow:
+            return step
+        flow = step
+    return flow
+
+
+def cascade(d, fast=False):
+    """Flowrates at the design point: the last sink on the top floor (fl11) at exactly 1 gpm.
+    Every other fixture takes whatever flow makes its head match its neighbour's, so walking upstream from fl11 each flow
+    is a 1-D problem in one unknown (see solve_for_flow). The top floor goes fl12, fl10, fl9, fl8, fl7.
+    The bottom floor works the same way from its last sink (fl6), but nothing fixes fl6 itself: it's whatever makes the
+    bottom floor need the same head as the top floor where they split. That's a 1-D problem too, with a whole walk up the
+    bottom floor for every try at fl6.
+    Returns bottom floor flowrates (fl1..fl6) and top floor flowrates (fl7..fl12), or None if the bottom floor can't
+    give every fixture at least 1 gpm (the same options pumps_required penalizes)."""
+
+    # All in plain gal/min and ft
+    def hl(number, flow):
+        counters["cascade"] += 1
+        return network.hl(number, flow, d, fast)
+
+    fl11 = 1
+    fl12 = max(solve_for_flow(lambda fl12: hl(23, fl12) + hl(26, fl12), hl(22, fl11)), 1)
+    fl10 = solve_for_flow(lambda fl10: hl(20, fl10), hl(21, fl12 + fl11) + hl(22, fl11))
+    fl9 = solve_for_flow(lambda fl9: hl(18, fl9), hl(19, fl10 + fl11 + fl12) + hl(20, fl10))
+    fl8 = solve_for_flow(lambda fl8: hl(16, fl8), hl(17, fl9 + fl10 + fl11 + fl12) + hl(18, fl9))
+    fl7 = solve_for_flow(lambda fl7: hl(14, fl7), hl(15, fl8 + fl9 + fl10 + fl11 + fl12) + hl(16, fl8))
+    flows2 = [fl7, fl8, fl9, fl10, fl11, fl12]
 
+    # Head to the split along the top floor, which the bottom floor has to match
+    top_head = hl(13, sum(flows2)) + hl(24, sum(flows2)) + hl(14, fl7)
 
-def solve_pumps_required(d, pump_type):
-    """Solves for the number of pumps required, both in series and in parallel.
-    Works by first solving for the flowrates, then computing the head required to push those flowrates through pipes,
-    then depending on which type of pump is used, calculates how many pumps are required."""
-
-    # The following can be solved one-by-one, which eliminates much of the hassle and makes it easier for fsolve to
-    # find everything
-    fl11 = 1 * gal / minute
-    fl12 = max(fsolve(lambda fl12: (
-            hl23(fl12[0] * gal/minute, d[3] * inch) + hl26(fl12[0] * gal/minute, d[4] * inch) - hl22(fl11, d[4] * inch)).asNumber(
-        ft), 1.05)[0], 1) * gal / minute
-    fl10 = fsolve(lambda fl10: (hl21(fl12 + fl11, d[3] * inch) + hl22(fl11, d[4] * inch) - hl20(fl10[0] * gal / minute,
-                                                                                                d[4] * inch)).asNumber(
-        ft), 1.34)[0] * gal / minute
-    fl9 = fsolve(lambda fl9: (
-            hl19(fl10 + fl11 + fl12, d[3] * inch) + hl20(fl10, d[4] * inch) - hl18(fl9[0] * gal / minute,
-                                                                                   d[4] * inch)).asNumber(ft),
-                 2.26)[0] * gal / minute
-    fl8 = fsolve(lambda fl8: (
-            hl17(fl9 + fl10 + fl11 + fl12, d[3] * inch) + hl18(fl9, d[4] * inch) - hl16(fl8[0] * gal / minute,
-                                                                                        d[4] * inch)).asNumber(ft),
-                 2.95)[0] * gal / minute
-    fl7 = fsolve(lambda fl7: (
-            hl15(fl8 + fl9 + fl10 + fl11 + fl12, d[3] * inch) + hl16(fl8, d[4] * inch) - hl14(fl7[0] * gal / minute,
-                                                                                              d[4] * inch)).asNumber(
-        ft), 4.07)[0] * gal / minute
-    flows2 = [fl7, fl8, fl9, fl10, fl11, fl12]
+    # Each walk starts its 1-D solves from the flows the walk before it ended up with, which are close by the end
+    last_walk = [1., 1., 1., 1., 1.]
 
-    # Guess obtained from no_longer_needed/assume_1_gpm.py. Relatively close in many instances.
-    guess = [8.44413328, 6.16273439, 4.76610446, 2.88076267, 2.30501932, 2.20906167]
+    def bottom_floor(fl6):
+        fl5 = solve_for_flow(lambda fl5: hl(11, fl5), hl(12, fl6) + hl(25, fl6), last_walk[4])
+        fl4 = solve_for_flow(lambda fl4: hl(9, fl4), hl(10, fl5 + fl6) + hl(11, fl5), last_walk[3])
+        fl3 = solve_for_flow(lambda fl3: hl(7, fl3), hl(8, fl4 + fl5 + fl6) + hl(9, fl4), last_walk[2])
+        fl2 = solve_for_flow(lambda fl2: hl(5, fl2), hl(6, fl3 + fl4 + fl5 + fl6) + hl(7, fl3), last_walk[1])
+        fl1 = solve_for_flow(lambda fl1: hl(3, fl1), hl(4, fl2 + fl3 + fl4 + fl5 + fl6) + hl(5, fl2), last_walk[0])
+        if fl6 > 0:
+            last_walk[:] = [fl1, fl2, fl3, fl4, fl5]
+        return [fl1, fl2, fl3, fl4, fl5, fl6]
 
-    # Pass to fsolve
-    flowrates, dic, ier, msg = fsolve(pumps_required, guess, args=(d, flows2), full_output=True)
+    def bottom_head(fl6):
+        flowrates = bottom_floor(fl6)
+        return hl(2, sum(flowrates)) + hl(3, flowrates[0])
 
-    # If solution did not converge, return an absurdly high number of pumps
-    if ier != 1:
-        return [1e3, 1e3]
+    flowrates = bottom_floor(solve_for_flow(bottom_head, top_head, xtol=1e-10))
+
+    if any([flow < 1 for flow in flowrates]):
+        return None
+    return flowrates, flows2
 
-    # Parse function return
-    fl1, fl2, fl3, fl4, fl5, fl6 = [i * gal / minute for i in flowrates]
 
-    totalflow = sum(flowrates) * gal / minute + fl7 + fl8 + fl9 + fl10 + fl11 + fl12
-    d = [i * inch for i in d]
+def solve_design_point(d, fast=False):
+    """Solves for the flowrates with the last sink at 1 gpm (the design point, see cascade), then computes the head
+    required to push those flowrates through the pipes. None of it depends on the pump, so it's only solved once per set
+    of diameters; after that it comes out of design_points.
+    Returns bottom floor flowrates, top floor flowrates, total flow and total head required, or None if some fixture
+    would get less than 1 gpm."""
 
-    # Total head required by system
-    total_head_required = hl1(totalflow, d[0]) + hl13(fl7 + fl8 + fl9 + fl10 + fl11 + fl12, d[0]) \
-                          + hl24(fl7 + fl8 + fl9 + fl10 + fl11 + fl12, d[3]) \
-                          + hl15(fl8 + fl9 + fl10 + fl11 + fl12, d[3]) + hl17(fl9 + fl10 + fl11 + fl12, d[3]) \
-                          + hl19(fl10 + fl11 + fl12, d[3]) + hl21(fl11 + fl12, d[3]) + hl23(fl12, d[3]) \
-                          + hl26(fl12, d[4])
-    # Same number, used for debugging
-    total_head_required_alt = hl1(totalflow, d[0]) + hl2(fl1 + fl2 + fl3 + fl4 + fl5 + fl6, d[1]) \
-                              + hl3(fl1, d[2])
+    key = (tuple(d), fast)
+    if key in design_points:
+        return design_points[key]
+
+    k = kernel(fast)
+    start = perf_counter()
+
+    flows = cascade(d, fast)
+    if flows is None:
+        design_points[key] = None
+        stage_times["cascade"] += perf_counter() - start
+        return None
+    flowrates, flows2 = flows
+
+    totalflow = (sum(flowrates) + sum(flows2)) * k.flow_unit
+
+    # Total head required by system, and the same number along the other floor (used for debugging)
+    if fast:
+        heads = network.fixture_heads(list(flowrates) + flows2, d)
+        total_head_required, total_head_required_alt = heads[11] * k.ft, heads[0] * k.ft
+    else:
+        total_head_required, total_head_required_alt = unit_total_heads(flowrates, flows2, d)
 
     # Only runs if this file itself is run, not if it is imported to another file. Used for debugging.
     if __name__ == "__main__":
@@ -107,141 +267,181 @@ def solve_pumps_required(d, pump_type):
         print("Total head required:")
         print(total_head_required)
         print(total_head_required_alt)
-        print(f"required pressure : {(total_head_required * grav * rhoWater).asUnit(psi)}")
+        print(f"required pressure : {(total_head_required * k.grav * k.rhoWater).asNumber(k.psi)} psi")
         print("check solver")
-        print(pumps_required(flowrates, [i.asNumber(inch) for i in d], flows2))
-        print(f"Single pump head at {totalflow}:")
-        if pump_type == "A":
-            print(pump_curve_A(totalflow))
-        if pump_type == "B":
-            print(pump_curve_B(totalflow))
-        if pump_type == "C":
-            print(pump_curve_C(totalflow))
-
-    # Calculate number of pumps required based on previous work
-    if pump_type == "A":
-
-        # Starts by assuming only 1 in parallel. Increases until the flowrate is sufficient.
-        no_parallel = 1
-        while pump_curve_A(totalflow / no_parallel) <= 0 * ft and no_parallel < 100:
-            no_parallel += 1
-        if no_parallel > 99:
-            raise RuntimeError(
-                f"Critical error occured while trying to calculate number of necessary pumps. Pump A x {no_parallel} was reached")
+        print(pumps_required(flowrates, d, flows2, fast))
 
-        # Returns a list: first is number of pumps in series, second is number of pumps in parallel.
-        return [np.ceil(total_head_required / pump_curve_A(totalflow / no_parallel)), no_parallel]
+    design_points[key] = flowrates, flows2, totalflow, total_head_required
+    stage_times["cascade"] += perf_counter() - start
+    return design_points[key]
 
-    # Similar below.
-    if pump_type == "B":
 
-        no_parallel = 1
-        while pump_curve_B(totalflow / no_parallel) <= 0 * ft and no_parallel < 100:
-            no_parallel += 1
-        if no_parallel > 99:
-            raise RuntimeError(
-                f"Critical error occured while trying to calculate number of necessary pumps. Pump B x {no_parallel} was reached")
+def solve_pumps_required(d, pump_type, fast=False):
+    """Solves for the number of pumps required, both in series and in parallel.
+    Works by first solving for the design point (see solve_design_point), then depending on which type of pump is used,
+    calculates how many pumps are required to supply that much head at that flow."""
 
-        return [np.ceil(total_head_required / pump_curve_B(totalflow / no_parallel)), no_parallel]
+    k = kernel(fast)
 
-    if pump_type == "C":
+    # If solution did not converge, return an absurdly high number of pumps
+    design_point = solve_design_point(d, fast)
+    if design_point is None:
+        return [1e3, 1e3]
+    start = perf_counter()
+    flowrates, flows2, totalflow, total_head_required = design_point
 
-        no_parallel = 1
-        while pump_curve_C(totalflow / no_parallel) <= 0 * ft and no_parallel < 100:
-            no_parallel += 1
-        if no_parallel > 99:
-            raise RuntimeError(
-                f"Critical error occured while trying to calculate number of necessary pumps. Pump C x {no_parallel} was reached")
+    if __name__ == "__main__":
+        print(f"Single pump head at {totalflow}:")
+        print(k.pump_curve(pump_type, totalflow))
 
-        return [np.ceil(total_head_required / pump_curve_C(totalflow / no_parallel)), no_parallel]
+    # Straight from the pump's curve (see pumps.pumps_required).
+    # Returns a list: first is number of pumps in series, second is number of pumps in parallel.
+    series, parallel = pumps.pumps_required(pump_type, k.flow_in_gpm(totalflow), k.head_in_ft(total_head_required))
+    stage_times["pumps"] += perf_counter() - start
+    return [int(series[0]), int(parallel[0])]
 
 
-def head_losses(flowrates, d, pump, number_of_pumps):
+def head_losses(flowrates, d, pump, number_of_pumps, fast=False):
     """This function will be passed to the solver. Takes a 12-dimensional array of flowrates and outputs a
     12-dimensional array of differences in head loss between pipes. Also requires input of pipe diameters, pump type,
     and number of pumps that will be set in series."""
 
+    k = kernel(fast)
+    counters["residuals"] += 1
+    totalflow = sum(flowrates) * k.flow_unit
+
+    # The pipe table gives the head to every fixture in one go. Same residuals as below, last one is the pump.
+    if fast:
+        heads = network.fixture_heads(flowrates, d)
+        residuals = list(network.LOOP_MATRIX @ heads)
+        residuals.append(heads[0] - k.head_in_ft(k.pump_curve(pump, totalflow)) * number_of_pumps)
+        return penalize_low_flows(residuals, flowrates)
+
     # Transform array into more readable single variables and add units
-    fl1, fl2, fl3, fl4, fl5, fl6, fl7, fl8, fl9, fl10, fl11, fl12 = [i * gal / minute for i in flowrates]
-    totalflow = sum(flowrates) * gal / minute
-    d = [i * inch for i in d]
+    fl1, fl2, fl3, fl4, fl5, fl6, fl7, fl8, fl9, fl10, fl11, fl12 = [i * k.gal / k.minute for i in flowrates]
+    d = [i * k.inch for i in d]
 
     # Calculate residuals, which fsolve will try to make zero by tweaking flowrates.
     residuals = [
         # Top floor
-        hl23(fl12, d[3]) + hl26(fl12, d[4]) - hl22(fl11, d[4]),
-        hl21(fl12 + fl11, d[3]) + hl22(fl11, d[4]) - hl20(fl10, d[4]),
-        hl19(fl10 + fl11 + fl12, d[3]) + hl20(fl10, d[4]) - hl18(fl9, d[4]),
-        hl17(fl9 + fl10 + fl11 + fl12, d[3]) + hl18(fl9, d[4]) - hl16(fl8, d[4]),
-        hl15(fl8 + fl9 + fl10 + fl11 + fl12, d[3]) + hl16(fl8, d[4]) - hl14(fl7, d[4]),
+        k.hl23(fl12, d[3]) + k.hl26(fl12, d[4]) - k.hl22(fl11, d[4]),
+        k.hl21(fl12 + fl11, d[3]) + k.hl22(fl11, d[4]) - k.hl20(fl10, d[4]),
+        k.hl19(fl10 + fl11 + fl12, d[3]) + k.hl20(fl10, d[4]) - k.hl18(fl9, d[4]),
+        k.hl17(fl9 + fl10 + fl11 + fl12, d[3]) + k.hl18(fl9, d[4]) - k.hl16(fl8, d[4]),
+        k.hl15(fl8 + fl9 + fl10 + fl11 + fl12, d[3]) + k.hl16(fl8, d[4]) - k.hl14(fl7, d[4]),
 
         # Bottom floor
-        hl12(fl6, d[1]) + hl25(fl6, d[2]) - hl11(fl5, d[2]),
-        hl10(fl5 + fl6, d[1]) + hl11(fl5, d[2]) - hl9(fl4, d[2]),
-        hl8(fl4 + fl5 + fl6, d[1]) + hl9(fl4, d[2]) - hl7(fl3, d[2]),
-        hl6(fl3 + fl4 + fl5 + fl6, d[1]) + hl7(fl3, d[2]) - hl5(fl2, d[2]),
-        hl4(fl2 + fl3 + fl4 + fl5 + fl6, d[1]) + hl5(fl2, d[2]) - hl3(fl1, d[2]),
+        k.hl12(fl6, d[1]) + k.hl25(fl6, d[2]) - k.hl11(fl5, d[2]),
+        k.hl10(fl5 + fl6, d[1]) + k.hl11(fl5, d[2]) - k.hl9(fl4, d[2]),
+        k.hl8(fl4 + fl5 + fl6, d[1]) + k.hl9(fl4, d[2]) - k.hl7(fl3, d[2]),
+        k.hl6(fl3 + fl4 + fl5 + fl6, d[1]) + k.hl7(fl3, d[2]) - k.hl5(fl2, d[2]),
+        k.hl4(fl2 + fl3 + fl4 + fl5 + fl6, d[1]) + k.hl5(fl2, d[2]) - k.hl3(fl1, d[2]),
 
         # Split
-        hl2(fl1 + fl2 + fl3 + fl4 + fl5 + fl6, d[1]) + hl3(fl1, d[2]) - hl13(fl7 + fl8 + fl9 + fl10 + fl11 + fl12,
-                                                                             d[0]) - hl24(
-            fl7 + fl8 + fl9 + fl10 + fl11 + fl12, d[3]) - hl14(fl7, d[4])
+        k.hl2(fl1 + fl2 + fl3 + fl4 + fl5 + fl6, d[1]) + k.hl3(fl1, d[2]) - k.hl13(fl7 + fl8 + fl9 + fl10 + fl11 + fl12,
+                                                                             d[0]) - k.hl24(
+            fl7 + fl8 + fl9 + fl10 + fl11 + fl12, d[3]) - k.hl14(fl7, d[4])
     ]
 
     # Add pump head term to residuals
-    if pump == "A":
-        residuals.append(
-            hl1(totalflow, d[0]) + hl2(fl1 + fl2 + fl3 + fl4 + fl5 + fl6, d[1]) + hl3(fl1, d[2]) - pump_curve_A(
-                totalflow) * number_of_pumps)
+    residuals.append(
+        k.hl1(totalflow, d[0]) + k.hl2(fl1 + fl2 + fl3 + fl4 + fl5 + fl6, d[1]) + k.hl3(fl1, d[2]) - k.pump_curve(
+            pump, totalflow) * number_of_pumps)
 
-    elif pump == "B":
-        residuals.append(
-            hl1(totalflow, d[0]) + hl2(fl1 + fl2 + fl3 + fl4 + fl5 + fl6, d[1]) + hl3(fl1, d[2]) - pump_curve_B(
-                totalflow) * number_of_pumps)
+    # Take away units
+    residuals = [k.head_in_ft(i) for i in residuals]
 
-    elif pump == "C":
-        residuals.append(
-            hl1(totalflow, d[0]) + hl2(fl1 + fl2 + fl3 + fl4 + fl5 + fl6, d[1]) + hl3(fl1, d[2]) - pump_curve_C(
-                totalflow) * number_of_pumps)
+    return penalize_low_flows(residuals, flowrates)
 
-    # Take away units
-    residuals = [i.asNumber(ft) for i in residuals]
 
-    # Flow must be greater than one. If less than one, drastically increase residuals to discourage fsolve from doing so
-    if any([flow < 1 for flow in flowrates]):
-        residuals = [(err + 1) * 1e4 if err > 0 else (err - 1) * 1e4 for err in residuals]
+def head_losses_jacobian(flowrates, d, pump, number_of_pumps, fast=True):
+    """Exact derivative of head_losses (the float version) with respect to all 12 flowrates.
+    The loop rows come straight from the pipe table, the pump row adds the pump curve's slope at the total flow,
+    which every flowrate feeds into. Passed to fsolve as fprime."""
+    counters["jacobians"] += 1
+    k = float_functions
+    totalflow = sum(flowrates) * k.flow_unit
+
+    heads_jacobian = network.fixture_heads_jacobian(flowrates, d)
+    pump_row = heads_jacobian[0] - k.head_in_ft(k.pump_slope(pump, totalflow)) * k.flow_unit * number_of_pumps
+    jacobian = np.vstack([network.LOOP_MATRIX @ heads_jacobian, pump_row])
+    return penalize_low_flows_jacobian(jacobian, flowrates)
+
+
+def operating_point_guess(d, pump, series):
+    """Design point flows scaled to meet the curve of series pumps, the same start compute_costs_batched uses
+    (see batch.operating_point_guess)"""
+    flowrates, flows2, _, head = solve_design_point(d, True)
+    return batch.operating_point_guess([list(flowrates) + flows2], [float_functions.head_in_ft(head)], [pump],
+                                       np.array([series]))[0]
 
-    return residuals
 
+def starting_guesses(guess, cold_guess, d, pump, series):
+    """Where solve_head_losses tries starting from, in order, until one converges: guess (the nearest warm start),
+    cold_guess and operating_point_guess. Just guess if the number of pumps didn't work out."""
+    yield guess
+    if series == 1e3:
+        return
+    if guess is not cold_guess:
+        yield cold_guess
+    yield operating_point_guess(d, pump, series)
 
-def solve_head_losses(d, pump):
+
+def solve_head_losses(d, pump, fast=False):
     """Easy port to fsolve"""
     # Call for number of pumps
-    number_of_pumps = solve_pumps_required(d, pump)
+    number_of_pumps = solve_pumps_required(d, pump, fast)
 
     # Guess obtained from no_longer_needed/assume_1_gpm.py. Relatively close in almost all instances.
-    guess_array = [8.44413328, 6.16273439, 4.76610446, 2.88076267, 2.30501932, 2.20906167, 4.0730172, 2.94887831,
-                   2.26262715, 1.3388585, 1.05406013, 1]
-
-    # Solve for actual head losses
-    soln, dic, ier, msg = fsolve(head_losses, guess_array, args=(d, pump, number_of_pumps[0]), full_output=True)
+    # Better is the operating point of the most similar set of diameters already solved with this pump.
+    cold_guess = [8.44413328, 6.16273439, 4.76610446, 2.88076267, 2.30501932, 2.20906167, 4.0730172, 2.94887831,
+                  2.26262715, 1.3388585, 1.05406013, 1]
+    guess_array = nearest_warm_start(warm_starts["head_losses"].get(pump), d, cold_guess)
+
+    # Solve for actual head losses, falling back on the usual guess if the neighbour's doesn't converge, and then on
+    # where compute_costs_batched starts (not worth it if the number of pumps already didn't work out, those are thrown
+    # out either way). That last one only depends on this option, so whatever converges from it does no matter which
+    # options were solved before it, or whether they were solved in the same --range.
+    # A solution with a fixture below 1 gpm doesn't count (penalize_low_flows only steers fsolve away from those).
+    # scipy.optimize takes longer to import than most runs spend in it, so only solves that use it import it
+    from scipy.optimize import fsolve
+    jacobian = head_losses_jacobian if fast and use_jacobian else None
+    start = perf_counter()
+    for guess in starting_guesses(guess_array, cold_guess, d, pump, number_of_pumps[0]):
+        soln, dic, ier, msg = fsolve(head_losses, guess, args=(d, pump, number_of_pumps[0], fast),
+                                     fprime=jacobian, full_output=True)
+        fsolve_stats["nfev"] += dic["nfev"]
+        converged = ier == 1 and min(soln) >= 1
+        if converged:
+            break
+    fsolve_stats.update(ier=ier, residual_norm=float(np.linalg.norm(dic["fvec"])))
+    stage_times["operating point"] += perf_counter() - start
 
     # Debug
     if __name__ == "__main__":
         print("DEBUG solve head losses")
         print("Check solver:")
-        print(head_losses(soln, d, pump, number_of_pumps[0]))
+        print(head_losses(soln, d, pump, number_of_pumps[0], fast))
 
     # In case solution did not converge, remove from list.
-    if ier != 1:
+    if not converged:
         return [1e3 for _ in range(12)], [1e3, 1e3]  # Making everything huge will remove it from relevant summaries
 
     # Return both if everything turned out well
+    warm_starts["head_losses"].setdefault(pump, {})[tuple(d)] = list(soln)
     return soln, number_of_pumps
 
 
+# Diameters (in) count_system_pipe_cost has prices for. Anything else would quietly come out too cheap.
+PRICED_DIAMETERS = (0.5, 0.75, 1)
+
+
 def count_system_pipe_cost(d):
-    """Counts up dollar value of pvc pipe, fittings, and valves"""
+    """Counts up dollar value of pvc pipe, fittings, and valves.
+    Raises ValueError for a diameter there's no price for (see PRICED_DIAMETERS)."""
+    unpriced = [diameter for diameter in d if diameter not in PRICED_DIAMETERS]
+    if unpriced:
+        raise ValueError(f"No pipe prices for {unpriced} in pipe, only for {PRICED_DIAMETERS}")
 
     cost = 0
     # Main pipe
@@ -337,113 +537,204 @@ def count_system_pipe_cost(d):
     return cost
 
 
-def compute_cost_with_specifications(array_of_arguments):
+def unit_head_losses(flowrates, d):
+    """Head loss along each of the 26 pipes with units, in the same order as hl1..hl26."""
+    k = kernel(False)
+    # Parse flowrates
+    fl1, fl2, fl3, fl4, fl5, fl6, fl7, fl8, fl9, fl10, fl11, fl12 = [i * k.gal / k.minute for i in flowrates]
+    totalflow = sum(flowrates) * k.gal / k.minute
+    d = [i * k.inch for i in d]
+
+    return [
+        k.hl1(totalflow, d[0]),
+        k.hl2(fl1 + fl2 + fl3 + fl4 + fl5 + fl6, d[1]),
+        k.hl3(fl1, d[2]),
+        k.hl4(fl2 + fl3 + fl4 + fl5 + fl6, d[1]),
+        k.hl5(fl2, d[2]),
+        k.hl6(fl3 + fl4 + fl5 + fl6, d[1]),
+        k.hl7(fl3, d[2]),
+        k.hl8(fl4 + fl5 + fl6, d[1]),
+        k.hl9(fl4, d[2]),
+        k.hl10(fl5 + fl6, d[1]),
+        k.hl11(fl5, d[2]),
+        k.hl12(fl6, d[1]),
+        k.hl13(fl7 + fl8 + fl9 + fl10 + fl11 + fl12, d[0]),
+        k.hl14(fl7, d[4]),
+        k.hl15(fl8 + fl9 + fl10 + fl11 + fl12, d[3]),
+        k.hl16(fl8, d[4]),
+        k.hl17(fl9 + fl10 + fl11 + fl12, d[3]),
+        k.hl18(fl9, d[4]),
+        k.hl19(fl10 + fl11 + fl12, d[3]),
+        k.hl20(fl10, d[4]),
+        k.hl21(fl11 + fl12, d[3]),
+        k.hl22(fl11, d[4]),
+        k.hl23(fl12, d[3]),
+        k.hl24(fl7 + fl8 + fl9 + fl10 + fl11 + fl12, d[3]),
+        k.hl25(fl6, d[2]),
+        k.hl26(fl12, d[4])
+    ]
+
+
+
+def compute_cost_with_specifications(array_of_arguments, fast=False, cache=None):
     """The workhorse of the program. Puts everything together.
     The first five entries to the input array are the diameters of different sections of pipe.
-    The sixth and last entry is the pump type."""
+    The sixth and last entry is the pump type.
+    fast=True runs everything on plain floats (float_functions) instead of carrying units (background_functions).
+    cache is an optional cache.SolutionCache. Options found in it aren't solved again, and new ones get saved to it."""
+
+    if cache is not None:
+        cached = cache.get(array_of_arguments, "fsolve" if fast else "fsolve with units")
+        if cached is not None:
+            # Still a good place for the next solve to start from, same as if it had just been solved
+            warm_starts["head_losses"].setdefault(array_of_arguments[5], {})[tuple(array_of_arguments[0:5])] = cached[5]
+            return cached
+        result = compute_cost_with_specifications(array_of_arguments, fast)
+        cache.put(array_of_arguments, "fsolve" if fast else "fsolve with units", result)
+        return result
 
     # Split array
     diams = array_of_arguments[0:5]
     pump_type = array_of_arguments[5]
 
     # Call for flowrates and number of pumps
-    flowrates, no_pumps = solve_head_losses(diams, pump_type)
+    flowrates, no_pumps = solve_head_losses(diams, pump_type, fast)
+
+    return cost_breakdown(diams, pump_type, flowrates, no_pumps, fast)
+
+
+def cost_breakdown(diams, pump_type, flowrates, no_pumps, fast=False):
+    """Everything compute_cost_with_specifications returns, once the flowrates and number of pumps are known"""
+
+    k = kernel(fast)
+    start = perf_counter()
 
     # Call for cost of piping
     pipe_cost = count_system_pipe_cost(diams)
 
-    # Parse flowrates
-    fl1, fl2, fl3, fl4, fl5, fl6, fl7, fl8, fl9, fl10, fl11, fl12 = [i * gal / minute for i in flowrates]
-    totalflow = sum(flowrates) * gal / minute
-
-    # Calculate total head required by system (which thanks to fsolve is the same as pump head delivered
-    d = [i * inch for i in diams]
-    headlosses = [
-        hl1(totalflow, d[0]),
-        hl2(fl1 + fl2 + fl3 + fl4 + fl5 + fl6, d[1]),
-        hl3(fl1, d[2]),
-        hl4(fl2 + fl3 + fl4 + fl5 + fl6, d[1]),
-        hl5(fl2, d[2]),
-        hl6(fl3 + fl4 + fl5 + fl6, d[1]),
-        hl7(fl3, d[2]),
-        hl8(fl4 + fl5 + fl6, d[1]),
-        hl9(fl4, d[2]),
-        hl10(fl5 + fl6, d[1]),
-        hl11(fl5, d[2]),
-        hl12(fl6, d[1]),
-        hl13(fl7 + fl8 + fl9 + fl10 + fl11 + fl12, d[0]),
-        hl14(fl7, d[4]),
-        hl15(fl8 + fl9 + fl10 + fl11 + fl12, d[3]),
-        hl16(fl8, d[4]),
-        hl17(fl9 + fl10 + fl11 + fl12, d[3]),
-        hl18(fl9, d[4]),
-        hl19(fl10 + fl11 + fl12, d[3]),
-        hl20(fl10, d[4]),
-        hl21(fl11 + fl12, d[3]),
-        hl22(fl11, d[4]),
-        hl23(fl12, d[3]),
-        hl24(fl7 + fl8 + fl9 + fl10 + fl11 + fl12, d[3]),
-        hl25(fl6, d[2]),
-        hl26(fl12, d[4])
-    ]
+    # Calculate total head required by system (which thanks to fsolve is the same as pump head delivered)
+    # The pipe table gives all 26 at once in ft, put back into SI so the rest is the same for both kernels.
+    totalflow = sum(flowrates) * k.flow_unit
+    if fast:
+        headlosses = network.segment_heads(flowrates, diams) * k.ft
+    else:
+        headlosses = unit_head_losses(flowrates, diams)
 
     total_head_required = headlosses[0] + headlosses[12] + headlosses[23] + headlosses[14] + headlosses[16] + \
                           headlosses[18] + headlosses[20] + headlosses[22] + headlosses[25]
     total_head_required_2 = headlosses[0] + headlosses[1] + headlosses[2]
 
-    if np.abs(total_head_required - total_head_required_2) / total_head_required > 0.01 and __name__ == "__main__":
-        print(array_of_arguments)
+    if abs(total_head_required - total_head_required_2) / total_head_required > 0.01 and __name__ == "__main__":
+        print(diams, pump_type)
         print("Heads differ too much. Look into that")
 
     # Calculate wattage and cost of pumps
-    shaft_work = total_head_required * totalflow * rhoWater * grav
-    wattage = 0
-    pump_cost = 0
-    if pump_type == "A":
-        pump_cost = 1500 * no_pumps[0] * no_pumps[1]
-        wattage = shaft_work / 0.9
-    elif pump_type == "B":
-        pump_cost = 800 * no_pumps[0] * no_pumps[1]
-        wattage = shaft_work / 0.8
-    elif pump_type == "C":
-        pump_cost = 250 * no_pumps[0] * no_pumps[1]
-        wattage = shaft_work / 0.7
+    shaft_work = total_head_required * totalflow * k.rhoWater * k.grav
+    pump = pumps.CATALOGUE[pump_type]
+    pump_cost = pump.price * no_pumps[0] * no_pumps[1]
+    wattage = shaft_work / pump.efficiency
 
     # Calculate total system cost, monthly maximum operating cost.
     # Assumes average 2023 US electricity price of 12.72 cents/kWh
     system_cost = pipe_cost + pump_cost
-    month_operating_cost = (wattage * (0.1272 / kWh) * (1 * month)).asNumber()
+    month_operating_cost = float(k.operating_cost(wattage))
 
     # Left from debugging
     if __name__ == "__main__":
         print("DEBUG cost fun")
         print("total head required: " + str(total_head_required))
-        print("total pump head supplied: " + str(pump_curve_A(totalflow / no_pumps[1]) * no_pumps[0]))
+        print("total pump head supplied: " + str(k.pump_curve(pump_type, totalflow / no_pumps[1]) * no_pumps[0]))
         print("All head losses:")
-        print([f"{i + 1}: {round(j.asNumber(ft), 3)}" for i, j in enumerate(headlosses)])
+        print([f"{i + 1}: {round(k.head_in_ft(j), 3)}" for i, j in enumerate(headlosses)])
 
     # Return every necessary bit of information
-    return [diams, pump_type, no_pumps, system_cost, month_operating_cost, list(flowrates),
-            totalflow.asNumber(gal / minute), total_head_required.asNumber(ft)]
+    stage_times["costs"] += perf_counter() - start
+    return [diams, pump_type, no_pumps, system_cost, month_operating_cost, [float(i) for i in flowrates],
+            k.flow_in_gpm(totalflow), k.head_in_ft(total_head_required)]
+
+
+def compute_costs_batched(params, cache=None):
+    """Same as compute_cost_with_specifications(param, fast=True) for every param in params, except the operating points
+    of all of them are solved together by batch.solve_operating_points instead of one fsolve each. Design points and
+    numbers of pumps are still found one set of diameters at a time (see solve_design_point), and each operating point
+    starts from its design point flows scaled to meet the pump curve. Returns the results in the same order as params."""
+    results = [None] * len(params)
+    if cache is not None:
+        results = [cache.get(param, "batched") for param in params]
+
+    # Options whose design point doesn't work out don't have an operating point to solve
+    rows = []
+    for i, param in enumerate(params):
+        if results[i] is not None:
+            continue
+        if solve_design_point(param[0:5], True) is None:
+            results[i] = cost_breakdown(param[0:5], param[5], [1e3 for _ in range(12)], [1e3, 1e3], True)
+        else:
+            rows.append(i)
+
+    if rows:
+        design = [solve_design_point(params[i][0:5], True) for i in rows]
+        d = [params[i][0:5] for i in rows]
+        pump_types = [params[i][5] for i in rows]
+        design_heads = [float_functions.head_in_ft(head) for *_, head in design]
+
+        # Same sizing as solve_pumps_required, for every option at once
+        start = perf_counter()
+        series, parallel = pumps.pumps_required(pump_types, [float_functions.flow_in_gpm(flow) for *_, flow, _ in design],
+                                                design_heads)
+        stage_times["pumps"] += perf_counter() - start
+        start = perf_counter()
+        guess = batch.operating_point_guess([list(flowrates) + flows2 for flowrates, flows2, _, _ in design],
+                                            design_heads, pump_types, series)
+        flows, converged, iterations = batch.solve_operating_points(guess, d, pump_types, series)
+        counters["batch_iterations"] += iterations
+        stage_times["operating point"] += perf_counter() - start
+
+        # Same as solve_head_losses when it doesn't converge
+        for i, no_series, no_parallel, flowrates, ok in zip(rows, series, parallel, flows, converged):
+            no_pumps = [int(no_series), int(no_parallel)]
+            if not ok:
+                flowrates, no_pumps = [1e3 for _ in range(12)], [1e3, 1e3]
+            results[i] = cost_breakdown(params[i][0:5], params[i][5], flowrates, no_pumps, True)
+
+    if cache is not None:
+        for i in rows:
+            cache.put(params[i], "batched", results[i])
+    return results
+
+
+def failed_solution(array_of_arguments):
+    """Stand-in for compute_cost_with_specifications when solving raised an error instead of just not converging.
+    Same layout, with huge numbers everywhere so it drops out of every summary like a non-converged option does."""
+    return [array_of_arguments[0:5], array_of_arguments[5], [1e3, 1e3], 1e9, 1e9, [1e3 for _ in range(12)], 1.2e4, 1e9]
 
 
 def build_parameter_array():
     """Simply iterates through all possible combinations of diameter sizing and pump choice.
-    Assumes diameter will only decrease along flow of pipe."""
-    params = []
-    for D0choice in [0.5, 0.75, 1]:
-        for D1choice in [0.5, 0.75, 1]:
-            for D2choice in [0.5, 0.75, 1]:
-                if D2choice > D1choice or D1choice > D0choice:
-                    continue
-                for D3choice in [0.5, 0.75, 1]:
-                    for D4choice in [0.5, 0.75, 1]:
-                        if D4choice > D3choice or D3choice > D0choice:
-                            continue
-                        for pumpchoice in ["A", "B", "C"]:
-                            params.append([D0choice, D1choice, D2choice, D3choice, D4choice, pumpchoice])
-
-    return params
+    Assumes diameter will only decrease along flow of pipe. See design_space.py for going through them (or any
+    range of them) without building the whole list."""
+    return list(DesignSpace())
+
+
+def sweep_order(params):
+    """Order to solve params in so that each set of diameters differs from the one before it in as few pipes as
+    possible, which makes the warm starts as close as they can be. Greedy: always goes to the closest set of diameters
+    not done yet. The pumps for each set of diameters stay together. Returns indices into params."""
+    groups = {}
+    for index, param in enumerate(params):
+        groups.setdefault(tuple(param[0:5]), []).append(index)
+
+    remaining = list(groups)
+    if not remaining:
+        return []
+    current = remaining.pop(0)
+    order = list(groups[current])
+    while remaining:
+        current = min(remaining, key=lambda d: (sum(a != b for a, b in zip(d, current)),
+                                                sum(abs(a - b) for a, b in zip(d, current))))
+        remaining.remove(current)
+        order += groups[current]
+    return order
 
 
 # More debugging
@@ -0,0 +1,288 @@
+import numpy as np
+import batch
+import float_functions as ff
+import network
+import pumps
+from solver_functions import compute_costs_batched, cost_breakdown, solve_design_point, solve_pumps_required
+
+# How much head the building needs for every total flow (its system curve) doesn't depend on the pumps at all, only on
+# the diameters. So it gets worked out once per set of diameters, as a table: the flow out of every fixture at a range
+# of heads, solved with the heads held fixed (a "pump" with a flat curve, see batch.solve_operating_points).
+# Any pump, any number in series or parallel, then just needs the point where its curve crosses the table, which is a
+# 1-D root find on a smooth interpolation (monotone cubic through the log of every fixture's flow against the log of
+# the head above STATIC_HEAD, where everything is nearly a straight line).
+# Every stretch of table is also solved exactly halfway along, and how far the interpolation is off there is kept as
+# its error (and the stretch split in two if that's too far), so there's always a measure of how much to trust it.
+# Nothing in optimize_everything.py uses this: for one pump type and number in series per option, solving every
+# operating point in full (compute_costs_batched) is still quicker than building the tables.
+
+# Heads to tabulate, as multiples of the design point's head above STATIC_HEAD. 1 is the design point itself, which is
+# already solved, and everything else is reached from the point next to it.
+GRID = 2. ** np.arange(-1, 6.75, 0.25)
+
+# How close (gal/min) the interpolation has to come to an exact solve, and how many times a stretch of table can get
+# split in half to get there. Where a pipe's flow goes between laminar and turbulent the curve has a kink in it, and
+# those are the stretches that need splitting (and the ones that may never get there).
+TOLERANCE = 1e-4
+ROUNDS = 8
+
+
+def fixed_head_solve(guess, d, heads):
+    """Fixture flows with the head at the pumps held at heads (ft), for every row at once, starting from guess.
+    Returns the flows and which rows actually got there (every residual within 1e-6 ft, every flow positive)."""
+    n = len(heads)
+    shutoff, flat = np.asarray(heads, dtype=float), np.zeros(n)
+    flows, _, _ = batch.solve_operating_points(guess, d, (shutoff, flat), np.ones(n), max_iterations=100)
+    residuals = batch.residuals(flows, np.asarray(d, dtype=float), shutoff, flat, np.ones(n))
+    return flows, (np.abs(residuals).max(axis=1) <= 1e-6) & (flows > 0).all(axis=1)
+
+
+class SystemCurve:
+    """Tabulated system curve of one set of diameters: fixture flows (gal/min, (points, 12)) at heads (ft)"""
+
+    def __init__(self, d, heads, flows):
+        self.d = d
+        self.heads = np.asarray(heads, dtype=float)
+        self.flows = np.asarray(flows, dtype=float)
+        # Largest difference (gal/min, any fixture) between the interpolation and an exact solve halfway along each
+        # stretch between two points. NaN until it's been checked (see refine), inf if the exact solve didn't converge.
+        self.errors = np.full(len(self.heads) - 1, np.nan)
+        self.interpolate()
+
+    def interpolate(self):
+        # scipy.interpolate takes most of a second to import, so only importing this module doesn't
+        from scipy.interpolate import PchipInterpolator
+        self.log_flows = PchipInterpolator(np.log(self.heads - batch.STATIC_HEAD), np.log(self.flows), axis=0)
+
+    def insert(self, head, flows):
+        """Adds an exactly solved point (inside the table), leaving the stretches it changes the interpolation of to be
+        checked again"""
+        i = int(np.searchsorted(self.heads, head))
+        self.heads = np.insert(self.heads, i, head)
+        self.flows = np.insert(self.flows, i, flows, axis=0)
+        self.errors = np.insert(self.errors, i - 1, np.nan)
+        self.errors[max(i - 2, 0):i + 2] = np.nan
+
+    def error(self):
+        return self.errors.max() if len(self.errors) else 0.
+
+    def flows_at(self, head):
+        """Interpolated flow out of every fixture with head (ft) at the pumps"""
+        return np.exp(self.log_flows(np.log(head - batch.STATIC_HEAD)))
+
+    def stretch(self, head):
+        """Index of the stretch of table head (ft) is on"""
+        return min(max(int(np.searchsorted(self.heads, head)) - 1, 0), len(self.errors) - 1)
+
+    def meeting_head(self, pump, series, parallel=1):
+        """Head (ft) where series x parallel pumps of that type (see pumps.CATALOGUE) meet the system curve, or None if
+        that's off the end of the table"""
+        from scipy.optimize import brentq
+
+        def mismatch(log_excess):
+            head = batch.STATIC_HEAD + np.exp(log_excess)
+            total = self.flows_at(head).sum()
+            return head - series * float(pumps.head(pump, total / parallel))
+
+        low, high = np.log(self.heads[[0, -1]] - batch.STATIC_HEAD)
+        if mismatch(low) > 0 or mismatch(high) < 0:
+            return None
+        return batch.STATIC_HEAD + np.exp(brentq(mismatch, low, high, xtol=1e-14))
+
+    def operating_point(self, pump, series, parallel=1):
+        """Fixture flows where series x parallel pumps of that type meet the system curve (see meeting_head), and the
+        error of the stretch of table it's on. None if that's off the end of the table. Like
+        solver_functions.head_losses, the default of one in parallel is how the rest of the solvers count pumps
+        (they don't split the flow between pumps in parallel)."""
+        head = self.meeting_head(pump, series, parallel)
+        if head is None:
+            return None
+        return self.flows_at(head), self.errors[self.stretch(head)]
+
+
+def tabulate(sets, tolerance=TOLERANCE, wanted=None):
+    """System curves for every set of diameters in sets (lists of five), keyed by tuple of diameters, refined down to
+    tolerance (see refine). Sets whose design point doesn't work out (or that don't get a point either side of it) get
+    None. All the sets are stepped along GRID together, one batched solve per step.
+    wanted optionally gives the only (pump, number in series) each set's curve is going to be used for, as a dict keyed
+    by tuple of diameters. Those pumps were sized to at least get to the design point, so they never meet the curve
+    below it, or above their shutoff head. Each curve then only goes from the design point to the first point past the
+    highest of those, and only the stretches they meet it on get refined."""
+    sets = [list(d) for d in sets]
+    design = [solve_design_point(d, True) for d in sets]
+    keep = [i for i, point in enumerate(design) if point is not None]
+    curves = {tuple(d): None for d in sets}
+    if not keep:
+        return curves
+
+    d = [sets[i] for i in keep]
+    design_flows = np.array([list(design[i][0]) + design[i][1] for i in keep])
+    design_excess = np.array([ff.head_in_ft(design[i][3]) for i in keep]) - batch.STATIC_HEAD
+
+    highest = np.full(len(keep), np.inf)
+    if wanted is not None:
+        highest = np.array([max(series * pumps.CATALOGUE[pump].shutoff for pump, series in wanted[tuple(sets[i])])
+                            for i in keep])
+
+    # Walk up from the design point, then down, each step starting from the last one's flows (scaled for the head).
+    # A set stops going in a direction as soon as one step doesn't converge, or going up once it's past highest.
+    start = int(np.flatnonzero(GRID == 1)[0])
+    flows = np.full((len(GRID), len(keep), network.NUMBER_OF_FIXTURES), np.nan)
+    flows[start] = design_flows
+    for direction in (1, -1) if wanted is None else (1,):
+        going = np.ones(len(keep), dtype=bool)
+        for i in range(start + direction, len(GRID) if direction == 1 else -1, direction):
+            rows = np.flatnonzero(going)
+            if not len(rows):
+                break
+            guess = flows[i - direction][rows] * np.sqrt(GRID[i] / GRID[i - direction])
+            solved, ok = fixed_head_solve(guess, [d[j] for j in rows], batch.STATIC_HEAD + GRID[i] * design_excess[rows])
+            flows[i][rows[ok]] = solved[ok]
+            going[rows[~ok]] = False
+            going[rows[batch.STATIC_HEAD + GRID[i] * design_excess[rows] >= highest[rows]]] = False
+
+    for j, i in enumerate(keep):
+        solved = ~np.isnan(flows[:, j, 0])
+        if solved.sum() < 2:
+            continue
+        curves[tuple(sets[i])] = SystemCurve(sets[i], batch.STATIC_HEAD + GRID[solved] * design_excess[j], flows[solved, j])
+
+    refine([curve for curve in curves.values() if curve is not None], tolerance, wanted=wanted)
+    return curves
+
+
+def unchecked(curve, wanted=None):
+    """Indices of the stretches of curve that haven't been checked yet. Just the ones the (pump, number in series) in
+    wanted meet the curve on, if given."""
+    if wanted is None:
+        return np.flatnonzero(np.isnan(curve.errors))
+    stretches = {curve.stretch(head) for head in (curve.meeting_head(pump, series) for pump, series in wanted)
+                 if head is not None}
+    return sorted(i for i in stretches if np.isnan(curve.errors[i]))
+
+
+def refine(curves, tolerance=TOLERANCE, rounds=ROUNDS, wanted=None):
+    """Checks every stretch of every curve that hasn't been yet: solves exactly halfway along it (in log head), starting
+    from the interpolation, and keeps how far off that was as its error. Wherever that's more than tolerance (gal/min),
+    the exact point goes into the table and the stretches either side get checked again, up to rounds times (only where
+    every fixture gets to 1 gpm by the top of the stretch). With wanted (see tabulate), only the stretches those pumps
+    meet the curves on get checked.
+    Anything still unchecked after that counts as inf. All the curves' checks are one batched solve per round."""
+    # Only curves that got new points last round have anything left to check
+    changed = curves
+    for _ in range(rounds):
+        stretches = [(curve, i) for curve in changed
+                     for i in unchecked(curve, None if wanted is None else wanted[tuple(curve.d)])]
+        if not stretches:
+            break
+        excess = np.array([curve.heads[i:i + 2] - batch.STATIC_HEAD for curve, i in stretches])
+        heads = batch.STATIC_HEAD + np.sqrt(excess[:, 0] * excess[:, 1])
+        guesses = np.array([curve.flows_at(head) for (curve, _), head in zip(stretches, heads)])
+        solved, ok = fixed_head_solve(guesses, [curve.d for curve, _ in stretches], heads)
+        errors = np.where(ok, np.abs(solved - guesses).max(axis=1), np.inf)
+
+        for (curve, i), error in zip(stretches, errors):
+            curve.errors[i] = error
+        # Going through each curve's new points from the top down keeps the indices of the ones below it right
+        # Stretches with a fixture below 1 gpm all along never have an operating point taken off them, so they don't
+        # get split (that's where the laminar-turbulent kinks are too)
+        usable = np.array([curve.flows[i + 1].min() >= 1 for curve, i in stretches])
+        split = sorted(np.flatnonzero(ok & usable & (errors > tolerance)), key=lambda k: -heads[k])
+        for k in split:
+            stretches[k][0].insert(heads[k], solved[k])
+        changed = list({id(stretches[k][0]): stretches[k][0] for k in split}.values())
+        for curve in changed:
+            curve.interpolate()
+
+    for curve in curves:
+        curve.errors[np.isnan(curve.errors)] = np.inf
+
+
+def compute_costs_tabulated(params, cache=None, tolerance=TOLERANCE):
+    """Same as solver_functions.compute_costs_batched, except every operating point comes off its diameters' system
+    curve (see tabulate) instead of being solved. Any option whose operating point is off the end of its table, on a
+    stretch of it that's off by more than tolerance (gal/min), or has a fixture below 1 gpm there, gets solved by
+    compute_costs_batched instead.
+    Results only go through cache at the default tolerance, since they depend on it."""
+    if tolerance != TOLERANCE:
+        cache = None
+    results = [None] * len(params)
+    if cache is not None:
+        results = [cache.get(param, "tabulated") for param in params]
+    todo = [i for i, result in enumerate(results) if result is None]
+
+    # Only the curves of sets of diameters some pump can be sized for get tabulated, and only as far as those need
+    leftover, wanted, sized = [], {}, {}
+    for i in todo:
+        d, pump = params[i][0:5], params[i][5]
+        no_pumps = solve_pumps_required(d, pump, True)
+        if no_pumps[0] == 1e3:
+            results[i] = cost_breakdown(d, pump, [1e3 for _ in range(12)], no_pumps, True)
+            continue
+        sized[i] = no_pumps
+        wanted.setdefault(tuple(d), []).append((pump, no_pumps[0]))
+    curves = tabulate(list(wanted), tolerance, wanted)
+
+    for i, no_pumps in sized.items():
+        d, pump = params[i][0:5], params[i][5]
+        curve = curves[tuple(d)]
+        point = None if curve is None else curve.operating_point(pump, no_pumps[0])
+        if point is None or point[1] > tolerance or point[0].min() < 1:
+            leftover.append(i)
+            continue
+        results[i] = cost_breakdown(d, pump, [float(flow) for flow in point[0]], no_pumps, True)
+
+    if leftover:
+        for i, result in zip(leftover, compute_costs_batched([params[i] for i in leftover])):
+            results[i] = result
+
+    if cache is not None:
+        for i in todo:
+            cache.put(params[i], "tabulated", results[i])
+    return results
+
+
+if __name__ == "__main__":
+    import time
+    from solver_functions import build_parameter_array, reset_warm_starts
+
+    params = build_parameter_array()
+    sets = list({tuple(param[0:5]): None for param in params})
+
+    # Loading scipy (see SystemCurve.interpolate) isn't part of building the tables
+    import scipy.interpolate
+    import scipy.optimize
+    solve_design_point(list(sets[0]), True)
+    reset_warm_starts()
+    start = time.perf_counter()
+    curves = tabulate(sets)
+    tabulated = time.perf_counter() - start
+    usable = [curve for curve in curves.values() if curve is not None]
+    errors = np.concatenate([curve.errors for curve in usable])
+    print(f"{len(usable)} system curves, {np.mean([len(curve.heads) for curve in usable]):.1f} points each, "
+          f"in {tabulated:.2f} s. {np.mean(errors <= TOLERANCE):.1%} of stretches within {TOLERANCE:.0e} gal/min "
+          f"of an exact solve, {np.isinf(errors).sum()} that couldn't be checked")
+
+    # Against solving every option's operating point in full
+    reset_warm_starts()
+    start = time.perf_counter()
+    full = compute_costs_batched(params)
+    full_time = time.perf_counter() - start
+    reset_warm_starts()
+    start = time.perf_counter()
+    table = compute_costs_tabulated(params)
+    table_time = time.perf_counter() - start
+    both = [(a, b) for a, b in zip(full, table) if a[2][0] != 1e3 and b[2][0] != 1e3]
+    print(f"Full solve {full_time:.2f} s, from the tables {table_time:.2f} s. "
+          f"{sum(a[2][0] != 1e3 for a in full)} and {sum(b[2][0] != 1e3 for b in table)} options converged, "
+          f"{len(both)} both ways. Largest difference in flow "
+          f"{max(np.abs(np.array(a[5]) - b[5]).max() for a, b in both):.1e} gal/min, "
+          f"in monthly cost ${max(abs(a[4] - b[4]) for a, b in both):.1e}")
+
+    # Once the tables are there, every pump in the catalogue at every number in series is nearly free
+    start = time.perf_counter()
+    points = [curve.operating_point(pump, series) for curve in usable for pump in pumps.CATALOGUE
+              for series in range(1, 11)]
+    trusted = sum(point is not None and point[1] <= TOLERANCE for point in points)
+    print(f"{len(points)} more operating points (every pump, 1 to 10 in series) in {time.perf_counter() - start:.2f} s, "
+          f"{trusted} of them on the table and within tolerance")
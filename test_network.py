@@ -0,0 +1,54 @@
+import json
+import os
+from functools import cache
+import pytest
+import float_functions as ff
+import network
+from benchmark import check_answers, same_results
+from solver_functions import build_parameter_array, compute_cost_with_specifications, reset_warm_starts, sweep_order
+
+# Both kernels (floats and units) against each other and against the answers in REFERENCE, option by option.
+# REFERENCE is pinned: unlike raw_data.json, no run overwrites it, so any option that comes out differently (numbers,
+# pump counts, or whether it converges at all) fails here. If a change is supposed to change the answers, check them
+# and run this file (python test_network.py) to write REFERENCE again.
+
+REFERENCE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "expected_results.json")
+
+
+@cache
+def sweep(fast):
+    """Every option solved like optimize_everything.py does it (in sweep order, warm starts and all), in the order of
+    build_parameter_array"""
+    reset_warm_starts()
+    params = build_parameter_array()
+    results = [None] * len(params)
+    for i in sweep_order(params):
+        results[i] = compute_cost_with_specifications(params[i], fast=fast)
+    return results
+
+
+def test_constants_match_background_functions():
+    ff.check_units()
+
+
+def test_pipe_table_matches_hl_functions():
+    assert network.table_error() < 1e-9
+
+
+@pytest.mark.parametrize("fast", [True, False], ids=["floats", "units"])
+def test_sweep_matches_reference(fast):
+    counts = check_answers(sweep(fast), REFERENCE)
+    assert counts["same"] == len(sweep(fast)), counts
+
+
+def test_kernels_agree():
+    converged = [[result[2][0] != 1e3 for result in sweep(fast)] for fast in [True, False]]
+    assert converged[0] == converged[1]
+    both = [i for i, ok in enumerate(converged[0]) if ok]
+    assert same_results([sweep(True)[i] for i in both], [sweep(False)[i] for i in both])
+
+
+if __name__ == "__main__":
+    with open(REFERENCE, "w") as file:
+        json.dump(sweep(True), file)
+    print(f"Wrote {REFERENCE}, {sum(result[2][0] != 1e3 for result in sweep(True))} options converged")